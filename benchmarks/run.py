@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+"""
+billow benchmarks
+
+Runs against billow.sim on a virtual clock, no AWS account or network
+needed.  Each benchmark runs in its own process so peak memory is its own,
+and the results are written as JSON:
+
+    python benchmarks/run.py                      # all, small fleet
+    python benchmarks/run.py --scale large -o results.json
+    python benchmarks/run.py rotate endpoint      # selected benchmarks
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Fleet sizes per scale
+SCALES = {
+    'small': {
+        'regions': 2,
+        'services': 100,
+        'groups': 2,
+        'instances': 4,
+        'large_groups': 10,
+        'large_instances': 20,
+        'rotate_groups': 5,
+        'rotate_instances': 20,
+        'zone_records': 5000,
+    },
+    'large': {
+        'regions': 4,
+        'services': 2500,
+        'groups': 4,
+        'instances': 10,
+        'large_groups': 20,
+        'large_instances': 50,
+        'rotate_groups': 10,
+        'rotate_instances': 50,
+        'zone_records': 50000,
+    },
+}
+
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'ap-southeast-1',
+           'ap-northeast-1', 'sa-east-1', 'eu-central-1', 'us-west-1']
+
+SCRIPTS = ['billow_list', 'billow_get', 'billow_find_configs',
+           'billow_list_configs', 'billow_find_images', 'billow_list_images',
+           'billow_list_rotate', 'billow_rotate', 'billow_rotate_info',
+           'billow_rotate_deregister', 'billow_rotate_instance',
+           'billow_rotate_register', 'billow_rotate_status',
+           'billow_rotate_terminate']
+
+
+class fleet(object):
+
+    """
+    A simulated account on a virtual clock, installed for the benchmark
+    """
+
+    def __init__(self, args, **kw):
+        from billow import clock, sim, stats
+        self.clock = clock.virtualclock()
+        self.sim = sim.simulator(clock=self.clock, latency=args.latency,
+                                 seed=1)
+        self.sim.generate(**kw)
+        sim.install(self.sim)
+        stats.reset()
+        self.start = self.clock.time()
+
+    def result(self):
+        from billow import stats
+        totals = stats.totals()
+        return {
+            'aws_calls': totals['calls'],
+            'aws_pages': totals['pages'],
+            'aws_coalesced': totals['coalesced'],
+            'virtual_time': round(self.clock.time() - self.start, 3),
+        }
+
+
+def large_service(args, scale):
+    from billow.billowCloud import billowCloud
+    f = fleet(args, regions=[REGIONS[0]], services=1,
+              groups=scale['large_groups'], instances=scale['large_instances'])
+    return f, billowCloud(regions=[REGIONS[0]]).get_service('svc0000')[0]
+
+
+def rotate_service(args, scale):
+    from billow.billowCloud import billowCloud
+    from billow.billowRotate import billowRotate
+    f = fleet(args, regions=[REGIONS[0]], services=1,
+              groups=scale['rotate_groups'],
+              instances=scale['rotate_instances'])
+    svc = billowCloud(regions=[REGIONS[0]]).get_service('svc0000')[0]
+    r = billowRotate(svc, clock=f.clock)
+    r.set_logger(lambda msg: None)
+    return f, r
+
+
+def bench_list_services(args, scale):
+    from billow.billowCloud import billowCloud
+    regions = REGIONS[:scale['regions']]
+    f = fleet(args, regions=regions, services=scale['services'],
+              groups=scale['groups'], instances=scale['instances'])
+    start = time.time()
+    services = billowCloud(regions=regions).list_services()
+    out = {'wall': time.time() - start, 'services': len(services)}
+    out.update(f.result())
+    return out
+
+
+def region_info(args, scale, snapshot):
+    from billow.billowCloud import billowCloud
+    f = fleet(args, regions=[REGIONS[0]], services=scale['services'],
+              groups=scale['groups'], instances=scale['instances'])
+    start = time.time()
+    services = billowCloud(regions=[REGIONS[0]],
+                           snapshot=snapshot).list_services()
+    for s in services:
+        s.info()
+    out = {'wall': time.time() - start, 'services': len(services)}
+    out.update(f.result())
+    return out
+
+
+def bench_region_info(args, scale):
+    return region_info(args, scale, False)
+
+
+def bench_region_snapshot(args, scale):
+    return region_info(args, scale, True)
+
+
+def bench_service_config(args, scale):
+    f, svc = large_service(args, scale)
+    start = time.time()
+    svc.config()
+    out = {'wall': time.time() - start}
+    out.update(f.result())
+    return out
+
+
+def bench_service_info(args, scale):
+    f, svc = large_service(args, scale)
+    start = time.time()
+    svc.info()
+    out = {'wall': time.time() - start}
+    out.update(f.result())
+    return out
+
+
+def bench_rotate_order(args, scale):
+    f, r = rotate_service(args, scale)
+    start = time.time()
+    order = r.order()
+    out = {'wall': time.time() - start, 'instances': len(order)}
+    out.update(f.result())
+    return out
+
+
+def bench_rotate_safety(args, scale):
+    f, r = rotate_service(args, scale)
+    start = time.time()
+    warnings = r.safety()
+    out = {'wall': time.time() - start, 'warnings': len(warnings)}
+    out.update(f.result())
+    return out
+
+
+def bench_rotate(args, scale):
+    f, r = rotate_service(args, scale)
+    start = time.time()
+    ok = r.rotate()
+    out = {
+        'wall': time.time() - start,
+        'success': ok,
+        'instances': scale['rotate_groups'] * scale['rotate_instances']
+    }
+    out.update(f.result())
+    return out
+
+
+def bench_rotate_batch(args, scale):
+    f, r = rotate_service(args, scale)
+    start = time.time()
+    ok = r.rotate(batch_percent=25)
+    out = {
+        'wall': time.time() - start,
+        'success': ok,
+        'instances': scale['rotate_groups'] * scale['rotate_instances']
+    }
+    out.update(f.result())
+    return out
+
+
+def bench_rotate_parallel(args, scale):
+    f, r = rotate_service(args, scale)
+    start = time.time()
+    ok = r.rotate(max_unavailable=2)
+    out = {
+        'wall': time.time() - start,
+        'success': ok,
+        'instances': scale['rotate_groups'] * scale['rotate_instances']
+    }
+    out.update(f.result())
+    return out
+
+
+def bench_endpoint(args, scale):
+    from billow.billowEndpoint import billowEndpoint
+    f = fleet(args, regions=[REGIONS[0]], services=scale['services'],
+              groups=1, instances=1, zone='example.com',
+              zone_records=scale['zone_records'])
+    start = time.time()
+    e = billowEndpoint('example.com', REGIONS[0])
+    e.find_destination('svc0000-prod-0.%s.elb.amazonaws.com' % REGIONS[0])
+    out = {'wall': time.time() - start, 'records': scale['zone_records'],
+           'destinations': len(e.reverse)}
+    out.update(f.result())
+    return out
+
+
+def bench_cli_startup(args, scale):
+    """
+    time from exec to --help output for every console script
+    """
+    scripts = dict()
+    for script in SCRIPTS:
+        code = 'import sys; sys.argv = [%r, "--help"]; ' \
+            'from billow.cli import %s; %s()' % (
+                script.replace('_', '-'), script, script)
+        runs = list()
+        for n in range(args.repeat):
+            start = time.time()
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call([sys.executable, '-c', code], cwd=ROOT,
+                                stdout=devnull)
+            runs.append(time.time() - start)
+        scripts[script.replace('_', '-')] = round(min(runs), 6)
+    return {'wall': sum(scripts.values()), 'scripts': scripts}
+
+
+# Commands and arguments checked by cli_imports
+IMPORT_COMMANDS = [
+    ('billow_list', []),
+    ('billow_get', ['svc0000-prod']),
+    ('billow_get', ['-y', 'svc0000-prod']),
+    ('billow_list_configs', ['prod-svc0000-*']),
+    ('billow_find_images', ['svc0000-prod']),
+    ('billow_list_rotate', ['svc0000-prod']),
+]
+
+# Modules a command must not load, by full name or package prefix
+IMPORT_FORBIDDEN = {
+    'billow-list': ['yaml', 'boto.route53', 'boto.sts'],
+}
+
+# Records a command's AWS calls against a small simulated fleet
+IMPORT_RECORD = """
+import sys
+from billow import clock, sim
+s = sim.simulator(clock=clock.virtualclock(), seed=1)
+s.generate(regions=['us-east-1'], services=1, groups=1, instances=2)
+sim.install(s)
+sys.argv = [%r, '--record', %r] + %r
+from billow import cli
+try:
+    cli.%s()
+except SystemExit:
+    pass
+"""
+
+# Replays them in a process without billow.sim, which loads boto's models
+# for its own responses, so only what the command loads is counted
+IMPORT_CHILD = """
+import json, sys
+before = set(m for m in sys.modules if sys.modules[m])
+sys.argv = [%r, '--replay', %r] + %r
+from billow import cli
+try:
+    cli.%s()
+except SystemExit:
+    pass
+from billow import aws
+loaded = set(m for m in sys.modules if sys.modules[m]) - before
+sys.stderr.write(json.dumps({
+    'modules': len(loaded),
+    'billow': sorted(m for m in loaded if m.startswith('billow.')),
+    'boto': sorted(m for m in loaded
+                   if m == 'boto' or m.startswith('boto.')),
+    'other': sorted(m for m in loaded if '.' not in m),
+    'services': sorted(set(k[0] for k in aws.connections)),
+}))
+"""
+
+
+def forbidden(name, modules):
+    """
+    modules name loaded that IMPORT_FORBIDDEN rules out
+    """
+    found = list()
+    for prefix in IMPORT_FORBIDDEN.get(name, []):
+        for m in modules:
+            if m == prefix or m.startswith(prefix + '.'):
+                found.append(m)
+    return sorted(found)
+
+
+def bench_cli_imports(args, scale):
+    """
+    modules each command loads and AWS services it connects to, replaying
+    calls recorded on a small simulated fleet
+    """
+    start = time.time()
+    commands = dict()
+    ok = True
+    # replay connects without calling AWS, boto still wants credentials
+    env = dict(os.environ, AWS_ACCESS_KEY_ID='replay',
+               AWS_SECRET_ACCESS_KEY='replay')
+    tmp = tempfile.mkdtemp(prefix='billow-imports-')
+    try:
+        for n, (script, argv) in enumerate(IMPORT_COMMANDS):
+            prog = script.replace('_', '-')
+            name = ' '.join([prog] + argv)
+            path = os.path.join(tmp, '%d.cassette' % n)
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call([sys.executable, '-c', IMPORT_RECORD % (
+                                    prog, path, argv, script)],
+                                cwd=ROOT, stdout=devnull, stderr=devnull)
+                p = subprocess.Popen([sys.executable, '-c', IMPORT_CHILD % (
+                                        prog, path, argv, script)],
+                                     cwd=ROOT, env=env, stdout=devnull,
+                                     stderr=subprocess.PIPE)
+                err = p.communicate()[1]
+            commands[name] = json.loads(err.splitlines()[-1])
+            bad = forbidden(prog, commands[name]['boto'] +
+                            commands[name]['other'])
+            if bad:
+                commands[name]['forbidden'] = bad
+                ok = False
+    finally:
+        shutil.rmtree(tmp)
+    return {'wall': time.time() - start, 'commands': commands,
+            'success': ok}
+
+
+benchmarks = [
+    ('list_services', bench_list_services),
+    ('region_info', bench_region_info),
+    ('region_snapshot', bench_region_snapshot),
+    ('service_config', bench_service_config),
+    ('service_info', bench_service_info),
+    ('rotate_order', bench_rotate_order),
+    ('rotate_safety', bench_rotate_safety),
+    ('rotate', bench_rotate),
+    ('rotate_batch', bench_rotate_batch),
+    ('rotate_parallel', bench_rotate_parallel),
+    ('endpoint', bench_endpoint),
+    ('cli_startup', bench_cli_startup),
+    ('cli_imports', bench_cli_imports),
+]
+
+
+def child(args):
+    """
+    run one benchmark in this process and print its result
+    """
+    func = dict(benchmarks)[args.child]
+    out = func(args, SCALES[args.scale])
+    out['wall'] = round(out['wall'], 6)
+    out['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    json.dump(out, sys.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='billow benchmarks against a simulated backend',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        'benchmarks',
+        nargs='*',
+        help='benchmarks to run, default all: %s'
+        % ', '.join(n for n, f in benchmarks)
+    )
+    parser.add_argument(
+        '-s',
+        '--scale',
+        choices=sorted(SCALES),
+        default='small',
+        help='fleet size'
+    )
+    parser.add_argument(
+        '-l',
+        '--latency',
+        type=float,
+        default=0,
+        help='simulated seconds per AWS call, virtual time'
+    )
+    parser.add_argument(
+        '-n',
+        '--repeat',
+        type=int,
+        default=3,
+        help='runs per benchmark, the fastest is reported'
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='write JSON results to a file instead of stdout'
+    )
+    parser.add_argument(
+        '--child',
+        help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    names = args.benchmarks or [n for n, f in benchmarks]
+    for n in names:
+        if n not in dict(benchmarks):
+            parser.error('unknown benchmark %s' % n)
+
+    from billow import __version__
+    results = dict()
+    for n in names:
+        runs = list()
+        # cli_startup repeats internally, cli_imports does not vary
+        repeat = 1 if n in ('cli_startup', 'cli_imports') else args.repeat
+        for r in range(repeat):
+            cmd = [sys.executable, os.path.abspath(__file__), '--child', n,
+                   '--scale', args.scale, '--latency', str(args.latency),
+                   '--repeat', str(args.repeat)]
+            runs.append(json.loads(subprocess.check_output(cmd)))
+        best = min(runs, key=lambda x: x['wall'])
+        best['peak_rss_kb'] = max(x['peak_rss_kb'] for x in runs)
+        results[n] = best
+        sys.stderr.write('%-16s %10.3fs\n' % (n, best['wall']))
+
+    report = {
+        'billow': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': int(time.time()),
+        'scale': args.scale,
+        'latency': args.latency,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4, separators=(',', ': '),
+                      sort_keys=True)
+            f.write('\n')
+    else:
+        print json.dumps(report, indent=4, separators=(',', ': '),
+                         sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
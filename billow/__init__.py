@@ -1,7 +1,10 @@
 """
 a large undulating mass of cloud services
+
+Nothing is imported here, so tools load only the modules they use:
+
+    from billow.billowCloud import billowCloud
 """
-import billow
 
 __version_info__ = ('0', '0', '1')
 __version__ = '.'.join(__version_info__)
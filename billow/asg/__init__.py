@@ -4,8 +4,7 @@ billow AutoScaleGroup API
 import billow
 from billow import aws
 import boto
-import boto.ec2
-import boto.ec2.autoscale
+from boto.exception import BotoServerError
 import time
 import fnmatch
 import re
@@ -15,28 +14,26 @@ class asg(object):
 
     def __init__(self, region):
         self.region = region
-        self.aws = aws.aws()
+        self.aws = aws.aws(region=self.region)
         self.asg = None
         self.ec2 = None
         self.cachetime = 60
+
+        # API limits on the number of ids per request
+        self.chunk_groups = 50
+        self.chunk_configs = 50
+        self.chunk_instances = 100
+        self.chunk_status = 100
         self.__lc_find_cache_time = time.time()
         self.__lc_find_cache = None
 
     def __connect(self):
         if not self.asg:
-            self.asg = boto.ec2.autoscale.connect_to_region(
-                self.region,
-                aws_access_key_id=self.aws.access_key(),
-                aws_secret_access_key=self.aws.secret_key()
-            )
+            self.asg = self.aws.connect('autoscale')
 
     def __connect_ec2(self):
         if not self.ec2:
-            self.ec2 = boto.ec2.connect_to_region(
-                self.region,
-                aws_access_key_id=self.aws.access_key(),
-                aws_secret_access_key=self.aws.secret_key()
-            )
+            self.ec2 = self.aws.connect('ec2')
 
     def list_groups(self):
         """
@@ -112,17 +109,45 @@ class asg(object):
 
         return self.lcs
 
+    def list_instances(self):
+        """
+        list all AutoScaleGroup Instances in a region
+        """
+        instances = list()
+        marker = None
+        self.__connect_ec2()
+
+        while True:
+            reservations = self.aws.wrap(
+                self.ec2.get_all_reservations,
+                filters={'tag-key': 'aws:autoscaling:groupName'},
+                next_token=marker
+            )
+            for r in reservations:
+                for i in r.instances:
+                    instances.append(i)
+            if reservations.next_token:
+                marker = reservations.next_token
+            else:
+                break
+
+        return instances
+
     def get_groups(self, groups):
         """
         get AutoScaleGroup in a region
         """
-        asgs = list()
-        marker = None
         self.__connect()
 
         if not isinstance(groups, list):
             groups = [groups]
 
+        return self.aws.chunked(self.__get_groups, groups, self.chunk_groups)
+
+    def __get_groups(self, groups):
+        asgs = list()
+        marker = None
+
         while True:
             a = self.aws.wrap(
                 self.asg.get_all_groups,
@@ -141,13 +166,18 @@ class asg(object):
         """
         get LaunchConfigurations in a region
         """
-        configs = list()
-        marker = None
         self.__connect()
 
         if not isinstance(names, list):
             names = [names]
 
+        return self.aws.chunked(self.__get_configs, names,
+                                self.chunk_configs)
+
+    def __get_configs(self, names):
+        configs = list()
+        marker = None
+
         while True:
             a = self.aws.wrap(
                 self.asg.get_all_launch_configurations,
@@ -166,13 +196,18 @@ class asg(object):
         """
         get Instances in a region
         """
-        instances = list()
-        marker = None
         self.__connect_ec2()
 
         if not isinstance(instance_ids, list):
             instance_ids = [instance_ids]
 
+        return self.aws.chunked(self.__get_instance, instance_ids,
+                                self.chunk_instances)
+
+    def __get_instance(self, instance_ids):
+        instances = list()
+        marker = None
+
         while True:
             #
             # Use get_all_reservations() since get_only_instances does not
@@ -203,13 +238,21 @@ class asg(object):
         """
         get Instance Status' in a region
         """
-        statuses = list()
-        marker = None
         self.__connect_ec2()
 
         if not isinstance(instance_ids, list):
             instance_ids = [instance_ids]
 
+        return self.aws.chunked(
+            lambda ids: self.__get_instance_status(ids, filters),
+            instance_ids,
+            self.chunk_status
+        )
+
+    def __get_instance_status(self, instance_ids, filters):
+        statuses = list()
+        marker = None
+
         while True:
             s = self.aws.wrap(
                 self.ec2.get_all_instance_status,
@@ -320,6 +363,7 @@ class asg(object):
         """
         Terminate instance within an asg object
         """
+        self.__connect()
 
         ret = self.aws.wrap(
             self.asg.terminate_instance,
@@ -333,6 +377,7 @@ class asg(object):
         """
         Set Desired Capacity for an AutoScaleGroup
         """
+        self.__connect()
 
         ret = self.aws.wrap(
             self.asg.set_desired_capacity,
@@ -347,6 +392,7 @@ class asg(object):
         """
         Disassociate an address from an instance
         """
+        self.__connect_ec2()
 
         ret = self.aws.wrap(
             self.ec2.disassociate_address,
@@ -360,6 +406,7 @@ class asg(object):
         """
         Associate an address to an instance
         """
+        self.__connect_ec2()
 
         # When using an Allocation ID, make sure to pass None for public_ip
         ret = self.aws.wrap(
@@ -378,6 +425,7 @@ class asg(object):
         """
         UnAssign a private address from an instance
         """
+        self.__connect_ec2()
 
         ret = self.aws.wrap(
             self.ec2.unassign_private_ip_addresses,
@@ -392,6 +440,7 @@ class asg(object):
         """
         Assign a private address to an instance
         """
+        self.__connect_ec2()
 
         ret = self.aws.wrap(
             self.ec2.assign_private_ip_addresses,
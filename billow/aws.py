@@ -5,19 +5,447 @@ except ImportError:
     sys.stderr.write('boto required\n')
     raise
 from boto.exception import BotoServerError
-from distutils.version import LooseVersion
-import time
+from . import cache
+from . import cassette
+from . import clock as clocks
+from . import stats
+import random
+import threading
 import os
 
+#
+# Refill rate (calls/second) and burst size per API family.  Families are
+# named after the endpoint host prefix (ec2.us-east-1.amazonaws.com -> ec2).
+#
+rate_limits = {
+    'default': (10, 20),
+    'autoscaling': (10, 20),
+    'ec2': (20, 100),
+    'elasticloadbalancing': (10, 20),
+    'iam': (5, 10),
+    'route53': (5, 5),
+    'sts': (10, 20),
+}
+
+#
+# Retries earned per successful call, and retries held in reserve, per
+# operation and region.
+#
+retry_budget = (0.1, 10)
+
+# Process-wide limiters and breakers, keyed by (account, region, family)
+limiters = dict()
+limiters_lock = threading.Lock()
+breakers = dict()
+breakers_lock = threading.Lock()
+
+# Process-wide retry budgets, keyed by (account, region, operation)
+budgets = dict()
+budgets_lock = threading.Lock()
+
+# Process-wide boto connections, keyed by (service, region, credentials)
+connections = dict()
+connections_lock = threading.Lock()
+
+# In-flight read calls, keyed by (account, region, operation, arguments)
+inflight = dict()
+inflight_lock = threading.Lock()
+
+# Calls that only read state, and may be shared by identical callers
+read_prefixes = ('get_', 'describe_', 'list_')
+
+# Object serving connections in place of boto, see set_provider
+provider = None
+
+# Clock for rate limiting, retry backoff and call latency, see set_clock
+clock = clocks.default
+
+# Minimum boto versions already checked, every backend asks on creation
+boto_versions = dict()
+
+
+class CircuitOpenError(BotoServerError):
+
+    """
+    Raised without calling AWS while an API family's circuit is open
+    """
+
+    def __init__(self, family, region, remaining):
+        BotoServerError.__init__(self, 503, 'Circuit Open')
+        self.error_code = 'CircuitOpen'
+        self.error_message = '%s in %s unavailable, retry in %ds' % (
+            family, region, int(remaining))
+
+    def __str__(self):
+        return 'CircuitOpenError: %s' % self.error_message
+
+
+class limiter(object):
+
+    """
+    Token bucket shared by every call to one API family in one region.
+
+    Callers reserve a token and sleep until it is due, so concurrent callers
+    are spread out at the refill rate instead of bursting together.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.stamp = clock.time()
+        self.lock = threading.Lock()
+
+    def __refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def configure(self, rate, burst):
+        with self.lock:
+            self.__refill(clock.time())
+            self.rate = float(rate)
+            self.burst = float(burst)
+            self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self):
+        """
+        Take a token, return seconds to wait before it may be used
+        """
+        with self.lock:
+            self.__refill(clock.time())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            clock.sleep(wait)
+        return wait
+
+    def penalize(self):
+        """
+        API reported throttling, drop any remaining burst allowance
+        """
+        with self.lock:
+            self.__refill(clock.time())
+            self.tokens = min(self.tokens, 0)
+
+
+class retrybudget(object):
+
+    """
+    Retries allowed to one operation in one region.
+
+    Every successful call earns ratio of a retry and every retry spends one,
+    so retries stay a fraction of recent successful calls however many
+    callers fail at once.  Starts with, and holds at most, reserve retries.
+    """
+
+    def __init__(self, ratio, reserve):
+        self.ratio = float(ratio)
+        self.reserve = float(reserve)
+        self.tokens = self.reserve
+        self.lock = threading.Lock()
+
+    def success(self):
+        with self.lock:
+            # rounded, or ten successes at 0.1 add up to just under a retry
+            self.tokens = min(self.reserve, round(self.tokens + self.ratio, 6))
+
+    def withdraw(self):
+        """
+        Spend a retry, False when none are left
+        """
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class retrypolicy(object):
+
+    """
+    Full-jitter exponential backoff, at most attempts tries per call
+
+    Each retry sleeps a random time between 0 and min(maxdelay, base * 2^n),
+    so concurrent processes throttled together do not retry in lockstep.
+    Retries also come out of the operation's retrybudget.
+    """
+
+    throttle_codes = ('Throttling', 'ThrottlingException',
+                      'RequestLimitExceeded')
+    unavailable_codes = ('ServiceUnavailable', 'Unavailable',
+                         'InternalError', 'InternalFailure')
+
+    def __init__(self, base=1, maxdelay=16, attempts=8):
+        self.base = base
+        self.maxdelay = maxdelay
+        self.attempts = attempts
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.maxdelay,
+                                     self.base * 2 ** (attempt - 1)))
+
+    def throttled(self, e):
+        return e.error_code in self.throttle_codes
+
+    def unavailable(self, e):
+        return e.error_code in self.unavailable_codes
+
+
+class breaker(object):
+
+    """
+    Circuit breaker for one API family in one region.
+
+    Opens after `threshold` consecutive unavailable responses, failing calls
+    fast for `cooldown` seconds.  Afterwards a single call is let through as
+    a probe while the others keep failing fast: its success closes the
+    circuit, its failure re-opens it.
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.probe = None
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """
+        seconds left before calls are allowed again, 0 when closed or when
+        the caller is let through as the half-open probe
+        """
+        with self.lock:
+            if self.opened is None:
+                return 0
+            now = clock.time()
+            left = self.opened + self.cooldown - now
+            if left > 0:
+                return left
+            # a probe that never answers gives up its turn after a cooldown
+            if self.probe is not None and now < self.probe + self.cooldown:
+                return self.probe + self.cooldown - now
+            self.probe = now
+            return 0
+
+    def release(self):
+        """
+        The probe ended without telling whether the API is up
+        """
+        with self.lock:
+            self.probe = None
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.probe = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe = None
+            if self.failures >= self.threshold:
+                self.opened = clock.time()
+
+
+class flight(object):
+
+    """
+    One in-flight AWS call, and the result handed to everyone waiting on it
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def get_breaker(account, region, family):
+    key = (account, region, family)
+    with breakers_lock:
+        if key not in breakers:
+            breakers[key] = breaker()
+        return breakers[key]
+
+
+def get_budget(account, region, operation):
+    key = (account, region, operation)
+    with budgets_lock:
+        if key not in budgets:
+            budgets[key] = retrybudget(*retry_budget)
+        return budgets[key]
+
+
+def get_limiter(account, region, family):
+    key = (account, region, family)
+    with limiters_lock:
+        if key not in limiters:
+            rate, burst = rate_limits.get(family, rate_limits['default'])
+            limiters[key] = limiter(rate, burst)
+        return limiters[key]
+
+
+def set_rate_limit(family, rate, burst=None):
+    """
+    Configure the refill rate (calls/second) and burst size for an API family,
+    updating any limiters already in use
+    """
+    if not burst:
+        burst = max(1, rate)
+    with limiters_lock:
+        rate_limits[family] = (rate, burst)
+        for k, v in limiters.iteritems():
+            if k[2] == family:
+                v.configure(rate, burst)
+
+
+def _connect_autoscale(region, **kw):
+    import boto.ec2.autoscale
+    return boto.ec2.autoscale.connect_to_region(region, **kw)
+
+
+def _connect_ec2(region, **kw):
+    # VPCConnection is an EC2Connection, one connection serves both APIs
+    import boto.vpc
+    return boto.vpc.connect_to_region(region, **kw)
+
+
+def _connect_elb(region, **kw):
+    import boto.ec2.elb
+    return boto.ec2.elb.connect_to_region(region, **kw)
+
+
+def _connect_iam(region, **kw):
+    return boto.connect_iam(**kw)
+
+
+def _connect_route53(region, **kw):
+    return boto.connect_route53(**kw)
+
+
+def _connect_sts(region, **kw):
+    import boto.sts
+    return boto.sts.connect_to_region(region, **kw)
+
+
+connectors = {
+    'autoscale': _connect_autoscale,
+    'ec2': _connect_ec2,
+    'elb': _connect_elb,
+    'iam': _connect_iam,
+    'route53': _connect_route53,
+    'sts': _connect_sts,
+}
+
+# Global services, one connection regardless of region
+global_services = ('iam', 'route53')
+
+
+def set_provider(p):
+    """
+    Serve connections from p.connect(service, region, **credentials) instead
+    of boto, e.g. billow.sim.  None restores boto.  Shared connections are
+    dropped either way.
+    """
+    global provider
+    with connections_lock:
+        provider = p
+        connections.clear()
+
+
+def set_clock(c):
+    """
+    Time calls with c, e.g. a clocks.virtualclock driving billow.sim.  None
+    restores the wall clock.  Limiters, breakers and retry budgets are reset,
+    their state being relative to the previous clock and backend.
+    """
+    global clock
+    clock = c or clocks.default
+    with limiters_lock:
+        limiters.clear()
+    with breakers_lock:
+        breakers.clear()
+    with budgets_lock:
+        budgets.clear()
+
+
+def get_connection(service, region, access_key=None, secret_key=None,
+                   security_token=None):
+    """
+    Return the shared boto connection for a service, region and set of
+    credentials, creating it on first use.  boto keeps HTTP connections alive
+    in a per-connection pool, so sharing the connection object shares the
+    TLS sessions too.
+    """
+    if service not in connectors:
+        raise KeyError('unknown service %s' % service)
+    if service in global_services:
+        region = None
+
+    # Replayed calls never reach AWS, do not go looking for credentials
+    if cassette.active and cassette.active.replaying and not access_key:
+        access_key = secret_key = 'replay'
+
+    key = (service, region, access_key, secret_key, security_token)
+    with connections_lock:
+        if key not in connections:
+            kw = {
+                'aws_access_key_id': access_key,
+                'aws_secret_access_key': secret_key
+            }
+            if security_token:
+                kw['security_token'] = security_token
+            if provider:
+                connections[key] = provider.connect(service, region, **kw)
+            else:
+                connections[key] = connectors[service](region, **kw)
+        return connections[key]
+
+
+def chunks(items, size):
+    """
+    split a list into consecutive lists of at most size items
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def load_rate_limits(spec):
+    """
+    Parse 'family=rate[:burst],...' as found in BILLOW_RATE_LIMITS
+    """
+    for entry in spec.split(','):
+        if '=' not in entry:
+            continue
+        family, limit = entry.split('=', 1)
+        burst = None
+        if ':' in limit:
+            limit, burst = limit.split(':', 1)
+            burst = float(burst)
+        set_rate_limit(family.strip(), float(limit), burst)
+
+
+if 'BILLOW_RATE_LIMITS' in os.environ:
+    load_rate_limits(os.environ['BILLOW_RATE_LIMITS'])
+
 
 class aws(object):
 
-    def __init__(self, delay=0, maxdelay=16):
-        self.rate_limit_delay = delay
-        self.rate_limit_maxdelay = maxdelay
+    def __init__(self, delay=0, maxdelay=16, region='us-east-1', retry=None):
+        if not retry:
+            retry = retrypolicy(base=delay or 1, maxdelay=maxdelay)
+        self.retry = retry
+        # concurrent requests when a call is split into chunks
+        self.concurrency = 4
         # requires unmerged https://github.com/boto/boto/pull/2898
         self.min_boto_version = '2.35.2'
-        self.region = 'us-east-1'
+        self.region = region
 
         if not self.validate_version(self.min_boto_version):
             sys.stderr.write("boto >= %s required\n" %
@@ -38,58 +466,224 @@ class aws(object):
     def secret_key(self):
         return self.aws_secret
 
+    def connect(self, service, access_key=None, secret_key=None,
+                security_token=None):
+        """
+        Shared connection to a service in this region, using the environment
+        credentials unless others are given
+        """
+        if not access_key:
+            access_key = self.aws_access
+            secret_key = self.aws_secret
+        return get_connection(service, self.region, access_key, secret_key,
+                              security_token)
+
     def validate_version(self, version):
-        if LooseVersion(boto.Version) < LooseVersion(version):
-            return False
-        return True
+        if version not in boto_versions:
+            from distutils.version import LooseVersion
+            boto_versions[version] = \
+                LooseVersion(boto.Version) >= LooseVersion(version)
+        return boto_versions[version]
+
+    def endpoint(self, awsfunc):
+        """
+        (account, region, family) an AWS call will be made against, derived
+        from the connection the call is bound to
+        """
+        bound = getattr(awsfunc, '__self__', None)
+        # route53 Zone objects carry their connection
+        conn = getattr(bound, 'route53connection', bound)
+
+        family = 'default'
+        host = getattr(conn, 'host', None)
+        if host:
+            family = host.split('.')[0]
+        elif type(bound).__module__.startswith('boto.route53'):
+            # a Zone replayed from a cassette has lost its connection
+            family = 'route53'
+
+        account = getattr(conn, 'aws_access_key_id', None)
+        if not account:
+            account = self.aws_access
+
+        return (account, self.region, family)
+
+    def chunked(self, func, items, size):
+        """
+        Call func(chunk) for each API-sized chunk of items and return the
+        concatenated results in chunk order.  Chunks run concurrently, each
+        request still taking its turn on the shared rate limiter.
+        """
+        parts = chunks(items, size)
+        if len(parts) <= 1:
+            return func(items)
+
+        from multiprocessing import TimeoutError
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(len(parts), self.concurrency))
+        try:
+            pending = pool.map_async(func, parts)
+            # wait with a timeout, so signals are still handled
+            while True:
+                try:
+                    results = pending.get(1)
+                    break
+                except TimeoutError:
+                    continue
+        except:
+            # Ctrl-C or a failed chunk, do not wait on the chunks still running
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+
+        out = list()
+        for r in results:
+            out.extend(r)
+        return out
+
+    def operation(self, awsfunc, family):
+        """
+        family.method name of an AWS call, e.g. ec2.get_all_reservations
+        """
+        return '%s.%s' % (family, getattr(awsfunc, '__name__', 'unknown'))
+
+    def limiter(self, awsfunc):
+        return get_limiter(*self.endpoint(awsfunc))
 
     def wrap(self, awsfunc, *args, **nargs):
         """
         Wrap AWS call with Rate-Limiting backoff
         Gratefully taken Netflix/security_monkey
+
+        Identical read calls made concurrently from several threads are
+        coalesced: the first caller makes the call and every other caller
+        waits for, and receives, the same result or exception.
+
+        With a cache active, read calls are answered from it while fresh and
+        any other call invalidates it for the region.
+        """
+        name = getattr(awsfunc, '__name__', '')
+        (account, region, family) = self.endpoint(awsfunc)
+        if not name.startswith(read_prefixes):
+            # whatever is cached for this region may be about to change
+            if cache.active:
+                cache.active.invalidate(account, region)
+            return self.__wrap(awsfunc, args, nargs)
+
+        operation = self.operation(awsfunc, family)
+        if cache.active:
+            (hit, response) = cache.active.get(account, region, operation,
+                                               args, nargs)
+            if hit:
+                stats.get(operation, region).hit()
+                return response
+
+        key = (account, region, family, name,
+               id(getattr(awsfunc, '__self__', None)),
+               repr(args), repr(sorted(nargs.items())))
+
+        with inflight_lock:
+            f = inflight.get(key)
+            leader = f is None
+            if leader:
+                f = flight()
+                inflight[key] = f
+
+        if not leader:
+            stats.get(operation, region).coalesce()
+            f.done.wait()
+            if f.error is not None:
+                raise f.error
+            return f.result
+
+        try:
+            f.result = self.__wrap(awsfunc, args, nargs)
+            if cache.active:
+                cache.active.put(account, region, operation, args, nargs,
+                                 f.result)
+        except BaseException as e:
+            # followers must not mistake an interrupted call for a None result
+            f.error = e
+            raise
+        finally:
+            with inflight_lock:
+                del inflight[key]
+            f.done.set()
+
+        return f.result
+
+    def __wrap(self, awsfunc, args, nargs):
+        """
+        Every call first takes a token from the limiter shared by all
+        backends calling the same API family in the same account and region.
+        Throttled and unavailable calls are retried with full-jitter backoff
+        until the attempts or the operation's retry budget run out, and calls
+        fail fast while the API family's circuit breaker is open.
         """
         attempts = 0
+        (account, region, family) = self.endpoint(awsfunc)
+        bucket = get_limiter(account, region, family)
+        circuit = get_breaker(account, region, family)
+        operation = self.operation(awsfunc, family)
+        budget = get_budget(account, region, operation)
+        opstats = stats.get(operation, region)
+        page = bool(nargs.get('next_token') or nargs.get('marker'))
 
         while True:
             attempts = attempts + 1
-            try:
-                if self.rate_limit_delay > 0:
-                    time.sleep(self.rate_limit_delay)
-
-                retval = awsfunc(*args, **nargs)
 
-                if self.rate_limit_delay > 0:
-                    self.rate_limit_delay = self.rate_limit_delay / 2
-
-                return retval
+            remaining = circuit.remaining()
+            if remaining > 0:
+                opstats.error()
+                raise CircuitOpenError(family, region, remaining)
 
+            opstats.wait(bucket.acquire())
+            start = clock.time()
+            try:
+                if cassette.active:
+                    retval = cassette.active.call(awsfunc, region, operation,
+                                                  args, nargs)
+                else:
+                    retval = awsfunc(*args, **nargs)
             except BotoServerError as e:
-                if e.error_code == 'Throttling':
-                    if self.rate_limit_delay == 0:
-                        self.rate_limit_delay = 1
-                        sys.stderr.write('rate-limited: attempt %d\n' %
-                                         attempts)
-                    elif self.rate_limit_delay < self.rate_limit_maxdelay:
-                        self.rate_limit_delay = self.rate_limit_delay * 2
-                        sys.stderr.write('rate-limited: attempt %d\n' %
-                                         attempts)
-                    else:
-                        raise e
-
-                elif e.error_code == 'ServiceUnavailable':
-                    if self.rate_limit_delay == 0:
-                        self.rate_limit_delay = 1
-                        sys.stderr.write('api-unavailable: attempt %d\n' %
-                                         attempts)
-                    elif self.rate_limit_delay < self.rate_limit_maxdelay:
-                        self.rate_limit_delay = self.rate_limit_delay * 2
-                        sys.stderr.write('api-unavailable: attempt %d\n' %
-                                         attempts)
-                    else:
-                        raise e
+                opstats.call(clock.time() - start, page=page)
+                opstats.error(throttled=self.retry.throttled(e))
+                if self.retry.throttled(e):
+                    bucket.penalize()
+                    circuit.release()
+                    reason = 'rate-limited'
+                elif self.retry.unavailable(e):
+                    circuit.failure()
+                    reason = 'api-unavailable'
                 else:
+                    # API answered, it is up even if the request was bad
+                    circuit.success()
+                    raise e
+
+                if attempts >= self.retry.attempts:
+                    raise e
+                if not budget.withdraw():
+                    sys.stderr.write('%s: retry budget of %s spent\n' %
+                                     (reason, operation))
                     raise e
 
+                delay = self.retry.backoff(attempts)
+                sys.stderr.write('%s: attempt %d, retry in %.1fs\n' %
+                                 (reason, attempts, delay))
+                opstats.retry(delay)
+                clock.sleep(delay)
+                continue
+            except:
+                # no answer from the API, another call may probe it
+                circuit.release()
+                raise
+
+            opstats.call(clock.time() - start, page=page)
+            circuit.success()
+            budget.success()
+            return retval
+
     def instance_info(self):
         identity = boto.utils.get_instance_identity(timeout=60,
                                                     num_retries=5)
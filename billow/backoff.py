@@ -0,0 +1,50 @@
+"""
+billow polling backoff
+
+Waits poll AWS until something finishes.  Polls start close together and
+spread out, skip the time in which nothing can have finished, wake when
+something is known to finish and never sleep past the deadline.
+"""
+
+
+class backoff(object):
+
+    """
+    Sleeps between the polls of one wait: first, growing by factor up to
+    cap.  All times are seconds since start:
+    - no poll before earliest, when nothing can have finished
+    - a wakeup at latest, when something is known to finish, polling
+      close together again after it
+    - no sleeping past timeout
+    """
+
+    def __init__(self, clock, first=1, cap=30, factor=2, earliest=0,
+                 latest=None, timeout=None, start=None):
+        self.clock = clock
+        self.first = first
+        self.delay = first
+        self.cap = max(first, cap)
+        self.factor = factor
+        self.earliest = earliest
+        self.latest = latest
+        self.timeout = timeout
+        self.start = start
+        if self.start is None:
+            self.start = clock.time()
+
+    def next(self):
+        """
+        Seconds to sleep before the next poll
+        """
+        elapsed = self.clock.time() - self.start
+        delay = self.delay
+        self.delay = min(self.delay * self.factor, self.cap)
+
+        if elapsed + delay < self.earliest:
+            delay = self.earliest - elapsed
+        if self.latest and elapsed < self.latest < elapsed + delay:
+            delay = self.latest - elapsed
+            self.delay = self.first
+        if self.timeout:
+            delay = min(delay, max(self.timeout - elapsed, 0))
+        return delay
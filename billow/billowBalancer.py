@@ -2,9 +2,12 @@ from . import asg
 from . import dns
 from . import elb
 from . import sec
+from . import vpc
 import boto
 import datetime
-import billow
+import threading
+from .billowInstance import billowInstance
+from boto.exception import BotoServerError
 
 
 class billowBalancer(object):
@@ -20,9 +23,15 @@ class billowBalancer(object):
         self.rawsgroups = None
         self.rawattrs = None
         self.rawhealth = None
+        self.pushedsgroups = None
+        self.__instancemap = dict()
+        self.__instancemap_source = None
         self.parent = parent
         self.update_time = None
 
+        # rotations refresh instance health from several threads
+        self.lock = threading.RLock()
+
         # Backends
         if self.parent:
             self.elb = self.parent.elb
@@ -132,25 +141,81 @@ class billowBalancer(object):
                 self.rawelb = elbs[0]
 
     def __load_sgroups(self, refresh=False):
+        if refresh:
+            self.pushedsgroups = None
         if not self.rawsgroups or refresh:
             self.__load()
-            self.rawsgroups = self.sec.get_groups(self.rawelb.security_groups)
+            self.rawsgroups = self.sec.get_groups(
+                    list(self.rawelb.security_groups),
+                    known=self.pushedsgroups)
 
     def __load_attrs(self, refresh=False):
         if not self.rawattrs or refresh:
             self.__load()
             self.rawattrs = self.elb.get_elb_attr(self.__name)
 
-    def __load_health(self, refresh=False):
-        if not self.rawhealth or refresh:
-            self.__load()
-            self.rawhealth = self.elb.get_health(self.__name)
+    def __load_health(self, refresh=False, instances=None):
+        with self.lock:
+            if instances and self.rawhealth is not None:
+                self.__load_instance_health(instances)
+            elif self.rawhealth is None or refresh:
+                self.__load()
+                self.rawhealth = self.elb.get_health(self.__name)
+
+    def __load_instance_health(self, instances):
+        """
+        Refresh health of some instances only, keeping the rest
+        """
+        try:
+            health = self.elb.get_health(self.__name, instances)
+        except BotoServerError as e:
+            if e.error_code != 'InvalidInstance':
+                raise e
+            if len(instances) > 1:
+                # one unregistered instance fails the lot, describe them all
+                self.rawhealth = self.elb.get_health(self.__name)
+                return
+            # not registered
+            health = list()
+
+        rawhealth = list()
+        for h in self.rawhealth:
+            if h.instance_id not in instances:
+                rawhealth.append(h)
+        rawhealth.extend(health)
+        self.rawhealth = rawhealth
+
+    def push(self, rawelb):
+        """
+        LoadBalancer gathered elsewhere
+        """
+        self.rawelb = rawelb
+
+    def push_sgroups(self, rawsgroups):
+        """
+        SecurityGroups gathered elsewhere, by id
+        """
+        self.pushedsgroups = rawsgroups
 
-    def refresh(self):
-        self.__load(refresh=True)
-        self.__load_sgroups(refresh=True)
-        self.__load_attrs(refresh=True)
-        self.__load_health(refresh=True)
+    def refresh(self, elb=False, sgroups=False, attrs=False, health=False,
+                instances=None):
+        """
+        Reload the balancer description, its security groups, attributes
+        and instance health, or only those asked for.  instances limits the
+        health reload to those instance ids.
+        """
+        if not (elb or sgroups or attrs or health):
+            elb = sgroups = attrs = health = True
+        if elb:
+            self.__load(refresh=True)
+        if sgroups:
+            self.__load_sgroups(refresh=True)
+        if attrs:
+            self.__load_attrs(refresh=True)
+        if health:
+            if instances and not isinstance(instances, list):
+                instances = [instances]
+            self.__load_health(refresh=True, instances=instances)
 
     def lb_certname(self, cert):
         return cert.split('/')[-1]
@@ -160,6 +225,10 @@ class billowBalancer(object):
         for sg in self.rawsgroups:
             if sg.id == sgid:
                 return str(sg.name)
+        if self.pushedsgroups and sgid in self.pushedsgroups:
+            sg = self.pushedsgroups[sgid]
+            self.rawsgroups.append(sg)
+            return str(sg.name)
         if request:
             sg = self.sec.get_groups(sgid)
             if sg:
@@ -215,14 +284,28 @@ class billowBalancer(object):
 
     @property
     def instances(self):
-        self.__load_health()
+        with self.lock:
+            self.__load_health()
+            rawhealth = self.rawhealth
         instances = list()
-        for h in self.rawhealth:
-            inst = billow.billowInstance(h.instance_id, region=self.region)
+        for h in rawhealth:
+            inst = billowInstance(h.instance_id, region=self.region)
             inst.push_balancer_info(h)
             instances.append(inst)
         return instances
 
+    @property
+    def instancemap(self):
+        """
+        instance id -> billowInstance, rebuilt when health is reloaded
+        """
+        with self.lock:
+            self.__load_health()
+            if self.__instancemap_source is not self.rawhealth:
+                self.__instancemap = dict((i.id, i) for i in self.instances)
+                self.__instancemap_source = self.rawhealth
+            return self.__instancemap
+
     def deregister(self, instance_id):
         if instance_id not in self.instances:
             print "XXX instance not found in balancer"
@@ -244,6 +327,11 @@ class billowBalancer(object):
         self.__load()
         return self.rawelb.health_check.target
 
+    @property
+    def health_interval(self):
+        self.__load()
+        return self.rawelb.health_check.interval
+
     @property
     def health_timeout(self):
         self.__load()
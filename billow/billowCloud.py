@@ -3,6 +3,7 @@ from . import dns
 from . import elb
 from . import sec
 import boto
+import sys
 from .billowRegion import billowRegion
 
 
@@ -10,45 +11,155 @@ class billowCloud(object):
 
     """
     a large undulating mass of cloud services
+
+    Regions are queried concurrently, at most concurrency at a time.  A
+    region that fails is reported and left out, errors keeps the exception
+    of each region that failed in the last query.
     """
 
-    def __init__(self, regions=['us-east-1']):
+    def __init__(self, regions=['us-east-1'], snapshot=False, concurrency=8):
         if not isinstance(regions, list):
             regions = list(regions)
 
         self.regions = list()
         for r in regions:
-            self.regions.append(billowRegion(region=r, parent=self))
+            self.regions.append(billowRegion(region=r, parent=self,
+                                             snapshot=snapshot))
 
         self.services = list()
+        self.concurrency = concurrency
+        self.errors = dict()
+
+    def iter_regions(self, func):
+        """
+        Call func(billowRegion) for every region concurrently, yielding
+        (billowRegion, result) as each region completes
+        """
+        self.errors = dict()
+        if not self.regions:
+            return
+
+        def call(r):
+            try:
+                return (r, func(r), None)
+            except Exception as e:
+                return (r, None, e)
+
+        for (r, result, error) in self.__fan_out(call):
+            if error is not None:
+                self.errors[r.region] = error
+                sys.stderr.write("region %s failed: %s\n" %
+                                 (r.region, error))
+                continue
+            yield (r, result)
+
+    def __fan_out(self, call):
+        # a single region needs no threads
+        if len(self.regions) == 1 or self.concurrency <= 1:
+            for r in self.regions:
+                yield call(r)
+            return
+
+        from multiprocessing import TimeoutError
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(len(self.regions), self.concurrency))
+        try:
+            results = pool.imap_unordered(call, self.regions)
+            for n in range(len(self.regions)):
+                # wait with a timeout, so signals are still handled
+                while True:
+                    try:
+                        yield results.next(1)
+                        break
+                    except TimeoutError:
+                        continue
+        except:
+            # Ctrl-C or an abandoned generator, do not wait on the regions
+            # still running
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+
+    def iter_services(self):
+        """
+        Yield services as each region's list completes
+        """
+        for r, services in self.iter_regions(lambda r: r.list_services()):
+            for s in services:
+                yield s
 
     def list_services(self):
+        byregion = dict()
+        for r, services in self.iter_regions(lambda r: r.list_services()):
+            byregion[r.region] = services
+
+        # regions in the order given
         self.services = list()
         for r in self.regions:
-            self.add_services(r.list_services())
+            if r.region in byregion:
+                self.add_services(byregion[r.region])
         return self.services
 
     def add_services(self, services):
         for v in services:
             self.services.append(v)
 
-    def get_service(self, services, region=None):
+    def __wanted(self, services, region):
+        """
+        (service, region) pairs, service-env:region selects a region unless
+        one is given
+        """
         if not services:
             return list()
         if not isinstance(services, list):
             services = [services]
-        out = list()
 
+        wanted = list()
         for s in services:
-            if ':' in s:
-                if not region:
-                    region = s.split(':')[1]
-                service = s.split(':')[0]
+            sregion = region
+            if ':' in s and not sregion:
+                sregion = s.split(':')[1]
+            wanted.append((s, sregion))
+        return wanted
 
-            for r in self.regions:
-                if region and r.region != region:
+    def __get_services(self, wanted):
+        def get(r):
+            found = list()
+            for s, sregion in wanted:
+                if sregion and r.region != sregion:
+                    found.append(list())
                     continue
-                svc = r.get_service(s)
-                out.extend(svc)
+                found.append(r.get_service(s))
+            return found
+        return self.iter_regions(get)
+
+    def iter_get_service(self, services, region=None):
+        """
+        Yield services as each region's lookup completes
+        """
+        wanted = self.__wanted(services, region)
+        if not wanted:
+            return
+        for r, found in self.__get_services(wanted):
+            for f in found:
+                for s in f:
+                    yield s
+
+    def get_service(self, services, region=None):
+        wanted = self.__wanted(services, region)
+        if not wanted:
+            return list()
+
+        byregion = dict()
+        for r, found in self.__get_services(wanted):
+            byregion[r.region] = found
+
+        # by service, then region, in the order given
+        out = list()
+        for n in range(len(wanted)):
+            for r in self.regions:
+                if r.region in byregion:
+                    out.extend(byregion[r.region][n])
 
         return out
@@ -1,11 +1,14 @@
 from . import asg
+from . import aws
 from . import dns
 from . import elb
 from . import sec
+from . import vpc
 import boto
 import datetime
-import billow
+from .billowInstance import billowInstance
 import json
+import threading
 
 
 class billowGroup(object):
@@ -14,7 +17,7 @@ class billowGroup(object):
     a large undulating mass of cloud services
     """
 
-    def __init__(self, group, region='us-east-1', parent=None):
+    def __init__(self, group, region='us-east-1', parent=None, clock=None):
         self.group = group
         self.rawgroup = None
         self.rawconfig = None
@@ -29,6 +32,22 @@ class billowGroup(object):
         self.update_time = None
         self.settings = dict()
 
+        # rotations poll and read the group from several threads
+        self.lock = threading.RLock()
+
+        # EC2 Instances by id, kept for cachetime seconds or until refresh,
+        # timed by clock or else the clock AWS calls are timed by
+        self.instancecache = dict()
+        self.instancecache_time = None
+        self.cachetime = 30
+        self.clock = clock
+
+        # instance id indexes, rebuilt when their source data changes
+        self.__instanceids = set()
+        self.__instanceids_source = None
+        self.__instancemap = dict()
+        self.__instancemap_source = None
+
         # Backends
         if self.parent:
             self.asg = self.parent.asg
@@ -134,25 +153,27 @@ class billowGroup(object):
             self.cluster == other.cluster
 
     def __load(self, refresh=False):
-        if not self.rawgroup or refresh:
-            self.rawgroup = None
-
-            group = self.asg.get_groups(self.group)
-            if len(group) == 1:
-                self.rawgroup = group[0]
-
-            # preserve update time for future caching decisions
-            self.update_time = datetime.datetime.utcnow()
-
-        for t in self.rawgroup.tags:
-            if t.key == self.tagservice:
-                self.__service = t.value
-            elif t.key == self.tagenviron:
-                self.__environ = t.value
-            elif t.key == self.tagcluster:
-                self.__cluster = t.value
-            elif t.key == self.tagsettings:
-                self.__load_settings(t.value)
+        with self.lock:
+            if not self.rawgroup or refresh:
+                # readers keep the previous group until this one is loaded
+                rawgroup = None
+                group = self.asg.get_groups(self.group)
+                if len(group) == 1:
+                    rawgroup = group[0]
+                self.rawgroup = rawgroup
+
+                # preserve update time for future caching decisions
+                self.update_time = datetime.datetime.utcnow()
+
+            for t in self.rawgroup.tags:
+                if t.key == self.tagservice:
+                    self.__service = t.value
+                elif t.key == self.tagenviron:
+                    self.__environ = t.value
+                elif t.key == self.tagcluster:
+                    self.__cluster = t.value
+                elif t.key == self.tagsettings:
+                    self.__load_settings(t.value)
 
     def __load_settings(self, raw):
         """
@@ -207,20 +228,55 @@ class billowGroup(object):
         if not self.rawevents or refresh:
             self.rawevents = self.asg.list_activities(self.group)
 
-    def refresh(self):
-        self.__load(refresh=True)
-
     def push(self, rawgroup):
         """
         Allow premature optimization by pushing in the ASG if it has been
         gathered elsewhere
         """
-        self.rawgroup = rawgroup
-        self.__load()
+        with self.lock:
+            self.rawgroup = rawgroup
+            self.__load()
+
+    def push_config(self, rawconfig):
+        """
+        LaunchConfiguration gathered elsewhere
+        """
+        self.rawconfig = rawconfig
+
+    def push_instances(self, rawinstances):
+        """
+        EC2 Instances gathered elsewhere, cached as if just fetched
+        """
+        with self.lock:
+            self.instancecache = dict()
+            self.instancecache_time = self.now()
+            for ri in rawinstances:
+                self.instancecache[ri.id] = ri
+
+    def now(self):
+        return (self.clock or aws.clock).time()
+
+    def __expire_instances(self):
+        if self.instancecache_time is None or \
+                self.instancecache_time + self.cachetime < self.now():
+            self.instancecache = dict()
+            self.instancecache_time = self.now()
 
     def refresh(self):
-        self.rawgroup = None
-        self.__load()
+        with self.lock:
+            self.instancecache = dict()
+            self.instancecache_time = None
+            # the group may have moved to another launch configuration
+            self.rawconfig = None
+            self.__load(refresh=True)
+
+    def poll(self):
+        """
+        Reload ASG membership and lifecycle states only, keeping cached EC2
+        details so only instances new to the group are described
+        """
+        self.__load(refresh=True)
+        return self.instances
 
     @property
     def region(self):
@@ -281,7 +337,12 @@ class billowGroup(object):
 
     @property
     def config_ami(self):
+        """
+        None when the launch configuration is missing
+        """
         self.__load_config()
+        if not self.rawconfig:
+            return None
         return self.rawconfig.image_id
 
     @property
@@ -348,7 +409,7 @@ class billowGroup(object):
         self.__load()
         instances = list()
         for i in self.rawgroup.instances:
-            inst = billow.billowInstance(i.instance_id, region=self.region)
+            inst = billowInstance(i.instance_id, region=self.region)
             inst.push_group_info(i)
             instances.append(inst)
         return instances
@@ -357,44 +418,89 @@ class billowGroup(object):
     def status(self):
         self.__load()
         self.__load_status()
+        statuses = dict()
+        for st in self.rawstatus:
+            statuses[st.id] = st
         instances = list()
         for i in self.rawgroup.instances:
-            inst = billow.billowInstance(i.instance_id, region=self.region)
+            inst = billowInstance(i.instance_id, region=self.region)
             inst.push_group_info(i)
-            for s in self.rawstatus:
-                if s.id == i.instance_id:
-                    inst.push_status_info(s)
-                    break
+            if i.instance_id in statuses:
+                inst.push_status_info(statuses[i.instance_id])
             instances.append(inst)
         return instances
 
     @property
     def instances(self):
-        self.__load()
-        instances = list()
-        ids = list()
-        for i in self.rawgroup.instances:
-            inst = billow.billowInstance(i.instance_id, region=self.region)
-            inst.push_group_info(i)
-            if self.rawstatus:
-                for s in self.rawstatus:
-                    if s.id == i.instance_id:
-                        inst.push_status_info(s)
-                        break
-            instances.append(inst)
-            ids.append(inst.id)
-
-        # No instances found, do not bother looking for info
-        if not instances:
-            return list()
-
-        self.rawinstances = self.asg.get_instance(ids)
-        for ri in self.rawinstances:
+        with self.lock:
+            self.__load()
+            rawgroup = self.rawgroup
+            statuses = dict()
+            for st in self.rawstatus or list():
+                statuses[st.id] = st
+            instances = list()
+            for i in rawgroup.instances:
+                inst = billowInstance(i.instance_id, region=self.region)
+                inst.push_group_info(i)
+                if i.instance_id in statuses:
+                    inst.push_status_info(statuses[i.instance_id])
+                instances.append(inst)
+
+            # No instances found, do not bother looking for info
+            if not instances:
+                self.__instancemap = dict()
+                self.__instancemap_source = None
+                return list()
+
+            # Only describe instances not already cached
+            self.__expire_instances()
+            missing = [i.id for i in instances
+                       if i.id not in self.instancecache]
+            if missing:
+                for ri in self.asg.get_instance(missing):
+                    self.instancecache[ri.id] = ri
+
+            self.rawinstances = list()
             for i in instances:
-                if i.id == ri.id:
+                if i.id in self.instancecache:
+                    ri = self.instancecache[i.id]
+                    self.rawinstances.append(ri)
                     i.push_instance_info(ri)
 
-        return instances
+            self.__instancemap = dict((i.id, i) for i in instances)
+            self.__instancemap_source = (rawgroup, self.rawstatus,
+                                         self.instancecache_time)
+            return instances
+
+    @property
+    def instanceids(self):
+        """
+        set of instance ids in the group, from the ASG alone
+        """
+        with self.lock:
+            self.__load()
+            rawgroup = self.rawgroup
+            if self.__instanceids_source is not rawgroup:
+                self.__instanceids = set(i.instance_id
+                                         for i in rawgroup.instances)
+                self.__instanceids_source = rawgroup
+            return self.__instanceids
+
+    @property
+    def instancemap(self):
+        """
+        instance id -> billowInstance, as instances, only rebuilt once the
+        group, status or instance cache changes
+        """
+        with self.lock:
+            self.__load()
+            source = self.__instancemap_source
+            if source is None or source[0] is not self.rawgroup or \
+                    source[1] is not self.rawstatus or \
+                    source[2] != self.instancecache_time or \
+                    self.instancecache_time + self.cachetime < self.now():
+                self.instances
+            return self.__instancemap
 
     def get_instance(self, instance):
         self.__load()
@@ -435,11 +541,11 @@ class billowGroup(object):
                 decrement_capacity=decrement_capacity
                 )
 
-    def increment(self):
+    def increment(self, count=1):
         self.refresh()
         return self.asg.set_capacity(
                 self.group,
-                self.cur_size + 1
+                self.cur_size + count
                 )
 
     def decrement(self):
@@ -1,5 +1,4 @@
 from . import asg
-import billow
 import boto
 
 class billowInstance(object):
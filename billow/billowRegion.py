@@ -15,11 +15,14 @@ class billowRegion(object):
     a large undulating mass of cloud services
     """
 
-    def __init__(self, region='us-east-1', parent=None):
+    def __init__(self, region='us-east-1', parent=None, snapshot=False):
         self.region = region
         self.parent = parent
         self.services = list()
 
+        # fetch whole-region inventory in bulk instead of per group
+        self.snapshot = snapshot
+
         # Backends
         self.asg = asg.asg(self.region)
         self.dns = dns.dns(self.region)
@@ -44,6 +47,9 @@ class billowRegion(object):
         return o
 
     def list_services(self):
+        if self.snapshot:
+            return self.list_services_snapshot()
+
         self.services = list()
         servicenames = dict()
         tags = self.asg.list_tags(tag=self.servicetags)
@@ -71,6 +77,58 @@ class billowRegion(object):
 
         return self.services
 
+    def list_services_snapshot(self):
+        """
+        Build all services from a handful of paginated bulk calls, pushing
+        groups, launch configs, instances, balancers and security groups
+        into them instead of each loading its own
+        """
+        self.services = list()
+
+        asgs = self.asg.list_groups()
+        configs = dict()
+        for lc in self.asg.list_configs():
+            configs[lc.name] = lc
+        instances = dict()
+        for i in self.asg.list_instances():
+            instances[i.id] = i
+        elbs = dict()
+        for e in self.elb.list_elbs():
+            elbs[e.name] = e
+        sgroups = dict()
+        for sg in self.sec.list_groups():
+            sgroups[sg.id] = sg
+        self.vpc.list_subnets()
+
+        rawgroups = dict()
+        for a in asgs:
+            tags = dict()
+            for t in a.tags:
+                tags[t.key] = t.value
+            if self.tagservice not in tags:
+                sys.stderr.write("group %s missing service tag\n" % a.name)
+                continue
+            if self.tagenviron not in tags:
+                sys.stderr.write("group %s missing environ tag\n" % a.name)
+                continue
+            rawgroups[a.name] = a
+            self.add_service(tags[self.tagservice], tags[self.tagenviron],
+                             group=a.name)
+
+        for s in self.services:
+            s.push_balancers(elbs)
+            s.push_sgroups(sgroups)
+            for g in s.groups:
+                a = rawgroups[g.group]
+                g.push(a)
+                if a.launch_config_name in configs:
+                    g.push_config(configs[a.launch_config_name])
+                g.push_instances([instances[i.instance_id]
+                                  for i in a.instances
+                                  if i.instance_id in instances])
+
+        return self.services
+
     def add_service(self, service, environ, group=None):
         slist = self.find_service(service, environ=environ)
         if not slist:
@@ -1,21 +1,37 @@
 from . import asg
-import billow
+from .backoff import backoff
+from .clock import default as default_clock
+from .billowService import billowService
 import boto
 from boto.exception import BotoServerError
 from contextlib import closing
 import itertools
 import json
+import math
 import sys
-import time
+import threading
 import urllib2
 
 class billowRotate(object):
     """
     Rotate instance within a billowService
+
+    clock provides time() and sleep() to every wait, a virtual clock lets
+    a simulated backend rotate without waiting.
     """
 
-    def __init__(self, service, region='us-east-1'):
-        if not isinstance(service, billow.billowService):
+    # Seconds between polls of each wait, (first, cap), see backoff
+    polling = {
+        'registered': (1, 10),
+        'deregistered': (1, 15),
+        'healthy': (2, 15),
+        'terminated': (2, 8),
+        'launched': (5, 15),
+        'notify': (1, 10),
+    }
+
+    def __init__(self, service, region='us-east-1', clock=None):
+        if not isinstance(service, billowService):
             raise TypeError
 
         self.service = service
@@ -24,6 +40,24 @@ class billowRotate(object):
         self.__logger = self.consolelogger
         self.private_secondary_failures = list()
         self.urltimeout = 60
+        # resume() waits no longer than this for what was left running
+        self.resumetimeout = 1800
+        self.clock = clock or default_clock
+
+        # instance id -> billowGroup, balancer name -> billowBalancer
+        self.groupindex = dict()
+        self.balancerindex = dict()
+        self.indexedgroups = None
+        self.indexedbalancers = None
+        self.indexlock = threading.Lock()
+
+        # instance id -> time last seen not registered with balancers, and
+        # first seen registered, health checks pass counted from registration
+        self.unregistered = dict()
+        self.registered = dict()
+
+        # billow.journal.journal of rotation phases, when set
+        self.journal = None
 
     def consolelogger(self, msg):
         sys.stderr.write("billowRotate %s: %s\n" % (self.service.service, msg))
@@ -35,6 +69,16 @@ class billowRotate(object):
     def log(self, msg):
         self.__logger(msg)
 
+    def set_journal(self, journal):
+        self.journal = journal
+
+    def note(self, phase, instance=None, **data):
+        """
+        Journal a phase of an instance's rotation
+        """
+        if self.journal:
+            self.journal.record(phase, instance, **data)
+
     def safety(self):
         """
         1. Check for no instances
@@ -42,6 +86,7 @@ class billowRotate(object):
         3. Check for (cur == max <= 1)
         4. Check CrossZoneLB disabled and empty AZ
         5. Check instances for secondary Private IPs and multi-subnet
+        6. Check for a missing launch configuration
         """
         warnings = list()
         for g in self.service.groups:
@@ -89,6 +134,12 @@ class billowRotate(object):
                                 % (g.group, i.id,
                                     ni['private_ip_addresses'][0]))
 
+            # 6. Check for a missing launch configuration
+            if g.config_ami is None:
+                warnings.append('%s launch configuration %s not found, ' \
+                        'every instance counts as outdated' \
+                        % (g.group, g.launch_config))
+
         return warnings
 
     def roundrobin(self, *iterables):
@@ -105,34 +156,64 @@ class billowRotate(object):
                 pending -= 1
                 nexts = itertools.cycle(itertools.islice(nexts, pending))
 
-    def order(self):
+    def current(self, group, instance):
+        """
+        Instance already runs the group's launch configuration and AMI, never
+        when the launch configuration is missing
+        """
+        if group.config_ami is None:
+            return False
+        if instance.group_config != group.launch_config:
+            return False
+        if instance.image_id and instance.image_id != group.config_ami:
+            return False
+        return True
+
+    def order(self, incremental=False):
         """
         1. UnHealthy Group instances
         2. Degraded Balancer instances
         3. All instances
         4. Round-robin interleave Groups
+
+        incremental leaves out instances already current()
         """
         self.instances = list()
         degraded = list()
         instances = list()
 
+        skip = set()
+        if incremental:
+            for g in self.service.groups:
+                for i in g.instances:
+                    if self.current(g, i):
+                        skip.add(i.id)
+
+        # degraded keeps the rotation order, seen answers membership
+        seen = set()
+
         # 1. UnHealthy Group instances
         for g in self.service.groups:
             for i in g.instances:
-                if i.group_health != 'Healthy' and i.id not in degraded:
+                if i.group_health != 'Healthy' and i.id not in seen \
+                        and i.id not in skip:
                     degraded.append(i.id)
+                    seen.add(i.id)
 
         # 2. Degraded Balancer instances
         for b in self.service.balancers:
             for i in b.instances:
-                if i.balancer_state != 'InService' and i.id not in degraded:
+                if i.balancer_state != 'InService' and i.id not in seen \
+                        and i.id not in skip:
                     degraded.append(i.id)
+                    seen.add(i.id)
 
         # 3. All instances
         for g in self.service.groups:
             instlist = list()
             for i in g.instances:
-                if i.id not in degraded and i.group_state == 'InService':
+                if i.id not in seen and i.group_state == 'InService' \
+                        and i.id not in skip:
                     instlist.append(i.id)
             instances.append(instlist)
 
@@ -142,38 +223,77 @@ class billowRotate(object):
 
         return self.instances
 
+    def instance_key(self, instance_id):
+        """
+        instance_id:region -> instance_id, as billowInstance matches
+        """
+        if ':' in instance_id:
+            (iid, region) = instance_id.split(':', 1)
+            if region == self.service.region:
+                return iid
+        return instance_id
+
+    def index_groups(self):
+        """
+        (Re)index group membership, entries for instances that have left a
+        group are caught when looked up
+        """
+        with self.indexlock:
+            groups = self.service.groups
+            if self.indexedgroups is not groups:
+                self.groupindex = dict()
+                self.indexedgroups = groups
+            for g in groups:
+                for i in g.instanceids:
+                    self.groupindex[i] = g
+
     def find_group_by_instance(self, instance_id):
-        for g in self.service.groups:
-            if instance_id in g.instances:
-                return g
-        return None
+        instance_id = self.instance_key(instance_id)
+        g = self.groupindex.get(instance_id)
+        if g is None or self.indexedgroups is not self.service.groups or \
+                instance_id not in g.instanceids:
+            self.index_groups()
+            g = self.groupindex.get(instance_id)
+            if g is not None and instance_id not in g.instanceids:
+                return None
+        return g
 
     def find_balancer(self, balancer_name):
-        for b in self.service.balancers:
-            if b.name == balancer_name:
-                return b
-        return None
+        balancers = self.service.balancers
+        if self.indexedbalancers is not balancers:
+            with self.indexlock:
+                balancerindex = dict()
+                for b in balancers:
+                    if b.name not in balancerindex:
+                        balancerindex[b.name] = b
+                self.balancerindex = balancerindex
+                self.indexedbalancers = balancers
+        return self.balancerindex.get(balancer_name)
 
     def find_balancer_instance(self, balancer, instance_id):
-        for i in balancer.instances:
-            if i.id == instance_id:
-                return i
-        return None
+        return balancer.instancemap.get(self.instance_key(instance_id))
 
     def find_group_instance(self, group, instance_id):
-        for i in group.instances:
-            if i.id == instance_id:
-                return i
-        return None
+        return group.instancemap.get(self.instance_key(instance_id))
+
+    def poller(self, phase, sleep=None, timeout=None, starttime=None):
+        """
+        backoff for a wait, a fixed sleep when given one
+        """
+        (first, cap) = self.polling[phase]
+        if sleep:
+            (first, cap) = (sleep, sleep)
+        return backoff(self.clock, first=first, cap=cap, timeout=timeout,
+                       start=starttime or None)
 
     def wait_timeout(self, timeout, starttime):
-        waittime = timeout - (time.time() - starttime)
+        waittime = timeout - (self.clock.time() - starttime)
         if waittime <= 0:
             self.log('timed out, aborting')
             return 0
         return waittime
 
-    def wait_elb_registered(self, instance_id, sleep=5, timeout=None):
+    def wait_elb_registered(self, instance_id, sleep=None, timeout=None):
         """
         Wait for instance to become registered to balancer
         Registration means 'InService' or 'OutOfService'
@@ -184,7 +304,8 @@ class billowRotate(object):
             if timeout < 0:
                 self.log('timed out waiting for balancer registration')
                 return False
-            starttime = time.time()
+            starttime = self.clock.time()
+        poll = self.poller('registered', sleep, timeout, starttime)
 
         healthy = False
         while not healthy:
@@ -195,6 +316,7 @@ class billowRotate(object):
                 return False
 
             healthycnt = 0
+            polltime = self.clock.time()
             for balancer_name in group.load_balancers:
                 balancer = self.find_balancer(balancer_name)
                 if not balancer:
@@ -203,8 +325,9 @@ class billowRotate(object):
                             % (instance_id, balancer_name))
                     return False
 
-                # Refresh ELB info
-                balancer.refresh()
+                # Refresh ELB health of this instance only
+                balancer.refresh(health=True,
+                                 instances=self.instance_key(instance_id))
 
                 instance = self.find_balancer_instance(balancer, instance_id)
                 if not instance:
@@ -215,18 +338,21 @@ class billowRotate(object):
                     healthycnt += 1
 
             if healthycnt == len(group.load_balancers):
+                self.registered.setdefault(instance_id, self.clock.time())
                 return True
+            self.unregistered[instance_id] = polltime
 
-            if timeout and (time.time() - starttime) > timeout:
+            if timeout and (self.clock.time() - starttime) >= timeout:
                 self.log('timed out waiting for instance %s balancer ' \
                         'deregistration' % instance_id)
                 return False
 
             if not healthy:
+                sleep = poll.next()
                 timeoutstr = ''
                 if timeout:
                     timeoutstr = ' timeout %ds' \
-                            % int(timeout - (time.time() - starttime))
+                            % int(timeout - (self.clock.time() - starttime))
                 self.log('sleeping %ds waiting for instance %s to register ' \
                         'with %d/%d balancers%s' % (
                             sleep,
@@ -235,11 +361,11 @@ class billowRotate(object):
                             len(group.load_balancers),
                             timeoutstr)
                         )
-                time.sleep(sleep)
+                self.clock.sleep(sleep)
 
         return True
 
-    def wait_elb_deregistered(self, instance_id, sleep=5, timeout=None):
+    def wait_elb_deregistered(self, instance_id, sleep=None, timeout=None):
         """
         Wait for instance to deregister from balancer
         Consider 'Unknown' as deregistered
@@ -249,7 +375,8 @@ class billowRotate(object):
             if timeout < 0:
                 self.log('timed out waiting for balancer deregistration')
                 return False
-            starttime = time.time()
+            starttime = self.clock.time()
+        poll = self.poller('deregistered', sleep, timeout, starttime)
 
         healthy = True
         while healthy:
@@ -270,8 +397,9 @@ class billowRotate(object):
                             % (instance_id, balancer_name))
                     return False
 
-                # Refresh ELB info
-                balancer.refresh()
+                # Refresh ELB health of this instance only
+                balancer.refresh(health=True,
+                                 instances=self.instance_key(instance_id))
 
                 instance = self.find_balancer_instance(balancer, instance_id)
                 if not instance:
@@ -295,16 +423,20 @@ class billowRotate(object):
             if unhealthycnt == len(group.load_balancers):
                 return True
 
-            if timeout and (time.time() - starttime) > timeout:
+            if timeout and (self.clock.time() - starttime) >= timeout:
                 self.log('timed out waiting for instance %s balancer ' \
                         'deregistration' % instance_id)
                 return False
 
             if healthy:
+                # Draining ends by its timeout, wake then
+                if drainmax:
+                    poll.latest = drainmax
+                sleep = poll.next()
                 timeoutstr = ''
                 if timeout:
                     timeoutstr = ' timeout %ds' \
-                            % int(timeout - (time.time() - starttime))
+                            % int(timeout - (self.clock.time() - starttime))
                 drainstr = ''
                 if drainmax:
                     drainstr = ' draining connections %ds' % drainmax
@@ -317,16 +449,17 @@ class billowRotate(object):
                             timeoutstr,
                             drainstr)
                         )
-                time.sleep(sleep)
+                self.clock.sleep(sleep)
 
         return True
 
-    def wait_elb_healthy(self, instance_id, sleep=5, timeout=None):
-        starttime = time.time()
+    def wait_elb_healthy(self, instance_id, sleep=None, timeout=None):
+        starttime = self.clock.time()
         if timeout:
             if timeout < 0:
                 self.log('timed out waiting for balancer health check')
                 return False
+        poll = self.poller('healthy', sleep, timeout, starttime)
 
         healthchecks = dict()
         healthtimes = dict()
@@ -348,8 +481,9 @@ class billowRotate(object):
                             % (instance_id, balancer_name))
                     return False
 
-                # Refresh ELB info
-                balancer.refresh()
+                # Refresh ELB health of this instance only
+                balancer.refresh(health=True,
+                                 instances=self.instance_key(instance_id))
 
                 instance = self.find_balancer_instance(balancer, instance_id)
                 if not instance:
@@ -362,19 +496,33 @@ class billowRotate(object):
                     healthtimes[balancer.name] = \
                             balancer.health_timeout * balancer.health_threshold
 
+                    # Passing takes threshold checks, interval apart,
+                    # counted from registration
+                    passing = balancer.health_interval * \
+                            balancer.health_threshold
+                    since = self.unregistered.get(instance_id)
+                    if since:
+                        poll.earliest = max(poll.earliest,
+                                since - starttime + passing)
+                    until = self.registered.get(instance_id)
+                    if until:
+                        poll.latest = max(poll.latest,
+                                until - starttime + passing)
+
             if healthycnt == len(group.load_balancers):
                 return True
 
-            if timeout and (time.time() - starttime) > timeout:
+            if timeout and (self.clock.time() - starttime) >= timeout:
                 self.log('timed out waiting for instance %s health check' \
                         % instance_id)
                 return False
 
             if not healthy:
+                sleep = poll.next()
                 timeoutstr = ''
                 if timeout:
                     timeoutstr = ' timeout %ds' \
-                            % int(timeout - (time.time() - starttime))
+                            % int(timeout - (self.clock.time() - starttime))
                 self.log('sleeping %ds waiting for instance %s health check ' \
                         'with %d/%d balancers%s' % (
                             sleep,
@@ -383,37 +531,50 @@ class billowRotate(object):
                             len(group.load_balancers),
                             timeoutstr)
                         )
-                now = time.time()
+                now = self.clock.time()
                 for balancer_name, target in healthchecks.iteritems():
                     if (now - starttime) > healthtimes[balancer_name]:
                         self.log('instance %s failing balancer %s health ' \
                                 'check %s' \
                                 % (instance_id, balancer_name, target))
-                time.sleep(sleep)
+                self.clock.sleep(sleep)
 
         return True
 
-    def wait_group_terminated(self, instance_id, sleep=5, timeout=None):
+    def wait_group_terminated(self, instance_id, sleep=None, timeout=None,
+            group=None):
         """
-        Wait for instance to terminate from group
+        Wait for instance to terminate from group, found by instance unless
+        given
         """
         starttime = 0
         if timeout:
             if timeout < 0:
                 self.log('timed out waiting for instance group termination')
                 return False
-            starttime = time.time()
+            starttime = self.clock.time()
+        poll = self.poller('terminated', sleep, timeout, starttime)
 
+        ingroup = group
         healthy = True
         while healthy:
-            group = self.find_group_by_instance(instance_id)
+            group = ingroup or self.find_group_by_instance(instance_id)
             if not group:
                 self.log('no group found, cannot wait for instance %s ' \
                         'group termination' % instance_id)
                 return False
 
-            # Refresh Group info
-            group.refresh()
+            # Shutdown waits at most the balancers' connection draining
+            # timeout, wake then
+            if not poll.latest:
+                for balancer_name in group.load_balancers:
+                    balancer = self.find_balancer(balancer_name)
+                    if balancer and balancer.connection_draining:
+                        poll.latest = max(poll.latest,
+                                balancer.connection_draining_timeout)
+
+            # Refresh Group membership and lifecycle
+            group.poll()
 
             instance = self.find_group_instance(group, instance_id)
             if not instance:
@@ -423,15 +584,16 @@ class billowRotate(object):
                     instance.instance_state == 'terminated':
                 return True
 
-            if timeout and (time.time() - starttime) > timeout:
+            if timeout and (self.clock.time() - starttime) >= timeout:
                 self.log('timed out waiting for instance %s termination ' \
                         'from group %s' % (instance_id, group.name))
                 return False
 
+            sleep = poll.next()
             timeoutstr = ''
             if timeout:
                 timeoutstr = ' timeout %ds' \
-                        % int(timeout - (time.time() - starttime))
+                        % int(timeout - (self.clock.time() - starttime))
             self.log('sleeping %ds waiting for instance %s in state %s to ' \
                     'terminate from group %s%s' % (
                         sleep,
@@ -440,24 +602,26 @@ class billowRotate(object):
                         group.name,
                         timeoutstr)
                     )
-            time.sleep(sleep)
+            self.clock.sleep(sleep)
 
         return True
 
     def wait_group_launched(self, group, instances,
-            count=1, sleep=5, timeout=None):
+            count=1, sleep=None, timeout=None):
         """
         Wait for new instance(s) to start
         """
         if not isinstance(instances, list):
             instances = [instances]
+        known = set(str(i) for i in instances)
 
         starttime = 0
         if timeout:
             if timeout < 0:
                 self.log('timed out waiting for instance group launch')
                 return False
-            starttime = time.time()
+            starttime = self.clock.time()
+        poll = self.poller('launched', sleep, timeout, starttime)
 
         healthy = False
         while not healthy:
@@ -465,12 +629,11 @@ class billowRotate(object):
             healthytext = None
             healthyinstances = list()
 
-            # Refresh Group info
-            group.refresh()
-
-            # Look for new instances not in previous list
-            for i in group.instances:
-                if i.id not in instances:
+            # Look for new instances not in previous list, refreshing Group
+            # membership and lifecycle only
+            polltime = self.clock.time()
+            for i in group.poll():
+                if i.id not in known:
                     # Warn when unexpectate state discovered
                     if (i.group_state == 'Terminated' or \
                             i.group_state == 'Terminating' or \
@@ -485,9 +648,11 @@ class billowRotate(object):
                                 % (i.id, i.group_state, i.instance_state))
                         continue
 
-                    # Display Pending if any are pending
+                    # Display Pending if any are pending, balancers only
+                    # register instances once in service
                     if i.group_state == 'Pending':
                         healthytext = i.group_state
+                        self.unregistered[i.id] = polltime
 
                     # Only display InService if no Pending
                     if not healthytext and i.group_state == 'InService':
@@ -496,19 +661,21 @@ class billowRotate(object):
                     if i.group_state == 'InService':
                         healthycnt += 1
                         healthyinstances.append(i.id)
+                        self.registered.setdefault(i.id, self.clock.time())
 
             if healthycnt >= count:
                 return healthyinstances
 
-            if timeout and (time.time() - starttime) > timeout:
+            if timeout and (self.clock.time() - starttime) >= timeout:
                 self.log('timed out waiting for instance start ' \
                         'from group %s' % group.name)
                 return False
 
+            sleep = poll.next()
             timeoutstr = ''
             if timeout:
                 timeoutstr = ' timeout %ds' \
-                        % int(timeout - (time.time() - starttime))
+                        % int(timeout - (self.clock.time() - starttime))
             statestr = ''
             if healthytext:
                 statestr = ' in state %s' % healthytext
@@ -521,20 +688,21 @@ class billowRotate(object):
                         group.name,
                         timeoutstr)
                     )
-            time.sleep(sleep)
+            self.clock.sleep(sleep)
 
         return list()
 
-    def wait_launch(self, group, instlist, timeout=None):
+    def wait_launch(self, group, instlist, count=1, timeout=None):
         """
-        Wait for a newly launched instance to come into service
+        Wait for newly launched instance(s) to come into service
         """
         if timeout and timeout < 0:
             self.log('timed out waiting for instance launch')
             return False
 
         # Wait for new instance to enter Group
-        ret = self.wait_group_launched(group, instlist, timeout=timeout)
+        ret = self.wait_group_launched(group, instlist, count=count,
+                                       timeout=timeout)
         if not ret:
             return False
 
@@ -571,7 +739,7 @@ class billowRotate(object):
     def deregister(self, instance_id, wait=True, timeout=None):
         ret = True
         for b in self.service.balancers:
-            if instance_id not in b.instances:
+            if not self.find_balancer_instance(b, instance_id):
                 self.log('instance %s already deregistered from balancer %s' \
                         % (instance_id, b.name))
                 continue
@@ -586,7 +754,7 @@ class billowRotate(object):
 
     def register(self, instance_id, wait=True, healthy=False, timeout=None):
         if timeout:
-            starttime = time.time()
+            starttime = self.clock.time()
 
         ret = True
         group = self.find_group_by_instance(instance_id)
@@ -602,8 +770,10 @@ class billowRotate(object):
                         'balancer deregistration' % balancer_name)
                 return False
 
+            self.unregistered[instance_id] = self.clock.time()
             if not balancer.register(instance_id):
                 ret = False
+            self.registered[instance_id] = self.clock.time()
 
         if wait:
             waittime = timeout
@@ -779,35 +949,37 @@ class billowRotate(object):
 
         return (healthy, status)
 
-    def wait_notify(self, group, instance_id, sleep=5, timeout=None):
+    def wait_notify(self, group, instance_id, sleep=None, timeout=None):
         """
         Wait for GET to 'urlstatus' to return "OK" or '{"status": "OK"}'
         """
         starttime = 0
         if timeout:
-            starttime = time.time()
+            starttime = self.clock.time()
+        poll = self.poller('notify', sleep, timeout, starttime)
 
         healthy = False
         while not healthy:
             (healthy, status) = self.status_check(group, instance_id, sleep,
                     timeout)
 
-            if not healthy and timeout and (time.time() - starttime) > timeout:
+            if not healthy and timeout and (self.clock.time() - starttime) >= timeout:
                 self.log('timed out waiting for instance %s status url' \
                         % instance_id)
                 return False
 
             if not healthy:
+                sleep = poll.next()
                 timeoutstr = ''
                 if timeout:
                     timeoutstr = ' timeout %ds' \
-                            % int(timeout - (time.time() - starttime))
+                            % int(timeout - (self.clock.time() - starttime))
                 responsestr = ''
                 if status and 'status' in status:
                     responsestr = ' notify %s' % status['status']
                 self.log('sleeping %ds waiting for instance %s status' \
                         '%s%s' % (sleep, instance_id, timeoutstr, responsestr))
-                time.sleep(sleep)
+                self.clock.sleep(sleep)
 
         return True
 
@@ -817,7 +989,7 @@ class billowRotate(object):
         """
         terminate_after = True
         if timeout:
-            starttime = time.time()
+            starttime = self.clock.time()
 
         group = self.find_group_by_instance(instance_id)
         if not group:
@@ -840,29 +1012,23 @@ class billowRotate(object):
             return False
         if not self.wait_notify(group, instance_id, timeout=timeout):
             return False
+        self.note('notified', instance_id, group=group.name)
 
         elasticips = self.get_elasticips(instance_id)
-        for e in elasticips:
-            self.log('disassociating static IP %s association %s ' \
-                    'allocation %s interface %s' \
-                    % (e['public_ip_address'], e['association_id'],
-                        e['allocation_id'], e['network_interface_id']))
-            group.asg.disassociate_address(e['association_id'])
-
         privateips = self.get_secondaryips(instance_id)
-        for p in privateips:
-            self.log('unassigning private IP %s interface %s' \
-                    % (p['private_ip_address'], p['network_interface_id']))
-            group.asg.unassign_private_ip_addresses(
-                    network_interface_id=p['network_interface_id'],
-                    private_ip_addresses=p['private_ip_address']
-                    )
+        if elasticips or privateips:
+            self.note('detached', instance_id, elasticips=elasticips,
+                      privateips=privateips)
+
+        self.detach(group, elasticips, privateips)
 
         # Terminate before launch
         if group.cur_size == group.max_size:
             terminate_after = False
 
             self.log('terminating instance %s' % instance_id)
+            self.note('terminating', instance_id,
+                      before=[i.id for i in instlist])
 
             # Do not wait for termination, instead wait for launched instance
             if not self.terminate(instance_id, wait=False):
@@ -871,6 +1037,9 @@ class billowRotate(object):
         # Increase Group size
         else:
             self.log('launching instance')
+            self.note('launching', instance_id,
+                      before=[i.id for i in instlist],
+                      desired=group.cur_size)
 
             if not group.increment():
                 self.log('group launch instance failed')
@@ -885,6 +1054,60 @@ class billowRotate(object):
 
         # Put back Elastic / Private IPs
         newinstance = ret[0]
+        self.note('launched', instance_id, replacement=newinstance)
+        if elasticips or privateips:
+            if not self.reattach(instance_id, newinstance, elasticips,
+                                 privateips):
+                return False
+
+        # Full launch wait after addresses associated
+        waittime = timeout
+        if timeout:
+            waittime = self.wait_timeout(timeout, starttime)
+        ret = self.wait_launch(group, instlist, timeout=waittime)
+        if ret == False:
+            return False
+        self.note('healthy', instance_id, replacement=newinstance)
+
+        if terminate_after:
+            if timeout:
+                waittime = self.wait_timeout(timeout, starttime)
+
+            self.log('terminating instance %s' % instance_id)
+            self.note('terminating', instance_id)
+
+            # Terminate and wait
+            if not self.terminate(instance_id, decrement_capacity=True,
+                    wait=True, timeout=waittime):
+                return False
+
+        self.note('done', instance_id)
+        return True
+
+    def detach(self, group, elasticips, privateips):
+        """
+        Take elastic and secondary private IPs off their instance
+        """
+        for e in elasticips:
+            self.log('disassociating static IP %s association %s ' \
+                    'allocation %s interface %s' \
+                    % (e['public_ip_address'], e['association_id'],
+                        e['allocation_id'], e['network_interface_id']))
+            group.asg.disassociate_address(e['association_id'])
+
+        for p in privateips:
+            self.log('unassigning private IP %s interface %s' \
+                    % (p['private_ip_address'], p['network_interface_id']))
+            group.asg.unassign_private_ip_addresses(
+                    network_interface_id=p['network_interface_id'],
+                    private_ip_addresses=p['private_ip_address']
+                    )
+
+    def reattach(self, instance_id, newinstance, elasticips, privateips):
+        """
+        Put the addresses detached from instance_id on newinstance,
+        secondary private IPs that fail are repaired after rotation
+        """
         for e in elasticips:
             self.log('associating static IP %s allocation %s' \
                     % (e['public_ip_address'], e['allocation_id']))
@@ -894,40 +1117,573 @@ class billowRotate(object):
                         % (e['public_ip_address'], e['allocation_id']))
                 return False
 
+        failures = list()
         for p in privateips:
             self.log('assigning private IP %s' % p['private_ip_address'])
             ret = self.put_secondaryip(newinstance, p['private_ip_address'])
             if not ret:
-                self.private_secondary_failures.append(p['private_ip_address'])
+                failures.append(p['private_ip_address'])
+        self.private_secondary_failures.extend(failures)
 
-        # Full launch wait after addresses associated
+        self.note('reattached', instance_id, replacement=newinstance,
+                  failures=failures)
+        return True
+
+    def find_group(self, group_name):
+        for g in self.service.groups:
+            if g.name == group_name:
+                return g
+        return None
+
+    def resume(self, timeout=None):
+        """
+        Finish the instances an interrupted rotation journaled but did not
+        complete: find their replacement, put back detached addresses, wait
+        for it to pass health checks and terminate the old instance.
+        Instances that never got a replacement are left for rotate().
+        All waits together are bounded by timeout, or resumetimeout when not
+        given.  Returns the number of instances that failed.
+        """
+        if not timeout:
+            timeout = self.resumetimeout
+        starttime = self.clock.time()
+
+        errors = 0
+        claimed = self.journal.replacements()
+        for (instance_id, phases) in self.journal.unfinished():
+            if self.wait_timeout(timeout, starttime) <= 0:
+                return errors + 1
+
+            group = None
+            if 'notified' in phases:
+                group = self.find_group(phases['notified']['group'])
+            if not group:
+                self.log('no group found, cannot resume rotation of ' \
+                        'instance %s' % instance_id)
+                errors += 1
+                continue
+
+            self.log('resuming rotation of instance %s' % instance_id)
+            group.poll()
+            old = self.find_group_instance(group, instance_id)
+
+            # Replacement journaled, or the instance launched since
+            replacement = None
+            if 'launched' in phases:
+                replacement = phases['launched']['replacement']
+            else:
+                before = phases.get('launching') or phases.get('terminating')
+                known = None
+                if before and 'before' in before:
+                    known = before['before'] + claimed + [instance_id]
+                if known and not self.launch_requested(group, instance_id,
+                                                       phases, known):
+                    self.log('no replacement was launched for instance %s' \
+                            % instance_id)
+                    known = None
+                if known:
+                    waittime = self.wait_timeout(timeout, starttime)
+                    if waittime <= 0:
+                        return errors + 1
+                    ret = self.wait_group_launched(group, known,
+                                                   timeout=waittime)
+                    if not ret:
+                        errors += 1
+                        continue
+                    replacement = ret[0]
+                    claimed.append(replacement)
+                    self.note('launched', instance_id,
+                              replacement=replacement)
+
+            # Addresses go to the replacement, or back where they came from
+            if 'detached' in phases and 'reattached' not in phases:
+                target = replacement
+                if not target and old:
+                    target = instance_id
+                if not target:
+                    self.log('no instance to put back addresses of ' \
+                            'instance %s' % instance_id)
+                    errors += 1
+                    continue
+
+                # Journaled before detaching, some may still be attached
+                elasticips = phases['detached']['elasticips']
+                privateips = phases['detached']['privateips']
+                if old:
+                    group.refresh()
+                    allocations = [e['allocation_id'] for e in elasticips]
+                    addresses = [p['private_ip_address'] for p in privateips]
+                    heldips = [e for e in self.get_elasticips(instance_id)
+                               if e['allocation_id'] in allocations]
+                    heldprivate = [p for p in
+                                   self.get_secondaryips(instance_id)
+                                   if p['private_ip_address'] in addresses]
+                    if target == instance_id:
+                        held = [e['allocation_id'] for e in heldips]
+                        elasticips = [e for e in elasticips
+                                      if e['allocation_id'] not in held]
+                        held = [p['private_ip_address'] for p in heldprivate]
+                        privateips = [p for p in privateips
+                                      if p['private_ip_address'] not in held]
+                    else:
+                        self.detach(group, heldips, heldprivate)
+
+                if not self.reattach(instance_id, target, elasticips,
+                                     privateips):
+                    errors += 1
+                    continue
+                if target == instance_id:
+                    # rotate() finds them again when it gets to the instance
+                    group.refresh()
+
+            if not replacement:
+                continue
+
+            if 'healthy' not in phases:
+                waittime = self.wait_timeout(timeout, starttime)
+                if waittime <= 0:
+                    return errors + 1
+                if not self.wait_elb_registered(replacement,
+                                                timeout=waittime):
+                    errors += 1
+                    continue
+                waittime = self.wait_timeout(timeout, starttime)
+                if waittime <= 0:
+                    return errors + 1
+                if not self.wait_elb_healthy(replacement, timeout=waittime):
+                    errors += 1
+                    continue
+                self.note('healthy', instance_id, replacement=replacement)
+
+            if old and not (old.group_state or '').startswith('Terminat'):
+                self.log('terminating instance %s' % instance_id)
+                self.note('terminating', instance_id)
+                if not self.terminate(instance_id, decrement_capacity=True,
+                                      wait=False):
+                    errors += 1
+                    continue
+            if old:
+                waittime = self.wait_timeout(timeout, starttime)
+                if waittime <= 0:
+                    return errors + 1
+                if not self.wait_group_terminated(instance_id,
+                                                  timeout=waittime,
+                                                  group=group):
+                    errors += 1
+                    continue
+            self.note('done', instance_id)
+
+        return errors
+
+    def launch_requested(self, group, instance_id, phases, known):
+        """
+        A replacement for instance_id was asked for before the rotation was
+        interrupted: the group has an instance not known before, its
+        desired capacity went up, or the instance is terminating ahead of
+        its replacement
+        """
+        for i in group.instances:
+            if i.id not in known:
+                return True
+        if 'launching' in phases:
+            desired = phases['launching'].get('desired')
+            return desired is not None and group.cur_size > desired
+        old = self.find_group_instance(group, instance_id)
+        return not old or (old.group_state or '').startswith('Terminat')
+
+    def batch_count(self, group, batch_size=None, batch_percent=None):
+        """
+        Instances of group replaced together, limited by the room between
+        desired and max capacity
+        """
+        count = 1
+        if batch_size:
+            count = batch_size
+        elif batch_percent:
+            size = len(group.instanceids)
+            count = int(math.ceil(size * batch_percent / 100.0))
+        return max(0, min(count, group.max_size - group.cur_size))
+
+    def zone_limits(self, group):
+        """
+        Instances per zone that may be replaced at once, half of those in
+        the zone so redundancy is kept while old instances terminate
+        """
+        zones = dict()
+        for i in group.instances:
+            zones[i.zone] = zones.get(i.zone, 0) + 1
+        limits = dict()
+        for k, v in zones.iteritems():
+            limits[k] = max(1, v / 2)
+        return limits
+
+    def waves(self, group, instance_ids, count):
+        """
+        Split instance_ids (in rotation order) into waves of at most count
+        instances, and at most zone_limits() per zone
+        """
+        limits = self.zone_limits(group)
+        pending = list(instance_ids)
+        waves = list()
+        while pending:
+            wave = list()
+            zones = dict()
+            for i in pending:
+                if len(wave) >= count:
+                    break
+                instance = self.find_group_instance(group, i)
+                zone = instance.zone if instance else None
+                if zones.get(zone, 0) >= limits.get(zone, 1):
+                    continue
+                zones[zone] = zones.get(zone, 0) + 1
+                wave.append(i)
+            pending = [i for i in pending if i not in wave]
+            waves.append(wave)
+        return waves
+
+    def rotate_wave(self, group, instance_ids, timeout=None):
+        """
+        Replace instance_ids of a group together: raise capacity by their
+        number, wait for all replacements to pass health checks, then
+        terminate the old instances
+        """
+        if timeout:
+            starttime = self.clock.time()
+
+        if 'rotate' in group.settings and group.settings['rotate'] == False:
+            self.log('skipping rotation of instances %s due to tag ' \
+                    'rotate=false' % ', '.join(instance_ids))
+            return True
+
+        # Capture current group list to detect new instances
+        instlist = group.instances
+
+        zones = dict()
+        for i in instance_ids:
+            instance = self.find_group_instance(group, i)
+            zones[i] = instance.zone if instance else None
+
+        #
+        # URL NOTIFY - HTTP request to instance endpoint for termination
+        #
+        for i in instance_ids:
+            if not self.notify_terminate(group, i, timeout=timeout):
+                return False
+        for i in instance_ids:
+            waittime = timeout
+            if timeout:
+                waittime = self.wait_timeout(timeout, starttime)
+            if not self.wait_notify(group, i, timeout=waittime):
+                return False
+            self.note('notified', i, group=group.name)
+
+        addresses = dict()
+        for i in instance_ids:
+            elasticips = self.get_elasticips(i)
+            privateips = self.get_secondaryips(i)
+            if elasticips or privateips:
+                self.note('detached', i, elasticips=elasticips,
+                          privateips=privateips)
+
+            self.detach(group, elasticips, privateips)
+            if elasticips or privateips:
+                addresses[i] = (elasticips, privateips)
+
+        self.log('launching %d instances' % len(instance_ids))
+        desired = group.cur_size
+        for i in instance_ids:
+            self.note('launching', i, before=[n.id for n in instlist],
+                      desired=desired)
+        if not group.increment(len(instance_ids)):
+            self.log('group launch instances failed')
+            return False
+
+        # Wait for new instances to enter Group
         waittime = timeout
         if timeout:
             waittime = self.wait_timeout(timeout, starttime)
-        ret = self.wait_launch(group, instlist, timeout=waittime)
-        if ret == False:
+        launched = self.wait_group_launched(group, instlist,
+                                            count=len(instance_ids),
+                                            timeout=waittime)
+        if not launched:
             return False
 
-        if terminate_after:
-            if timeout:
-                waittime = self.wait_timeout(timeout, starttime)
+        # Pair replacements in the same zone where possible, those with
+        # addresses to put back first
+        unused = list(launched)
+        replacements = dict()
+        for i in sorted(instance_ids, key=lambda i: i not in addresses):
+            newinstance = unused[0]
+            for n in unused:
+                instance = self.find_group_instance(group, n)
+                if instance and instance.zone == zones[i]:
+                    newinstance = n
+                    break
+            unused.remove(newinstance)
+            replacements[i] = newinstance
+            self.note('launched', i, replacement=newinstance)
 
-            self.log('terminating instance %s' % instance_id)
+        # Put back Elastic / Private IPs
+        for i in instance_ids:
+            if i not in addresses:
+                continue
+            (elasticips, privateips) = addresses[i]
+            if not self.reattach(i, replacements[i], elasticips, privateips):
+                return False
 
-            # Terminate and wait
-            if not self.terminate(instance_id, decrement_capacity=True,
-                    wait=True, timeout=waittime):
+        # Full launch wait after addresses associated
+        if timeout:
+            waittime = self.wait_timeout(timeout, starttime)
+        if self.wait_launch(group, instlist, count=len(instance_ids),
+                            timeout=waittime) == False:
+            return False
+        for i in instance_ids:
+            self.note('healthy', i, replacement=replacements[i])
+
+        # Terminate all, then wait for all
+        for i in instance_ids:
+            self.log('terminating instance %s' % i)
+            self.note('terminating', i)
+            if not self.terminate(i, decrement_capacity=True, wait=False):
                 return False
+        for i in instance_ids:
+            if timeout:
+                waittime = self.wait_timeout(timeout, starttime)
+            if not self.wait_group_terminated(i, timeout=waittime,
+                                              group=group):
+                return False
+            self.note('done', i)
 
         return True
 
-    def rotate(self, wait=True, timeout=None):
+    def plan(self, rotatelist=None, max_unavailable=1,
+            balancer_unavailable=None, batch_size=None, batch_percent=None):
+        """
+        Schedule rotation into slots of [(group, [instance_id])] rotated
+        together, with at most max_unavailable instances per zone and
+        balancer_unavailable per balancer in a slot.  Within a group a slot
+        is limited by batch_size/batch_percent and the room between desired
+        and max capacity, or one instance when there is none.
+        """
+        if rotatelist is None:
+            rotatelist = self.order()
+
+        pending = list()
+        for i in rotatelist:
+            group = self.find_group_by_instance(i)
+            if not group:
+                self.log('no group found, cannot rotate instance %s' % i)
+                continue
+            pending.append((group, i))
+
+        limits = dict()
+        for (group, i) in pending:
+            if group.name in limits:
+                continue
+            if batch_size or batch_percent:
+                count = self.batch_count(group, batch_size, batch_percent)
+            else:
+                count = group.max_size - group.cur_size
+            limits[group.name] = max(1, count)
+
+        slots = list()
+        while pending:
+            zones = dict()
+            balancers = dict()
+            groups = list()
+            parts = dict()
+            for (group, i) in pending:
+                instance = self.find_group_instance(group, i)
+                zone = instance.zone if instance else None
+                if zones.get(zone, 0) >= max_unavailable:
+                    continue
+                if balancer_unavailable and [b for b in group.load_balancers
+                        if balancers.get(b, 0) >= balancer_unavailable]:
+                    continue
+                if len(parts.get(group.name, [])) >= limits[group.name]:
+                    continue
+
+                zones[zone] = zones.get(zone, 0) + 1
+                for b in group.load_balancers:
+                    balancers[b] = balancers.get(b, 0) + 1
+                if group.name not in parts:
+                    parts[group.name] = list()
+                    groups.append(group)
+                parts[group.name].append(i)
+
+            slots.append([(g, parts[g.name]) for g in groups])
+            pending = [(g, i) for (g, i) in pending
+                       if i not in parts.get(g.name, [])]
+
+        return slots
+
+    def rotate_part(self, group, instance_ids, timeout=None):
+        """
+        Rotate instance_ids of a group, one alone or together as a wave.
+        Returns the number of instances that failed.
+        """
+        if len(instance_ids) == 1:
+            ret = self.rotate_instance(instance_ids[0], timeout=timeout)
+        else:
+            self.log('rotating %d instances in group %s: %s' \
+                    % (len(instance_ids), group.name, ', '.join(instance_ids)))
+            ret = self.rotate_wave(group, instance_ids, timeout=timeout)
+        if not ret:
+            self.log('failed rotating %s' % ', '.join(instance_ids))
+            return len(instance_ids)
+        return 0
+
+    def rotate_slots(self, slots, timeout=None):
+        """
+        Rotate slot after slot, the groups of a slot in parallel.  Returns
+        the number of instances that failed.
+        """
+        if timeout:
+            starttime = self.clock.time()
+
+        errors = 0
+        for slot in slots:
+            waittime = timeout
+            if timeout:
+                waittime = self.wait_timeout(timeout, starttime)
+                # Abort rotation if no time left on the clock
+                if waittime <= 0:
+                    return errors + 1
+
+            if len(slot) == 1:
+                (group, instance_ids) = slot[0]
+                errors += self.rotate_part(group, instance_ids,
+                                           timeout=waittime)
+                continue
+
+            from multiprocessing import TimeoutError
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(len(slot))
+            try:
+                results = pool.map_async(
+                        lambda p: self.rotate_part(p[0], p[1],
+                                                   timeout=waittime),
+                        slot)
+                while True:
+                    # wait with a timeout, so signals are still handled
+                    try:
+                        errors += sum(results.get(1))
+                        break
+                    except TimeoutError:
+                        continue
+            except:
+                # Ctrl-C leaves the slot to the journal, do not wait on it
+                pool.terminate()
+                raise
+            pool.close()
+            pool.join()
+
+        return errors
+
+    def rotate_batches(self, rotatelist, batch_size=None, batch_percent=None,
+            timeout=None):
+        """
+        Rotate in waves per group, interleaving groups.  Returns the number
+        of instances that failed.
+        """
+        if timeout:
+            starttime = self.clock.time()
+
+        # rotation order within each group
+        bygroup = dict()
+        groups = list()
+        for i in rotatelist:
+            group = self.find_group_by_instance(i)
+            if not group:
+                self.log('no group found, cannot rotate instance %s' % i)
+                continue
+            if group.name not in bygroup:
+                bygroup[group.name] = list()
+                groups.append(group)
+            bygroup[group.name].append(i)
+
+        plans = list()
+        for g in groups:
+            count = self.batch_count(g, batch_size, batch_percent)
+            if count <= 1:
+                self.log('group %s has no room above desired capacity for ' \
+                        'more than one instance, rotating one at a time' \
+                        % g.name)
+                plans.append([(g, [i]) for i in bygroup[g.name]])
+                continue
+            plans.append([(g, w) for w in
+                          self.waves(g, bygroup[g.name], count)])
+
+        errors = 0
+        for (group, wave) in self.roundrobin(*plans):
+            waittime = timeout
+            if timeout:
+                waittime = self.wait_timeout(timeout, starttime)
+                # Abort rotation if no time left on the clock
+                if waittime <= 0:
+                    return errors + 1
+            errors += self.rotate_part(group, wave, timeout=waittime)
+
+        return errors
+
+    def rotate(self, wait=True, timeout=None, batch_size=None,
+            batch_percent=None, max_unavailable=None,
+            balancer_unavailable=None, incremental=False, resume=False):
+        """
+        Rotate every instance, one at a time unless batch_size or
+        batch_percent of each group are replaced together, or in parallel
+        slots of max_unavailable per zone (see plan()).  incremental only
+        rotates instances not yet on their group's launch configuration,
+        resume first finishes what the journal has unfinished and skips the
+        replacements it launched.
+        """
         if timeout:
-            starttime = time.time()
+            starttime = self.clock.time()
 
         errors = 0
 
-        rotatelist = self.order()
+        skip = list()
+        if resume and self.journal:
+            errors = self.resume(timeout=timeout)
+            skip = self.journal.replacements()
+            if timeout:
+                remaining = self.wait_timeout(timeout, starttime)
+                if remaining <= 0:
+                    errors += 1
+                    self.note('finished', errors=errors)
+                    self.log('finished: %d FAILURES' % errors)
+                    return False
+                timeout = remaining
+                starttime = self.clock.time()
+        else:
+            if self.journal and self.journal.unfinished():
+                self.log('journal %s holds an unfinished rotation, ' \
+                        'finish it with --resume or remove the journal' \
+                        % self.journal.path)
+                return False
+            self.note('start', service=str(self.service))
+
+        rotatelist = [i for i in self.order(incremental=incremental)
+                      if i not in skip]
+        if incremental:
+            self.log('%d instances not on their launch configuration' \
+                    % len(rotatelist))
+        if max_unavailable:
+            slots = self.plan(rotatelist, max_unavailable=max_unavailable,
+                              balancer_unavailable=balancer_unavailable,
+                              batch_size=batch_size,
+                              batch_percent=batch_percent)
+            count = sum(len(ids) for slot in slots for (g, ids) in slot)
+            self.log('rotating %d instances in %d slots' \
+                    % (count, len(slots)))
+            errors += self.rotate_slots(slots, timeout=timeout)
+            rotatelist = list()
+        elif batch_size or batch_percent:
+            errors += self.rotate_batches(rotatelist, batch_size=batch_size,
+                                          batch_percent=batch_percent,
+                                          timeout=timeout)
+            rotatelist = list()
+
         for instance in rotatelist:
             waittime = timeout
             if timeout:
@@ -946,6 +1702,7 @@ class billowRotate(object):
             self.finalize_secondaryip()
             errors += len(self.private_secondary_failures)
 
+        self.note('finished', errors=errors)
         if errors > 0:
             self.log('finished: %d FAILURES' % errors)
             return False
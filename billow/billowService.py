@@ -5,8 +5,7 @@ from . import sec
 from . import vpc
 import boto
 import datetime
-import pprint
-import billow
+from .billowBalancer import billowBalancer
 from .billowGroup import billowGroup
 
 
@@ -26,6 +25,8 @@ class billowService(object):
         self.__balancers = list()
 
         self.rawsgroups = None
+        self.pushedelbs = None
+        self.pushedsgroups = None
 
         # service-env:region overrides passed in region
         if ':' in service:
@@ -87,6 +88,7 @@ class billowService(object):
         return self.__info
 
     def __repr__(self):
+        import pprint
         return pprint.pformat(self.config())
 
     def __str__(self):
@@ -164,8 +166,11 @@ class billowService(object):
         self.__groups = groups
 
     def __load_sgroups(self, refresh=False):
+        if refresh:
+            self.pushedsgroups = None
         if not self.rawsgroups or refresh:
-            self.rawsgroups = self.sec.get_groups(self.security_groups)
+            self.rawsgroups = self.sec.get_groups(self.security_groups,
+                                                  known=self.pushedsgroups)
 
     def __load_balancers(self, refresh=False):
         if not self.__balancers or refresh:
@@ -173,16 +178,33 @@ class billowService(object):
             for g in self.groups:
                 for lb in g.load_balancers:
                     if lb not in self.__balancers:
-                        b = billow.billowBalancer(lb, region=self.region,
+                        b = billowBalancer(lb, region=self.region,
                                 parent=self)
+                        if self.pushedelbs and lb in self.pushedelbs:
+                            b.push(self.pushedelbs[lb])
+                        if self.pushedsgroups is not None:
+                            b.push_sgroups(self.pushedsgroups)
                         self.__balancers.append(b)
 
     def refresh(self):
+        self.pushedelbs = None
         self.__load()
         self.__load_groups()
         self.__load_sgroups(refresh=True)
         self.__load_balancers(refresh=True)
 
+    def push_balancers(self, rawelbs):
+        """
+        LoadBalancers gathered elsewhere, by name
+        """
+        self.pushedelbs = rawelbs
+
+    def push_sgroups(self, rawsgroups):
+        """
+        SecurityGroups gathered elsewhere, by id
+        """
+        self.pushedsgroups = rawsgroups
+
     def add_group(self, groupname):
         """
         Add a group to the service by name
@@ -244,6 +266,10 @@ class billowService(object):
         for sg in self.rawsgroups:
             if sg.id == sgid:
                 return str(sg.name)
+        if self.pushedsgroups and sgid in self.pushedsgroups:
+            sg = self.pushedsgroups[sgid]
+            self.rawsgroups.append(sg)
+            return str(sg.name)
         if request:
             sg = self.sec.get_groups(sgid)
             if sg:
@@ -0,0 +1,204 @@
+"""
+billow inventory cache
+
+Read calls made through aws.wrap are kept in a SQLite database shared by
+every billow process, keyed by account, region, operation and arguments.
+Each operation has its own time to live and operations without one are
+never cached.  Any mutating call empties the cache for its account and
+region.
+"""
+from . import cassette
+from . import clock as clocks
+import errno
+import os
+import sqlite3
+import stat
+import sys
+import threading
+
+# Cache used by aws.wrap, if any
+active = None
+
+# Seconds a response stays valid, per operation
+ttls = {
+    'autoscaling.get_all_tags': 300,
+    'autoscaling.get_all_groups': 30,
+    'autoscaling.get_all_launch_configurations': 300,
+    'ec2.get_all_reservations': 30,
+    'ec2.get_all_images': 600,
+    'ec2.get_all_security_groups': 300,
+    'ec2.get_all_subnets': 3600,
+    'elasticloadbalancing.get_all_load_balancers': 300,
+    'elasticloadbalancing.get_all_lb_attributes': 300,
+}
+
+
+def default_path():
+    from .util import cache_dir
+    if 'BILLOW_CACHE' in os.environ:
+        return os.environ['BILLOW_CACHE']
+    return cache_dir('inventory.sqlite')
+
+
+def set_ttl(operation, seconds):
+    """
+    Cache operation (e.g. ec2.get_all_images) for seconds, 0 disables
+    """
+    if seconds:
+        ttls[operation] = seconds
+    else:
+        ttls.pop(operation, None)
+
+
+def load_ttls(spec):
+    """
+    Parse 'operation=seconds,...' as found in BILLOW_CACHE_TTLS
+    """
+    for entry in spec.split(','):
+        if '=' not in entry:
+            continue
+        operation, seconds = entry.split('=', 1)
+        set_ttl(operation.strip(), int(seconds))
+
+
+if 'BILLOW_CACHE_TTLS' in os.environ:
+    load_ttls(os.environ['BILLOW_CACHE_TTLS'])
+
+
+class cache(object):
+
+    """
+    With refresh=True cached responses are never served, but fresh ones are
+    still stored for the next process.  clock times responses, the wall
+    clock unless given.
+    """
+
+    schema = 'CREATE TABLE IF NOT EXISTS responses (' \
+        'account TEXT, region TEXT, operation TEXT, key TEXT, ' \
+        'stored REAL, response BLOB, ' \
+        'PRIMARY KEY (account, region, operation, key))'
+
+    def __init__(self, path=None, refresh=False, clock=None):
+        self.path = path or default_path()
+        self.refresh = refresh
+        self.clock = clock or clocks.default
+        self.lock = threading.Lock()
+
+        self.secure()
+        self.db = sqlite3.connect(self.path, timeout=10,
+                                  check_same_thread=False)
+        self.db.text_factory = str
+        with self.db:
+            self.db.execute(self.schema)
+            self.db.execute('DELETE FROM responses WHERE stored < ?',
+                            (self.clock.time() - max(ttls.values() or [0]),))
+
+    def secure(self):
+        """
+        Responses are unpickled, only use a file of the current user's that
+        nobody else can write
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        try:
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0600))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        st = os.lstat(self.path)
+        if not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid():
+            raise OSError(errno.EPERM, 'not a file owned by the current user')
+        if st.st_mode & 022:
+            raise OSError(errno.EPERM, 'writable by other users')
+
+    def cacheable(self, operation):
+        return operation in ttls
+
+    def get(self, account, region, operation, args, nargs):
+        """
+        (True, response) when a fresh response is cached, else (False, None)
+        """
+        if self.refresh or operation not in ttls:
+            return (False, None)
+
+        key = cassette.callkey(region, operation, args, nargs)
+        try:
+            with self.lock:
+                row = self.db.execute(
+                    'SELECT stored, response FROM responses WHERE '
+                    'account = ? AND region = ? AND operation = ? AND '
+                    'key = ?',
+                    (account or '', region or '', operation, key)).fetchone()
+        except sqlite3.Error, e:
+            sys.stderr.write('cache read failed: %s\n' % e)
+            return (False, None)
+        if not row or row[0] + ttls[operation] < self.clock.time():
+            return (False, None)
+        return (True, cassette.loads(str(row[1])))
+
+    def put(self, account, region, operation, args, nargs, response):
+        if operation not in ttls:
+            return
+        key = cassette.callkey(region, operation, args, nargs)
+        raw = sqlite3.Binary(cassette.dumps(response))
+        try:
+            with self.lock:
+                with self.db:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO responses VALUES '
+                        '(?, ?, ?, ?, ?, ?)',
+                        (account or '', region or '', operation, key,
+                         self.clock.time(), raw))
+        except sqlite3.Error, e:
+            sys.stderr.write('cache write failed: %s\n' % e)
+
+    def invalidate(self, account, region):
+        """
+        AWS state changed, drop everything cached for account and region.
+        If that fails, stop serving cached responses altogether.
+        """
+        try:
+            with self.lock:
+                with self.db:
+                    self.db.execute(
+                        'DELETE FROM responses WHERE account = ? AND '
+                        'region = ?', (account or '', region or ''))
+        except sqlite3.Error, e:
+            sys.stderr.write('cache invalidation failed: %s\n' % e)
+            self.refresh = True
+
+    def clear(self):
+        with self.lock:
+            with self.db:
+                self.db.execute('DELETE FROM responses')
+
+    def close(self):
+        with self.lock:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+
+def use(path=None, refresh=False, clock=None):
+    """
+    Cache read calls made by this process, returns None when the cache
+    cannot be opened
+    """
+    global active
+    stop()
+    try:
+        active = cache(path, refresh=refresh, clock=clock)
+    except (sqlite3.Error, OSError), e:
+        sys.stderr.write('cache disabled, %s: %s\n' %
+                         (path or default_path(), e))
+        active = None
+    return active
+
+
+def stop():
+    global active
+    if active:
+        active.close()
+    active = None
@@ -0,0 +1,174 @@
+"""
+billow AWS call recording and replay
+
+A cassette captures every request aws.wrap sends, with its response or error
+and timing, one JSON document per line.  Replaying a cassette serves the
+recorded responses in order, without credentials or network access.
+"""
+import base64
+import collections
+import cPickle as pickle
+import cStringIO
+import json
+import threading
+import time
+
+# Cassette used by aws.wrap, if any
+active = None
+
+
+class ReplayError(Exception):
+
+    """
+    Raised when replaying a call that was not recorded
+    """
+    pass
+
+
+def dumps(obj):
+    """
+    Pickle a boto response, dropping references to live connections
+    """
+    from boto.connection import AWSAuthConnection
+    buf = cStringIO.StringIO()
+    p = pickle.Pickler(buf, 2)
+
+    def persistent_id(o):
+        if isinstance(o, AWSAuthConnection):
+            return 'connection'
+        return None
+    p.persistent_id = persistent_id
+    p.dump(obj)
+    return buf.getvalue()
+
+
+def loads(raw):
+    """
+    Unpickle a boto response, connections come back as None
+    """
+    u = pickle.Unpickler(cStringIO.StringIO(raw))
+    u.persistent_load = lambda pid: None
+    return u.load()
+
+
+def callkey(region, operation, args, nargs):
+    return '%s %s %r %r' % (region, operation, args, sorted(nargs.items()))
+
+
+class cassette(object):
+
+    """
+    mode 'record' truncates path and appends every call to it, mode 'replay'
+    serves calls from it.  With latency=True replayed calls take as long as
+    they did when recorded.
+    """
+
+    def __init__(self, path, mode='replay', latency=False):
+        if mode not in ('record', 'replay'):
+            raise ValueError('cassette mode must be record or replay')
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.tape = collections.defaultdict(collections.deque)
+        self.fp = None
+
+        if self.replaying:
+            self.__load()
+        else:
+            self.fp = open(self.path, 'w')
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def __load(self):
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.tape[entry['key']].append(entry)
+
+    def record(self, region, operation, args, nargs, elapsed,
+               response=None, error=None):
+        entry = {
+            'key': callkey(region, operation, args, nargs),
+            'region': region,
+            'operation': operation,
+            'time': time.time(),
+            'elapsed': elapsed
+        }
+        if error is not None:
+            entry['error'] = {
+                'status': error.status,
+                'reason': error.reason,
+                'body': error.body
+            }
+        else:
+            entry['response'] = base64.b64encode(dumps(response))
+
+        with self.lock:
+            self.fp.write(json.dumps(entry) + '\n')
+            self.fp.flush()
+
+    def replay(self, region, operation, args, nargs):
+        key = callkey(region, operation, args, nargs)
+        with self.lock:
+            if not self.tape[key]:
+                raise ReplayError('no recorded response for %s' % key)
+            entry = self.tape[key].popleft()
+
+        if self.latency:
+            time.sleep(entry['elapsed'])
+
+        if 'error' in entry:
+            from boto.exception import BotoServerError
+            e = entry['error']
+            raise BotoServerError(e['status'], e['reason'], e['body'])
+        return loads(base64.b64decode(entry['response']))
+
+    def call(self, awsfunc, region, operation, args, nargs):
+        """
+        Make (or replay) one AWS request
+        """
+        if self.replaying:
+            return self.replay(region, operation, args, nargs)
+
+        from boto.exception import BotoServerError
+        start = time.time()
+        try:
+            retval = awsfunc(*args, **nargs)
+        except BotoServerError as e:
+            self.record(region, operation, args, nargs, time.time() - start,
+                        error=e)
+            raise
+        self.record(region, operation, args, nargs, time.time() - start,
+                    response=retval)
+        return retval
+
+    def close(self):
+        if self.fp:
+            self.fp.close()
+            self.fp = None
+
+
+def use(path, mode='replay', latency=False):
+    """
+    Record or replay all AWS calls made by this process
+    """
+    global active
+    stop()
+    active = cassette(path, mode=mode, latency=latency)
+    return active
+
+
+def stop():
+    global active
+    if active:
+        active.close()
+    active = None
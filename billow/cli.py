@@ -2,10 +2,10 @@ import argparse
 import sys
 import errno
 import json
-import yaml
-import pprint
 from .util import common_parser, common_args, catch_sigint
-import billow
+from .util import print_ndjson, service_records, yaml_dump
+from . import client
+from . import commands
 import re
 
 
@@ -25,19 +25,30 @@ def billow_list():
         help='yaml output',
         action='store_true'
     )
+    parsergroup.add_argument(
+        '--ndjson',
+        help='one json record per service, as each region completes',
+        action='store_true'
+    )
     args = parser.parse_args()
     common_args(args)
 
-    output = list()
-    bc = billow.billowCloud(regions=args.regions)
-    services = bc.list_services()
-    for s in services:
-        output.append(str(s))
+    if args.ndjson and not client.available(args):
+        from .billowCloud import billowCloud
+        bc = billowCloud(regions=args.regions)
+        for s in bc.iter_services():
+            print_ndjson(str(s))
+        sys.exit(0)
 
-    if args.json:
+    output = commands.run(args, 'list')
+
+    if args.ndjson:
+        for o in output:
+            print_ndjson(o)
+    elif args.json:
         print json.dumps(output)
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print o
@@ -61,11 +72,22 @@ def billow_get():
         help='yaml output',
         action='store_true'
     )
+    parsergroup.add_argument(
+        '--ndjson',
+        help='one json record per service, or per group and instance '
+             'with --info, as each is found',
+        action='store_true'
+    )
     parser.add_argument(
         '--info',
         help='full info',
         action='store_true'
     )
+    parser.add_argument(
+        '--snapshot',
+        help='fetch whole-region inventory in bulk, faster for many services',
+        action='store_true'
+    )
     parser.add_argument(
         'services',
         metavar='SERVICE',
@@ -76,23 +98,38 @@ def billow_get():
     args = parser.parse_args()
     common_args(args)
 
-    output = list()
-    bc = billow.billowCloud(regions=args.regions)
-    services = bc.get_service(args.services)
-    if not services:
-        sys.stderr.write('no service found\n')
-        sys.exit(errno.ENOENT)
-    for s in services:
-        if args.info:
-            output.append(s.info())
-        else:
-            output.append(s.config())
+    if args.ndjson and not client.available(args):
+        from .billowCloud import billowCloud
+        bc = billowCloud(regions=args.regions, snapshot=args.snapshot)
+        found = False
+        for s in bc.iter_get_service(args.services):
+            found = True
+            if args.info:
+                for r in service_records(s.info()):
+                    print_ndjson(r)
+            else:
+                print_ndjson(s.config())
+        if not found:
+            sys.stderr.write('no service found\n')
+            sys.exit(errno.ENOENT)
+        sys.exit(0)
 
-    if args.json:
+    output = commands.run(args, 'get', services=args.services,
+                          info=args.info)
+
+    if args.ndjson:
+        for o in output:
+            if args.info:
+                for r in service_records(o):
+                    print_ndjson(r)
+            else:
+                print_ndjson(o)
+    elif args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
+        import pprint
         _first = True
         for o in output:
             if not _first:
@@ -133,29 +170,12 @@ def billow_find_images():
     args = parser.parse_args()
     common_args(args)
 
-    if '-' not in args.image:
-        sys.stderr.write('service-environ required\n')
-        sys.exit(1)
-
-    service = args.image.rsplit('-')[0]
-    environ = args.image.rsplit('-')[1]
-
-    output = list()
-    bc = billow.billowCloud(regions=args.regions)
-    for r in bc.regions:
-        i = billow.billowImage(region=r.region, parent=r)
-        images = i.list_dated_newest(service, environ)
-        for image in images:
-            output.append({
-                'id': image.id,
-                'name': image.name,
-                'description': image.description
-            })
+    output = commands.run(args, 'find-images', image=args.image)
 
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print "%s %s" % (str(o['id']), str(o['name']))
@@ -164,6 +184,8 @@ def billow_find_images():
 
 
 def billow_list_images():
+    from .billowCloud import billowCloud
+    from .billowImage import billowImage
     catch_sigint()
     parser = common_parser('billow list images')
     parsergroup = parser.add_mutually_exclusive_group()
@@ -193,9 +215,9 @@ def billow_list_images():
     common_args(args)
 
     output = list()
-    bc = billow.billowCloud(regions=args.regions)
+    bc = billowCloud(regions=args.regions)
     for r in bc.regions:
-        i = billow.billowImage(region=r.region, parent=r)
+        i = billowImage(region=r.region, parent=r)
         try:
             images = i.search(args.image, regex=args.regex)
         except re.error:
@@ -211,7 +233,7 @@ def billow_list_images():
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print "%s %s" % (str(o['id']), str(o['name']))
@@ -220,6 +242,8 @@ def billow_list_images():
 
 
 def billow_find_configs():
+    from .billowCloud import billowCloud
+    from .billowConfig import billowConfig
     catch_sigint()
     parser = common_parser('billow find configs')
     parsergroup = parser.add_mutually_exclusive_group()
@@ -251,9 +275,9 @@ def billow_find_configs():
     environ = args.config.rsplit('-')[1]
 
     output = list()
-    bc = billow.billowCloud(regions=args.regions)
+    bc = billowCloud(regions=args.regions)
     for r in bc.regions:
-        c = billow.billowConfig(region=r.region, parent=r)
+        c = billowConfig(region=r.region, parent=r)
         configs = c.list_dated_newest(service, environ)
         for config in configs:
             output.append({
@@ -264,7 +288,7 @@ def billow_find_configs():
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print "%s %s" % (str(o['name']), str(o['image_id']))
@@ -273,6 +297,8 @@ def billow_find_configs():
 
 
 def billow_list_configs():
+    from .billowCloud import billowCloud
+    from .billowConfig import billowConfig
     catch_sigint()
     parser = common_parser('billow list configs')
     parsergroup = parser.add_mutually_exclusive_group()
@@ -297,9 +323,9 @@ def billow_list_configs():
     common_args(args)
 
     output = list()
-    bc = billow.billowCloud(regions=args.regions)
+    bc = billowCloud(regions=args.regions)
     for r in bc.regions:
-        c = billow.billowConfig(region=r.region, parent=r)
+        c = billowConfig(region=r.region, parent=r)
         configs = c.match(args.config)
         for config in configs:
             output.append({
@@ -310,7 +336,7 @@ def billow_list_configs():
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print "%s %s" % (str(o['name']), str(o['image_id']))
@@ -334,6 +360,12 @@ def billow_list_rotate():
         help='yaml output',
         action='store_true'
     )
+    parser.add_argument(
+        '--force-all',
+        help='list every instance, not only those off the launch '
+             'configuration',
+        action='store_true'
+    )
     parser.add_argument(
         'service',
         type=str,
@@ -342,25 +374,13 @@ def billow_list_rotate():
     args = parser.parse_args()
     common_args(args)
 
-    output = list()
-    bc = billow.billowCloud(regions=args.regions)
-    services = bc.get_service(args.service)
-    if not services:
-        sys.stderr.write('no service found\n')
-        sys.exit(errno.ENOENT)
-    for s in services:
-        r = billow.billowRotate(s)
-        warnings = r.safety()
-        for w in warnings:
-            sys.stderr.write('WARNING: %s\n' % w)
-
-        for i in r.order():
-            output.append(i)
+    output = commands.run(args, 'list-rotate', service=args.service,
+                          force_all=args.force_all)
 
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print str(o)
@@ -369,6 +389,9 @@ def billow_list_rotate():
 
 
 def billow_rotate():
+    from .billowCloud import billowCloud
+    from .billowRotate import billowRotate
+    from .journal import journal, default_path as journal_path
     catch_sigint()
     parser = common_parser('billow rotate')
     parsergroup = parser.add_mutually_exclusive_group()
@@ -396,34 +419,92 @@ def billow_rotate():
         help='action timeout in seconds',
         default=None
     )
+    parsergroup = parser.add_mutually_exclusive_group()
+    parsergroup.add_argument(
+        '--batch-size',
+        type=int,
+        help='instances of each group to replace together',
+        default=None
+    )
+    parsergroup.add_argument(
+        '--batch-percent',
+        type=int,
+        help='percent of each group to replace together',
+        default=None
+    )
+    parser.add_argument(
+        '--max-unavailable',
+        type=int,
+        help='rotate in parallel, at most this many instances per zone at '
+             'once',
+        default=None
+    )
+    parser.add_argument(
+        '--max-unavailable-balancer',
+        type=int,
+        help='with --max-unavailable, at most this many instances per '
+             'balancer at once',
+        default=None
+    )
+    parser.add_argument(
+        '--force-all',
+        help='rotate every instance, not only those off the launch '
+             'configuration',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--resume',
+        help='first finish what an interrupted rotation left in its journal',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--journal',
+        metavar='FILE',
+        help='rotation journal, default ~/.cache/billow/rotate/'
+             'SERVICE.journal, FILE.SERVICE when several services match',
+        default=None
+    )
     parser.add_argument(
         'service',
         type=str,
         help='service to rotate'
     )
     args = parser.parse_args()
-    common_args(args)
+    common_args(args, refresh=True)
     wait = True
     if args.nowait:
         wait = False
 
     output = list()
-    bc = billow.billowCloud(regions=args.regions)
+    bc = billowCloud(regions=args.regions)
     services = bc.get_service(args.service)
     if not services:
         sys.stderr.write('no service found\n')
         sys.exit(errno.ENOENT)
     for s in services:
-        r = billow.billowRotate(s)
+        r = billowRotate(s)
+        path = journal_path(str(s))
+        if args.journal:
+            path = args.journal
+            # one journal per service, a rotation's start drops the last one
+            if len(services) > 1:
+                path = '%s.%s' % (args.journal, s)
+        r.set_journal(journal(path))
         warnings = r.safety()
         for w in warnings:
             sys.stderr.write('WARNING: %s\n' % w)
-        r.rotate(wait=wait, timeout=args.timeout)
+        r.rotate(wait=wait, timeout=args.timeout,
+                 batch_size=args.batch_size,
+                 batch_percent=args.batch_percent,
+                 max_unavailable=args.max_unavailable,
+                 balancer_unavailable=args.max_unavailable_balancer,
+                 incremental=not args.force_all,
+                 resume=args.resume)
 
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print str(o)
@@ -432,6 +513,8 @@ def billow_rotate():
 
 
 def billow_rotate_info():
+    from .billowCloud import billowCloud
+    from .billowRotate import billowRotate
     catch_sigint()
     parser = common_parser('billow rotate')
     parsergroup = parser.add_mutually_exclusive_group()
@@ -447,28 +530,34 @@ def billow_rotate_info():
         help='yaml output',
         action='store_true'
     )
+    parser.add_argument(
+        '--force-all',
+        help='order every instance, not only those off the launch '
+             'configuration',
+        action='store_true'
+    )
     parser.add_argument(
         'service',
         type=str,
         help='service to rotate'
     )
     args = parser.parse_args()
-    common_args(args)
+    common_args(args, refresh=True)
 
     output = list()
-    bc = billow.billowCloud(regions=args.regions)
+    bc = billowCloud(regions=args.regions)
     services = bc.get_service(args.service)
     if not services:
         sys.stderr.write('no service found\n')
         sys.exit(errno.ENOENT)
     for s in services:
-        r = billow.billowRotate(s)
+        r = billowRotate(s)
         settings = list()
         for g in s.groups:
             g.refresh()
             if g.settings:
                 settings.append(g.settings)
-        order = r.order()
+        order = r.order(incremental=not args.force_all)
         addrs = list()
         for o in order:
             inst = s.get_instance(o)
@@ -485,7 +574,7 @@ def billow_rotate_info():
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print str(o)
@@ -509,42 +598,27 @@ def billow_rotate_status():
         help='yaml output',
         action='store_true'
     )
+    parser.add_argument(
+        '--force-all',
+        help='check every instance, not only those off the launch '
+             'configuration',
+        action='store_true'
+    )
     parser.add_argument(
         'service',
         type=str,
         help='service to rotate'
     )
     args = parser.parse_args()
-    common_args(args)
+    common_args(args, refresh=True)
 
-    output = list()
-    bc = billow.billowCloud(regions=args.regions)
-    services = bc.get_service(args.service)
-    if not services:
-        sys.stderr.write('no service found\n')
-        sys.exit(errno.ENOENT)
-    for s in services:
-        r = billow.billowRotate(s)
-        settings = list()
-        for g in s.groups:
-            g.refresh()
-            if g.settings:
-                settings.append(g.settings)
-        order = r.order()
-        addrs = list()
-        for o in order:
-            group = r.find_group_by_instance(o)
-            (healthy, status) = r.status_check(group, o, sleep=0, timeout=0)
-            output.append({
-                'instance': o,
-                'healthy': healthy,
-                'status': status
-                })
+    output = commands.run(args, 'rotate-status', service=args.service,
+                          force_all=args.force_all)
 
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print str(o)
@@ -553,6 +627,8 @@ def billow_rotate_status():
 
 
 def billow_rotate_deregister():
+    from .billowCloud import billowCloud
+    from .billowRotate import billowRotate
     catch_sigint()
     parser = common_parser('billow rotate deregister')
     parsergroup = parser.add_mutually_exclusive_group()
@@ -591,25 +667,25 @@ def billow_rotate_deregister():
         help='instance to deregister'
     )
     args = parser.parse_args()
-    common_args(args)
+    common_args(args, refresh=True)
     wait = True
     if args.nowait:
         wait = False
 
     output = list()
-    bc = billow.billowCloud(regions=args.regions)
+    bc = billowCloud(regions=args.regions)
     services = bc.get_service(args.service)
     if not services:
         sys.stderr.write('no service found\n')
         sys.exit(errno.ENOENT)
     for s in services:
-        r = billow.billowRotate(s)
+        r = billowRotate(s)
         r.deregister(args.instance, wait=wait, timeout=args.timeout)
 
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print str(o)
@@ -618,6 +694,8 @@ def billow_rotate_deregister():
 
 
 def billow_rotate_register():
+    from .billowCloud import billowCloud
+    from .billowRotate import billowRotate
     catch_sigint()
     parser = common_parser('billow rotate deregister')
     parsergroup = parser.add_mutually_exclusive_group()
@@ -656,26 +734,26 @@ def billow_rotate_register():
         help='instance to register'
     )
     args = parser.parse_args()
-    common_args(args)
+    common_args(args, refresh=True)
     wait = True
     if args.nowait:
         wait = False
 
     output = list()
-    bc = billow.billowCloud(regions=args.regions)
+    bc = billowCloud(regions=args.regions)
     services = bc.get_service(args.service)
     if not services:
         sys.stderr.write('no service found\n')
         sys.exit(errno.ENOENT)
     for s in services:
-        r = billow.billowRotate(s)
+        r = billowRotate(s)
         r.register(args.instance, wait=wait, timeout=args.timeout,
                 healthy=True)
 
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print str(o)
@@ -684,6 +762,8 @@ def billow_rotate_register():
 
 
 def billow_rotate_terminate():
+    from .billowCloud import billowCloud
+    from .billowRotate import billowRotate
     catch_sigint()
     parser = common_parser('billow rotate terminate')
     parsergroup = parser.add_mutually_exclusive_group()
@@ -723,26 +803,26 @@ def billow_rotate_terminate():
         help='instances to terminate'
     )
     args = parser.parse_args()
-    common_args(args)
+    common_args(args, refresh=True)
     wait = True
     if args.nowait:
         wait = False
 
     output = list()
-    bc = billow.billowCloud(regions=args.regions)
+    bc = billowCloud(regions=args.regions)
     services = bc.get_service(args.service)
     if not services:
         sys.stderr.write('no service found\n')
         sys.exit(errno.ENOENT)
     for s in services:
-        r = billow.billowRotate(s)
+        r = billowRotate(s)
         for i in args.instance:
             r.terminate(i, wait=wait, timeout=args.timeout)
 
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print str(o)
@@ -751,6 +831,8 @@ def billow_rotate_terminate():
 
 
 def billow_rotate_instance():
+    from .billowCloud import billowCloud
+    from .billowRotate import billowRotate
     catch_sigint()
     parser = common_parser('billow rotate instance')
     parsergroup = parser.add_mutually_exclusive_group()
@@ -789,25 +871,25 @@ def billow_rotate_instance():
         help='instance to rotate'
     )
     args = parser.parse_args()
-    common_args(args)
+    common_args(args, refresh=True)
     wait = True
     if args.nowait:
         wait = False
 
     output = list()
-    bc = billow.billowCloud(regions=args.regions)
+    bc = billowCloud(regions=args.regions)
     services = bc.get_service(args.service)
     if not services:
         sys.stderr.write('no service found\n')
         sys.exit(errno.ENOENT)
     for s in services:
-        r = billow.billowRotate(s)
+        r = billowRotate(s)
         r.rotate_instance(args.instance, wait=wait, timeout=args.timeout)
 
     if args.json:
         print json.dumps(output, indent=4, separators=(',', ': '))
     elif args.yaml:
-        print yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+        print yaml_dump(output)
     else:
         for o in output:
             print str(o)
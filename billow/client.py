@@ -0,0 +1,118 @@
+"""
+billowd client
+
+Command line tools ask a running billowd before doing the work themselves.
+Kept apart from the daemon so they do not load the server to find out.
+"""
+from . import commands
+import json
+import os
+import socket
+
+# Seconds to wait on billowd, a daemon that hangs is treated as absent
+timeout = 30
+
+
+def default_path():
+    from .util import cache_dir
+    if 'BILLOW_SOCKET' in os.environ:
+        return os.environ['BILLOW_SOCKET']
+    return cache_dir('billowd.sock')
+
+
+def plain(value):
+    """
+    JSON strings come back unicode, billow compares and prints str
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [plain(v) for v in value]
+    if isinstance(value, dict):
+        return dict((plain(k), plain(v)) for k, v in value.iteritems())
+    return value
+
+
+def connect(path):
+    """
+    socket connected to billowd, None when nothing is listening
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(path)
+    except socket.error:
+        s.close()
+        return None
+    return s
+
+
+def query(command, regions, snapshot=False, refresh=False, path=None, **args):
+    """
+    billowd's reply to a command, None when no daemon answers
+    """
+    path = path or default_path()
+    if not os.path.exists(path):
+        return None
+    s = connect(path)
+    if not s:
+        return None
+
+    request = {
+        'command': command,
+        'regions': regions,
+        'snapshot': snapshot,
+        'refresh': refresh,
+        'args': args,
+    }
+    try:
+        s.sendall(json.dumps(request) + '\n')
+        line = s.makefile('r').readline()
+    except (socket.error, socket.timeout):
+        return None
+    finally:
+        s.close()
+    if not line:
+        return None
+    return plain(json.loads(line))
+
+
+def available(args):
+    """
+    Command line tools ask billowd unless they record, replay, count calls
+    or skip caches, which only make sense in their own process
+    """
+    if args.record or args.replay or args.stats or args.no_cache:
+        return False
+    return listening()
+
+
+def listening(path=None):
+    """
+    True when billowd answers on path, a socket file left behind by one
+    that exited is not enough
+    """
+    s = connect(path or default_path())
+    if not s:
+        return False
+    s.close()
+    return True
+
+
+def call(args, command, **kw):
+    """
+    billowd's output for a command line tool, None when it should run the
+    command itself.  Raises CommandError as the command would.
+    """
+    if not available(args):
+        return None
+    reply = query(command, args.regions,
+                  snapshot=getattr(args, 'snapshot', False),
+                  refresh=args.refresh, **kw)
+    if reply is None:
+        return None
+    for w in reply.get('warnings', []):
+        commands.warn(w)
+    if 'error' in reply:
+        raise commands.CommandError(reply['error'], reply['code'])
+    return reply['output']
@@ -0,0 +1,77 @@
+"""
+billow clocks
+
+Everything that waits on AWS asks a clock for the time and to sleep, so a
+simulated backend can run on virtual time.
+"""
+import threading
+import time
+
+
+class clock(object):
+
+    """
+    wall clock
+    """
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class virtualclock(object):
+
+    """
+    clock that only moves when slept on, sleeping returns immediately
+
+    Each thread sleeps on its own time, so threads waiting side by side take
+    as long as the longest of them rather than all of them.  A thread starts
+    from the latest time reached by threads that have finished or by a
+    thread running alone, and catches up to the latest time any thread has
+    reached once it is alone.
+    """
+
+    def __init__(self, start=None):
+        if start is None:
+            start = time.time()
+        self.now = float(start)
+        self.slept = 0.0
+        self.lock = threading.Lock()
+
+        # thread -> its time, and where threads new to the clock start
+        self.threads = dict()
+        self.joined = self.now
+
+    def __thread(self):
+        current = threading.current_thread()
+        for t in self.threads.keys():
+            if t is not current and not t.is_alive():
+                self.joined = max(self.joined, self.threads.pop(t))
+        if current not in self.threads:
+            self.threads[current] = self.joined
+        if len(self.threads) == 1:
+            self.threads[current] = self.joined = self.now
+        return current
+
+    def time(self):
+        with self.lock:
+            return self.threads[self.__thread()]
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        with self.lock:
+            current = self.__thread()
+            self.threads[current] += seconds
+            self.now = max(self.now, self.threads[current])
+            self.slept += seconds
+
+    def advance(self, seconds):
+        self.sleep(seconds)
+
+
+# Clock used when none is given
+default = clock()
@@ -0,0 +1,127 @@
+"""
+billow commands as data, shared by the command line tools and billowd
+"""
+import errno
+import sys
+
+
+class CommandError(Exception):
+
+    """
+    A command that cannot answer, code is the exit status
+    """
+
+    def __init__(self, message, code=1):
+        Exception.__init__(self, message)
+        self.message = message
+        self.code = code
+
+
+def warn(message):
+    sys.stderr.write('WARNING: %s\n' % message)
+
+
+def get_services(bc, service):
+    services = bc.get_service(service)
+    if not services:
+        raise CommandError('no service found', errno.ENOENT)
+    return services
+
+
+def list_services(bc, warn=warn):
+    output = list()
+    for s in bc.list_services():
+        output.append(str(s))
+    return output
+
+
+def get(bc, services, info=False, warn=warn):
+    output = list()
+    for s in get_services(bc, services):
+        if info:
+            output.append(s.info())
+        else:
+            output.append(s.config())
+    return output
+
+
+def find_images(bc, image, warn=warn):
+    from .billowImage import billowImage
+    if '-' not in image:
+        raise CommandError('service-environ required')
+
+    service = image.rsplit('-')[0]
+    environ = image.rsplit('-')[1]
+
+    output = list()
+    for r in bc.regions:
+        i = billowImage(region=r.region, parent=r)
+        images = i.list_dated_newest(service, environ)
+        for image in images:
+            output.append({
+                'id': image.id,
+                'name': image.name,
+                'description': image.description
+            })
+    return output
+
+
+def list_rotate(bc, service, force_all=False, warn=warn):
+    from .billowRotate import billowRotate
+    output = list()
+    for s in get_services(bc, service):
+        r = billowRotate(s)
+        warnings = r.safety()
+        for w in warnings:
+            warn(w)
+
+        for i in r.order(incremental=not force_all):
+            output.append(i)
+    return output
+
+
+def rotate_status(bc, service, force_all=False, warn=warn):
+    from .billowRotate import billowRotate
+    output = list()
+    for s in get_services(bc, service):
+        r = billowRotate(s)
+        for g in s.groups:
+            g.refresh()
+        for o in r.order(incremental=not force_all):
+            group = r.find_group_by_instance(o)
+            (healthy, status) = r.status_check(group, o, sleep=0, timeout=0)
+            output.append({
+                'instance': o,
+                'healthy': healthy,
+                'status': status
+                })
+    return output
+
+
+commands = {
+    'list': list_services,
+    'get': get,
+    'find-images': find_images,
+    'list-rotate': list_rotate,
+    'rotate-status': rotate_status,
+}
+
+
+def run(args, command, **kw):
+    """
+    Output of a command line tool, from billowd when it is running, else
+    worked out here.  Errors exit with their code.
+    """
+    from . import client
+    try:
+        output = client.call(args, command, **kw)
+        if output is None:
+            # only now load the models, and boto with them
+            from .billowCloud import billowCloud
+            bc = billowCloud(regions=args.regions,
+                             snapshot=getattr(args, 'snapshot', False))
+            output = commands[command](bc, **kw)
+    except CommandError as e:
+        sys.stderr.write('%s\n' % e.message)
+        sys.exit(e.code)
+    return output
@@ -0,0 +1,244 @@
+"""
+billowd
+
+Keeps billowCloud objects and AWS connections warm and answers billow
+commands over a Unix socket, one JSON request and one JSON reply line per
+connection.  Answers are kept for maxage seconds, and those still being
+asked for are recomputed in the background before they go stale.
+"""
+from . import commands
+from .billowCloud import billowCloud
+from .client import connect, default_path, plain
+from .clock import default as default_clock
+import argparse
+import errno
+import json
+import os
+import socket
+import SocketServer
+import sys
+import threading
+
+# Commands always answered from AWS, they report what is happening now
+live = ['rotate-status']
+
+
+class billowd(object):
+
+    """
+    warm billowClouds per set of regions, and recent answers
+    """
+
+    def __init__(self, maxage=30, interval=10, idle=600, clock=None):
+        self.maxage = maxage
+        self.interval = interval
+        self.idle = idle
+        self.clock = clock or default_clock
+        self.lock = threading.Lock()
+        self.clouds = dict()
+        self.answers = dict()
+
+    def cloud(self, regions, snapshot=False):
+        """
+        (billowCloud, lock), one per set of regions, the lock serializes
+        everything done with that cloud
+        """
+        key = (tuple(regions), bool(snapshot))
+        with self.lock:
+            if key not in self.clouds:
+                self.clouds[key] = {
+                    'cloud': billowCloud(regions=list(regions),
+                                         snapshot=snapshot),
+                    'lock': threading.Lock(),
+                }
+            self.clouds[key]['used'] = self.clock.time()
+            return (self.clouds[key]['cloud'], self.clouds[key]['lock'])
+
+    def compute(self, request, refresh=False):
+        """
+        refresh=True rediscovers services first, so the command sees groups,
+        instances and balancers as they are now rather than as last loaded
+        """
+        func = commands.commands.get(request.get('command'))
+        if not func:
+            return {
+                'error': 'unknown command %s' % request.get('command'),
+                'code': errno.EINVAL
+            }
+
+        (bc, lock) = self.cloud(request['regions'], request.get('snapshot'))
+        warnings = list()
+        reply = {'warnings': warnings}
+        with lock:
+            try:
+                if refresh:
+                    bc.list_services()
+                reply['output'] = func(bc, warn=warnings.append,
+                                       **request.get('args', {}))
+            except commands.CommandError as e:
+                reply['error'] = e.message
+                reply['code'] = e.code
+            except Exception as e:
+                sys.stderr.write('%s failed: %s\n' % (request['command'], e))
+                reply['error'] = str(e)
+                reply['code'] = 1
+        return reply
+
+    def answer(self, request):
+        refresh = request.pop('refresh', False)
+        key = json.dumps(request, sort_keys=True)
+        if request.get('command') in live:
+            return self.compute(request, refresh=refresh)
+
+        now = self.clock.time()
+        with self.lock:
+            cached = self.answers.get(key)
+            if cached:
+                cached['asked'] = now
+        if cached and not refresh and now - cached['time'] < self.maxage:
+            return cached['reply']
+
+        reply = self.compute(request, refresh=refresh)
+        with self.lock:
+            self.answers[key] = {
+                'request': request,
+                'reply': reply,
+                'time': now,
+                'asked': now,
+            }
+        return reply
+
+    def refresh(self):
+        """
+        Forget what nobody asked for lately, rediscover services and
+        recompute the answers that would go stale before the next refresh
+        """
+        now = self.clock.time()
+        with self.lock:
+            for key, a in self.answers.items():
+                if now - a['asked'] > self.idle:
+                    del self.answers[key]
+            for key, c in self.clouds.items():
+                if now - c['used'] > self.idle:
+                    del self.clouds[key]
+            clouds = self.clouds.values()
+            answers = self.answers.items()
+
+        for c in clouds:
+            with c['lock']:
+                c['cloud'].list_services()
+
+        for key, a in answers:
+            if now - a['time'] < self.maxage - self.interval:
+                continue
+            reply = self.compute(a['request'])
+            with self.lock:
+                if key in self.answers:
+                    self.answers[key]['reply'] = reply
+                    self.answers[key]['time'] = now
+
+    def run(self):
+        while True:
+            self.clock.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                sys.stderr.write('refresh failed: %s\n' % e)
+
+
+class handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = plain(json.loads(line))
+        except ValueError:
+            reply = {'error': 'bad request', 'code': errno.EINVAL}
+        else:
+            reply = self.server.billowd.answer(request)
+        self.wfile.write(json.dumps(reply) + '\n')
+
+
+class server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, billowd):
+        self.billowd = billowd
+        SocketServer.UnixStreamServer.__init__(self, path, handler)
+
+
+def serve(path=None, daemon=None):
+    """
+    Answer on path until interrupted, refreshing in the background
+    """
+    path = path or default_path()
+    daemon = daemon or billowd()
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0700)
+    if os.path.exists(path):
+        running = connect(path)
+        if running:
+            running.close()
+            raise socket.error(errno.EADDRINUSE,
+                               'billowd already listening on %s' % path)
+        os.unlink(path)
+
+    # the socket is created owner only, not opened up until a chmod
+    umask = os.umask(0177)
+    try:
+        s = server(path, daemon)
+    finally:
+        os.umask(umask)
+    refresher = threading.Thread(target=daemon.run)
+    refresher.daemon = True
+    refresher.start()
+    try:
+        s.serve_forever()
+    finally:
+        s.server_close()
+        os.unlink(path)
+
+
+def main():
+    from .util import catch_sigint
+    catch_sigint()
+    parser = argparse.ArgumentParser(
+        description='billow daemon',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-s',
+        '--socket',
+        help='unix socket to answer on, default $BILLOW_SOCKET or '
+             '~/.cache/billow/billowd.sock'
+    )
+    parser.add_argument(
+        '--max-age',
+        type=int,
+        default=30,
+        help='seconds an answer is served before it is recomputed'
+    )
+    parser.add_argument(
+        '--interval',
+        type=int,
+        default=10,
+        help='seconds between background refreshes'
+    )
+    parser.add_argument(
+        '--idle',
+        type=int,
+        default=600,
+        help='seconds an answer is kept fresh after it was last asked for'
+    )
+    args = parser.parse_args()
+
+    d = billowd(maxage=args.max_age, interval=args.interval, idle=args.idle)
+    try:
+        serve(args.socket, d)
+    except socket.error as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(errno.EADDRINUSE)
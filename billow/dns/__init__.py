@@ -3,17 +3,13 @@ billow DNS API
 """
 import billow
 from billow import aws
-import boto.route53
-import boto.route53.exception
-import boto.route53.zone
-import boto.sts
 
 
 class dns(object):
 
     def __init__(self, region):
         self.region = region
-        self.aws = aws.aws()
+        self.aws = aws.aws(region=self.region)
         self.r53 = None
         self.sts = None
         self.ststok = None
@@ -21,25 +17,22 @@ class dns(object):
 
     def __connect(self, role=None):
         if not self.sts:
-            self.sts = boto.sts.connect_to_region(self.region,
-                                                  aws_access_key_id=self.aws.access_key(),
-                                                  aws_secret_access_key=self.aws.secret_key())
+            self.sts = self.aws.connect('sts')
 
         if role:
             if not self.ststok or role != self.role:
                 self.role = role
-                self.ststok = self.sts.assume_role(role, 'billow')
-                self.r53 = boto.connect_route53(
-                    aws_access_key_id=self.ststok.credentials.access_key,
-                    aws_secret_access_key=self.ststok.credentials.secret_key,
+                self.ststok = self.aws.wrap(self.sts.assume_role, role,
+                                            'billow')
+                self.r53 = self.aws.connect(
+                    'route53',
+                    access_key=self.ststok.credentials.access_key,
+                    secret_key=self.ststok.credentials.secret_key,
                     security_token=self.ststok.credentials.session_token
                 )
 
         if not self.r53:
-            self.r53 = boto.connect_route53(
-                aws_access_key_id=self.aws.access_key(),
-                aws_secret_access_key=self.aws.secret_key()
-            )
+            self.r53 = self.aws.connect('route53')
 
     def get_records(self, dnsname, role=None):
         self.__connect(role=role)
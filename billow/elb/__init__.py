@@ -4,26 +4,23 @@ billow Load Balancer API
 import billow
 from billow import aws
 import boto
-import boto.ec2
-import boto.ec2.elb
 
 
 class elb(object):
 
     def __init__(self, region):
         self.region = region
-        self.aws = aws.aws()
+        self.aws = aws.aws(region=self.region)
         self.elb = None
 
         self.default_idle_timeout = 60
 
+        # API limit on the number of names per request
+        self.chunk_elbs = 20
+
     def _connect(self):
         if not self.elb:
-            self.elb = boto.ec2.elb.connect_to_region(
-                self.region,
-                aws_access_key_id=self.aws.access_key(),
-                aws_secret_access_key=self.aws.secret_key()
-            )
+            self.elb = self.aws.connect('elb')
 
     def list_elbs(self):
         """
@@ -53,9 +50,13 @@ class elb(object):
         if not isinstance(names, list):
             names = [names]
 
+        self._connect()
+
+        return self.aws.chunked(self._get_elb, names, self.chunk_elbs)
+
+    def _get_elb(self, names):
         elbs = list()
         marker = None
-        self._connect()
 
         while True:
             e = self.aws.wrap(
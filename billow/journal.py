@@ -0,0 +1,110 @@
+"""
+billow rotation journal
+
+billowRotate appends one JSON record per line as each instance passes a
+phase of its rotation, flushed to disk before moving on, so a rotation that
+was interrupted can be resumed from what it had finished:
+
+    notified    termination URL called
+    detached    elastic and secondary private IPs being taken from the instance
+    launching   desired capacity raised, with the group's instances before
+    terminating instance being terminated, with the group's instances before
+                when terminated ahead of its replacement
+    launched    replacement instance in service
+    reattached  addresses put on the replacement
+    healthy     replacement passing balancer health checks
+    done        instance replaced
+
+A 'start' record begins each rotation, only records after the last one are
+read back.
+"""
+from .clock import default as default_clock
+import json
+import os
+import threading
+
+
+def default_path(service):
+    """
+    ~/.cache/billow/rotate/service-env:region.journal
+    """
+    from .util import cache_dir
+    return cache_dir('rotate', '%s.journal' % service)
+
+
+class journal(object):
+
+    """
+    append-only rotation journal in a file
+    """
+
+    def __init__(self, path, clock=None):
+        self.path = path
+        self.clock = clock or default_clock
+        self.lock = threading.Lock()
+
+    def record(self, phase, instance=None, **data):
+        entry = {'time': self.clock.time(), 'phase': phase}
+        if instance:
+            entry['instance'] = instance
+        entry.update(data)
+        line = json.dumps(entry, sort_keys=True) + '\n'
+
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def records(self):
+        """
+        Records of the last rotation started, a torn last line is skipped
+        """
+        records = list()
+        if not os.path.exists(self.path):
+            return records
+        with self.lock:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('phase') == 'start':
+                        records = list()
+                    records.append(entry)
+        return records
+
+    def instances(self):
+        """
+        [(instance_id, {phase: record})] in the order rotation began, each
+        'notified' starting that instance over
+        """
+        order = list()
+        phases = dict()
+        for entry in self.records():
+            instance = entry.get('instance')
+            if not instance:
+                continue
+            if instance not in phases or entry['phase'] == 'notified':
+                if instance not in phases:
+                    order.append(instance)
+                phases[instance] = dict()
+            phases[instance][entry['phase']] = entry
+        return [(i, phases[i]) for i in order]
+
+    def unfinished(self):
+        return [(i, p) for (i, p) in self.instances() if 'done' not in p]
+
+    def replacements(self):
+        """
+        Instances launched to replace others in the last rotation
+        """
+        launched = list()
+        for (i, p) in self.instances():
+            if 'launched' in p:
+                launched.append(p['launched']['replacement'])
+        return launched
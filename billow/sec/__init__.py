@@ -4,42 +4,66 @@ billow Security API
 import billow
 from billow import aws
 import boto
-import boto.ec2
 
 
 class sec(object):
 
     def __init__(self, region):
         self.region = region
-        self.aws = aws.aws()
+        self.aws = aws.aws(region=self.region)
         self.ec2 = None
         self.account_id = None
 
+        # ids per request, keeping request size reasonable
+        self.chunk_groups = 100
+
     def __connect(self):
         if not self.ec2:
-            self.ec2 = boto.ec2.connect_to_region(
-                self.region,
-                aws_access_key_id=self.aws.access_key(),
-                aws_secret_access_key=self.aws.secret_key()
-            )
+            self.ec2 = self.aws.connect('ec2')
 
     def get_account_id(self):
         if not self.account_id:
-            iam = boto.connect_iam()
-            self.account_id = iam.get_user()['get_user_response']['get_user_result'][
+            iam = self.aws.connect('iam')
+            user = self.aws.wrap(iam.get_user)
+            self.account_id = user['get_user_response']['get_user_result'][
                 'user']['arn'].split(':')[4]
         return self.account_id
 
-    def get_groups(self, groups):
+    def list_groups(self):
         """
-        get SecurityGroups in a region
+        list all SecurityGroups in a region
         """
-        sgroups = list()
         self.__connect()
 
+        sgroups = self.aws.wrap(
+            self.ec2.get_all_security_groups
+        )
+
+        return list(sgroups)
+
+    def get_groups(self, groups, known=None):
+        """
+        get SecurityGroups in a region, taking those in known (id ->
+        SecurityGroup, gathered elsewhere) from there
+        """
         if not isinstance(groups, list):
             groups = [groups]
 
+        sgroups = list()
+        if known is not None:
+            sgroups = [known[x] for x in groups if x in known]
+            groups = [x for x in groups if x not in known]
+        if not groups:
+            return sgroups
+
+        self.__connect()
+        sgroups.extend(self.aws.chunked(self.__get_groups, groups,
+                                        self.chunk_groups))
+        return sgroups
+
+    def __get_groups(self, groups):
+        sgroups = list()
+
         a = self.aws.wrap(
             self.ec2.get_all_security_groups,
             group_ids=groups
@@ -0,0 +1,1053 @@
+"""
+billow simulated AWS provider
+
+An in-process stand-in for the AutoScale, EC2/VPC, ELB, Route53, STS and IAM
+calls made by the billow backends.  Responses are real boto model objects,
+so everything above the backends runs unmodified.  Groups launch and
+terminate instances, balancers register them and pass health checks after
+configurable delays, and calls can be slowed down or throttled.
+
+    s = sim.simulator(clock=clock.virtualclock(), latency=0.01)
+    s.generate(regions=['us-east-1'], services=2500, groups=4, instances=10)
+    sim.install(s)
+"""
+from billow import aws
+from billow import clock as clocks
+from boto.ec2.autoscale.activity import Activity
+from boto.ec2.autoscale.group import AutoScalingGroup
+from boto.ec2.autoscale.instance import Instance as GroupInstance
+from boto.ec2.autoscale.launchconfig import LaunchConfiguration
+from boto.ec2.autoscale.tag import Tag
+from boto.ec2.address import Address
+from boto.ec2.elb.attributes import LbAttributes
+from boto.ec2.elb.healthcheck import HealthCheck
+from boto.ec2.elb.instancestate import InstanceState as BalancerState
+from boto.ec2.elb.listener import Listener
+from boto.ec2.elb.loadbalancer import LoadBalancer
+from boto.ec2.elb.policies import Policies
+from boto.ec2.group import Group
+from boto.ec2.image import Image
+from boto.ec2.instance import Instance, InstanceState, Reservation
+from boto.ec2.instancestatus import InstanceStatus, Status
+from boto.ec2.networkinterface import (Attachment, NetworkInterface,
+                                       PrivateIPAddress)
+from boto.ec2.securitygroup import GroupOrCIDR, IPPermissions, SecurityGroup
+from boto.exception import BotoServerError
+from boto.resultset import ResultSet
+from boto.route53.record import Record
+from boto.sts.credentials import AssumedRole, Credentials
+from boto.vpc.subnet import Subnet
+from contextlib import contextmanager
+import datetime
+import fnmatch
+import itertools
+import random
+import threading
+
+ACCOUNT_ID = '123456789012'
+
+
+def error(status, code, message=''):
+    body = '<Response><Errors><Error><Code>%s</Code><Message>%s</Message>' \
+        '</Error></Errors></Response>' % (code, message)
+    return BotoServerError(status, code, body)
+
+
+def page(items, next_token, size, attr='next_token'):
+    """
+    ResultSet holding one page of items, with the token for the next page
+    """
+    start = int(next_token or 0)
+    rs = ResultSet()
+    rs.extend(items[start:start + size])
+    nxt = None
+    if start + size < len(items):
+        nxt = str(start + size)
+    setattr(rs, attr, nxt)
+    return rs
+
+
+def timestamp(t):
+    return datetime.datetime.utcfromtimestamp(t).strftime(
+        '%Y-%m-%dT%H:%M:%S.000Z')
+
+
+class siminstance(object):
+
+    __slots__ = ('id', 'group', 'zone', 'subnet', 'config', 'image',
+                 'private_ip', 'secondary', 'launched', 'terminating',
+                 'terminated')
+
+    def __init__(self, id, group, zone, subnet, config, image, private_ip,
+                 launched):
+        self.id = id
+        self.group = group
+        self.zone = zone
+        self.subnet = subnet
+        self.config = config
+        self.image = image
+        self.private_ip = private_ip
+        self.secondary = list()
+        self.launched = launched
+        self.terminating = None
+        self.terminated = None
+
+
+class simgroup(object):
+
+    def __init__(self, name, config, zones, subnets, balancers, size,
+                 min_size, max_size, tags):
+        self.name = name
+        self.config = config
+        self.zones = zones
+        # zone -> subnet id
+        self.subnets = subnets
+        self.balancers = balancers
+        self.desired = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.tags = tags
+        self.instances = list()
+        self.activities = list()
+
+
+class simbalancer(object):
+
+    def __init__(self, name, zones, subnets, security_groups, interval=30,
+                 healthy=3, unhealthy=5, timeout=5, draining=0,
+                 crosszone=True):
+        self.name = name
+        self.zones = zones
+        self.subnets = subnets
+        self.security_groups = security_groups
+        self.interval = interval
+        self.healthy = healthy
+        self.unhealthy = unhealthy
+        self.timeout = timeout
+        self.draining = draining
+        self.crosszone = crosszone
+        # instance id -> [registered time, deregistered time or None]
+        self.members = dict()
+
+    @property
+    def healthy_time(self):
+        return self.interval * self.healthy
+
+
+class simregion(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.groups = dict()
+        self.grouporder = list()
+        self.configs = dict()
+        self.configorder = list()
+        self.instances = dict()
+        self.balancers = dict()
+        self.balancerorder = list()
+        self.sgroups = dict()
+        self.subnets = dict()
+        self.images = list()
+        self.addresses = dict()
+        # instances with lifecycle transitions still to happen
+        self.active = set()
+
+
+class simulator(object):
+
+    """
+    Simulated AWS account.
+
+    clock provides time() and sleep(), defaulting to the wall clock.  With a
+    billow.clock.virtualclock, shared with billowRotate, simulated waits
+    take no real time.
+    latency is seconds per call, or a (min, max) range.  throttle is the
+    probability of a call failing with Throttling.  boot_time is how long a
+    launched instance stays Pending, terminate_time how long a terminating
+    instance takes to disappear after connection draining.
+    """
+
+    def __init__(self, clock=None, latency=0, throttle=0, seed=None,
+                 boot_time=60, terminate_time=30):
+        self.clock = clock or clocks.default
+        self.latency = latency
+        self.throttle = throttle
+        self.boot_time = boot_time
+        self.terminate_time = terminate_time
+        self.random = random.Random(seed)
+        self.regions = dict()
+        self.zones = dict()
+        self.lock = threading.RLock()
+        self.counter = itertools.count(1)
+        self.calls = 0
+
+    def region(self, name):
+        if name not in self.regions:
+            self.regions[name] = simregion(name)
+        return self.regions[name]
+
+    def connect(self, service, region, **kw):
+        connections = {
+            'autoscale': simautoscale,
+            'ec2': simec2,
+            'elb': simelb,
+            'iam': simiam,
+            'route53': simroute53,
+            'sts': simsts,
+        }
+        return connections[service](self, region)
+
+    def newid(self, prefix):
+        return '%s-%08x' % (prefix, next(self.counter))
+
+    def newip(self):
+        n = next(self.counter)
+        return '10.%d.%d.%d' % ((n >> 16) & 255, (n >> 8) & 255, n & 255)
+
+    @contextmanager
+    def call(self, region):
+        """
+        Simulate one API call: latency, throttling, then exclusive access to
+        the region with all due lifecycle transitions applied
+        """
+        latency = self.latency
+        if isinstance(latency, (list, tuple)):
+            latency = self.random.uniform(latency[0], latency[1])
+        if latency:
+            self.clock.sleep(latency)
+
+        with self.lock:
+            self.calls += 1
+            if self.throttle and self.random.random() < self.throttle:
+                raise error(400, 'Throttling', 'Rate exceeded')
+            r = self.region(region) if region else None
+            if r:
+                self.tick(r)
+            yield r
+
+    #
+    # Lifecycle
+    #
+
+    def drain_time(self, r, g):
+        drain = 0
+        for b in g.balancers:
+            if b in r.balancers:
+                drain = max(drain, r.balancers[b].draining)
+        return drain
+
+    def group_state(self, r, inst, now):
+        if inst.terminated is not None:
+            return 'Terminated'
+        if inst.terminating is not None:
+            return 'Terminating'
+        if now < inst.launched + self.boot_time:
+            return 'Pending'
+        return 'InService'
+
+    def instance_state(self, r, inst, now):
+        if inst.terminated is not None:
+            return (48, 'terminated')
+        if inst.terminating is not None:
+            drain = self.drain_time(r, r.groups[inst.group])
+            if now >= inst.terminating + drain:
+                return (32, 'shutting-down')
+            return (16, 'running')
+        if now < inst.launched + self.boot_time / 2.0:
+            return (0, 'pending')
+        return (16, 'running')
+
+    def balancer_state(self, r, b, iid, now):
+        """
+        (state, reason, description) or None when no longer registered
+        """
+        registered, deregistered = b.members[iid]
+        if deregistered is not None:
+            if now < deregistered + b.draining:
+                return ('InService', 'N/A',
+                        'Instance deregistration currently in progress.')
+            return None
+        inst = r.instances.get(iid)
+        if not inst or inst.terminating is not None:
+            return ('OutOfService', 'Instance',
+                    'Instance is in terminated state.')
+        if now < registered + b.healthy_time:
+            return ('OutOfService', 'Instance',
+                    'Instance has not passed the configured HealthyThreshold '
+                    'number of health checks consecutively.')
+        return ('InService', 'N/A', 'N/A')
+
+    def tick(self, r):
+        now = self.clock.time()
+        for iid in list(r.active):
+            inst = r.instances[iid]
+            g = r.groups[inst.group]
+            if inst.terminating is not None:
+                done = inst.terminating + self.drain_time(r, g) + \
+                    self.terminate_time
+                if now >= done:
+                    inst.terminated = done
+                    if iid in g.instances:
+                        g.instances.remove(iid)
+                    for b in g.balancers:
+                        if b in r.balancers:
+                            r.balancers[b].members.pop(iid, None)
+                    r.active.discard(iid)
+                continue
+            inservice = inst.launched + self.boot_time
+            if now >= inservice:
+                # groups register instances as they come into service
+                for b in g.balancers:
+                    if b in r.balancers:
+                        r.balancers[b].members[iid] = [inservice, None]
+                r.active.discard(iid)
+
+    def live(self, r, g):
+        return [i for i in g.instances if r.instances[i].terminating is None]
+
+    def launch(self, r, g, now):
+        counts = dict((z, 0) for z in g.zones)
+        for i in self.live(r, g):
+            counts[r.instances[i].zone] += 1
+        zone = min(g.zones, key=lambda z: (counts[z], g.zones.index(z)))
+        config = r.configs[g.config]
+        inst = siminstance(self.newid('i'), g.name, zone, g.subnets[zone],
+                           g.config, config.image_id, self.newip(), now)
+        r.instances[inst.id] = inst
+        g.instances.append(inst.id)
+        r.active.add(inst.id)
+        self.activity(g, now, 'Launching a new EC2 instance: %s' % inst.id)
+        return inst
+
+    def terminate(self, r, g, inst, now):
+        inst.terminating = now
+        for b in g.balancers:
+            if b in r.balancers and inst.id in r.balancers[b].members:
+                r.balancers[b].members[inst.id][1] = now
+        r.active.add(inst.id)
+        return self.activity(g, now, 'Terminating EC2 instance: %s' % inst.id)
+
+    def reconcile(self, r, g, now):
+        """
+        Launch or terminate instances until the group is at desired capacity
+        """
+        live = self.live(r, g)
+        while len(live) < g.desired:
+            live.append(self.launch(r, g, now).id)
+        for iid in live[:max(0, len(live) - g.desired)]:
+            self.terminate(r, g, r.instances[iid], now)
+
+    def activity(self, g, now, description):
+        a = Activity()
+        a.activity_id = self.newid('activity')
+        a.group_name = g.name
+        a.start_time = timestamp(now)
+        a.end_time = None
+        a.progress = 0
+        a.status_code = 'InProgress'
+        a.description = description
+        a.cause = 'billow simulator'
+        a.status_message = None
+        g.activities.insert(0, a)
+        return a
+
+    #
+    # Fleet
+    #
+
+    def add_subnet(self, region, zone, cidr):
+        r = self.region(region)
+        sid = self.newid('subnet')
+        r.subnets[sid] = (cidr, zone)
+        return sid
+
+    def add_security_group(self, region, name, rules=None):
+        """
+        rules is a list of (protocol, from_port, to_port, cidr or group id)
+        """
+        r = self.region(region)
+        sgid = self.newid('sg')
+        r.sgroups[sgid] = (name, rules or list())
+        return sgid
+
+    def add_image(self, region, name, description=None):
+        r = self.region(region)
+        ami = self.newid('ami')
+        r.images.append((ami, name, description or name))
+        return ami
+
+    def add_config(self, region, name, image_id, security_groups,
+                   instance_type='m3.medium'):
+        r = self.region(region)
+        lc = LaunchConfiguration(name=name, image_id=image_id,
+                                 key_name='billow',
+                                 security_groups=security_groups,
+                                 instance_type=instance_type,
+                                 associate_public_ip_address=False)
+        r.configs[name] = lc
+        r.configorder.append(name)
+        return lc
+
+    def add_balancer(self, region, name, zones, subnets, security_groups,
+                     **kw):
+        r = self.region(region)
+        b = simbalancer(name, zones, subnets, security_groups, **kw)
+        r.balancers[name] = b
+        r.balancerorder.append(name)
+        return b
+
+    def add_group(self, region, name, config, zones, subnets, size,
+                  balancers=None, min_size=None, max_size=None, tags=None,
+                  age=86400):
+        """
+        Add a group already running size instances, launched age seconds ago
+        and registered with its balancers
+        """
+        r = self.region(region)
+        if min_size is None:
+            min_size = 0
+        if max_size is None:
+            max_size = size * 2
+        g = simgroup(name, config, zones, subnets, balancers or list(),
+                     size, min_size, max_size, tags or dict())
+        r.groups[name] = g
+        r.grouporder.append(name)
+
+        now = self.clock.time()
+        for n in range(size):
+            inst = self.launch(r, g, now - age)
+            r.active.discard(inst.id)
+            for b in g.balancers:
+                r.balancers[b].members[inst.id] = [now - age, None]
+        g.activities = list()
+        return g
+
+    def add_zone(self, name, records):
+        """
+        records is a list of (name, type, value), where an A record value
+        is taken as an alias target
+        """
+        self.zones[name.rstrip('.')] = records
+
+    def generate(self, regions=['us-east-1'], services=10, environ='prod',
+                 groups=2, instances=4, balancers=1, zones=3,
+                 draining=0, zone=None, zone_records=0):
+        """
+        Populate each region with services, each with groups of instances
+        behind balancers.  With zone, also build a route53 zone holding a
+        record per balancer, padded to zone_records records.
+        """
+        if not isinstance(regions, list):
+            regions = [regions]
+
+        records = list()
+        for region in regions:
+            azs = ['%s%s' % (region, chr(ord('a') + n))
+                   for n in range(zones)]
+            subnets = dict()
+            for n, az in enumerate(azs):
+                subnets[az] = self.add_subnet(region, az, '10.0.%d.0/24' % n)
+            default_sg = self.add_security_group(
+                region, 'default', [('tcp', 22, 22, '10.0.0.0/8')])
+
+            for s in range(services):
+                service = 'svc%04d' % s
+                sg = self.add_security_group(
+                    region, '%s-%s' % (service, environ),
+                    [('tcp', 80, 80, default_sg), ('tcp', 443, 443,
+                                                   '0.0.0.0/0')])
+                stamp = '20260101%06d' % s
+                image = self.add_image(region, '%s-%s-%s' % (
+                    environ, service, stamp))
+                config = '%s-%s-%s' % (environ, service, stamp)
+                self.add_config(region, config, image, [sg, default_sg])
+
+                elbs = list()
+                for n in range(balancers):
+                    name = '%s-%s-%d' % (service, environ, n)
+                    self.add_balancer(region, name, azs,
+                                      [subnets[z] for z in azs], [sg],
+                                      draining=draining)
+                    elbs.append(name)
+                    if zone:
+                        records.append((
+                            '%s-%s-%d.%s' % (service, environ, n, zone),
+                            'CNAME', '%s.%s.elb.amazonaws.com' % (
+                                name, region)))
+
+                for n in range(groups):
+                    tags = {
+                        'service': service,
+                        'env': environ,
+                        'cluster': '%s-%d' % (service, n)
+                    }
+                    self.add_group(region, '%s-%s-%d' % (
+                        service, environ, n), config, azs, subnets,
+                        instances, balancers=elbs, tags=tags)
+
+        if zone:
+            for n in range(len(records), zone_records):
+                records.append(('host%06d.%s' % (n, zone), 'A',
+                                '10.%d.%d.%d' % ((n >> 16) & 255,
+                                                 (n >> 8) & 255, n & 255)))
+            self.add_zone(zone, records)
+
+    #
+    # boto model objects
+    #
+
+    def boto_group(self, r, g, now):
+        a = AutoScalingGroup(name=g.name, launch_config=g.config,
+                             availability_zones=g.zones,
+                             load_balancers=g.balancers,
+                             health_check_type='ELB',
+                             health_check_period=300,
+                             vpc_zone_identifier=[g.subnets[z]
+                                                  for z in g.zones],
+                             desired_capacity=g.desired,
+                             min_size=g.min_size, max_size=g.max_size)
+        a.autoscaling_group_arn = 'arn:aws:autoscaling:%s:%s:' \
+            'autoScalingGroup:%s' % (r.name, ACCOUNT_ID, g.name)
+        a.suspended_processes = list()
+        a.tags = list()
+        for k, v in sorted(g.tags.iteritems()):
+            a.tags.append(Tag(key=k, value=v, resource_id=g.name))
+        a.instances = list()
+        for iid in g.instances:
+            inst = r.instances[iid]
+            i = GroupInstance()
+            i.instance_id = iid
+            i.group_name = g.name
+            i.health_status = 'Healthy'
+            i.lifecycle_state = self.group_state(r, inst, now)
+            i.launch_config_name = inst.config
+            i.availability_zone = inst.zone
+            a.instances.append(i)
+        return a
+
+    def boto_instance(self, r, inst, now):
+        i = Instance()
+        i.id = inst.id
+        i.image_id = inst.image
+        i.instance_type = r.configs[inst.config].instance_type \
+            if inst.config in r.configs else 'm3.medium'
+        i.key_name = 'billow'
+        i.architecture = 'x86_64'
+        i.virtualization_type = 'hvm'
+        i.ebs_optimized = False
+        i.launch_time = timestamp(inst.launched)
+        i._state = InstanceState(*self.instance_state(r, inst, now))
+        i.subnet_id = inst.subnet
+        i.vpc_id = 'vpc-00000001'
+        i.private_ip_address = inst.private_ip
+        i.private_dns_name = 'ip-%s.ec2.internal' % \
+            inst.private_ip.replace('.', '-')
+        i.public_dns_name = ''
+        i.ip_address = None
+        i.tags = {'aws:autoscaling:groupName': inst.group}
+        i.groups = list()
+        for sg in r.configs[inst.config].security_groups \
+                if inst.config in r.configs else []:
+            grp = Group()
+            grp.id = sg
+            grp.name = r.sgroups[sg][0] if sg in r.sgroups else sg
+            i.groups.append(grp)
+
+        n = NetworkInterface()
+        n.id = 'eni-%s' % inst.id[2:]
+        n.subnet_id = inst.subnet
+        n.vpc_id = i.vpc_id
+        n.private_ip_address = inst.private_ip
+        n.source_dest_check = True
+        n.ipOwnerId = 'amazon'
+        n.privateDnsName = i.private_dns_name
+        n.private_ip_addresses = [PrivateIPAddress(
+            private_ip_address=inst.private_ip, primary=True)]
+        for ip in inst.secondary:
+            n.private_ip_addresses.append(PrivateIPAddress(
+                private_ip_address=ip, primary=False))
+        n.attachment = Attachment()
+        n.attachment.id = 'eni-attach-%s' % inst.id[2:]
+        n.attachment.instance_id = inst.id
+        i.interfaces = [n]
+        return i
+
+    def boto_balancer(self, r, b):
+        lb = LoadBalancer(name=b.name)
+        lb.dns_name = '%s.%s.elb.amazonaws.com' % (b.name, r.name)
+        lb.availability_zones = list(b.zones)
+        lb.subnets = list(b.subnets)
+        lb.security_groups = list(b.security_groups)
+        lb.scheme = 'internet-facing'
+        lb.health_check = HealthCheck(access_point=b.name,
+                                      interval=b.interval,
+                                      target='HTTP:80/health',
+                                      healthy_threshold=b.healthy,
+                                      timeout=b.timeout,
+                                      unhealthy_threshold=b.unhealthy)
+        lb.policies = Policies()
+        lb.policies.app_cookie_stickiness_policies = None
+        lb.policies.lb_cookie_stickiness_policies = None
+        lb.policies.other_policies = list()
+        lb.listeners = [Listener(load_balancer=lb, load_balancer_port=80,
+                                 instance_port=80, protocol='HTTP',
+                                 instance_protocol='HTTP')]
+        lb.instances = list()
+        return lb
+
+    def boto_sgroup(self, r, sgid):
+        name, rules = r.sgroups[sgid]
+        sg = SecurityGroup(owner_id=ACCOUNT_ID, name=name, id=sgid,
+                           description=name)
+        sg.vpc_id = 'vpc-00000001'
+        for prot, from_port, to_port, source in rules:
+            p = IPPermissions(sg)
+            p.ip_protocol = prot
+            p.from_port = str(from_port)
+            p.to_port = str(to_port)
+            grant = GroupOrCIDR(p)
+            if source.startswith('sg-'):
+                grant.group_id = source
+                grant.owner_id = ACCOUNT_ID
+            else:
+                grant.cidr_ip = source
+            p.grants.append(grant)
+            sg.rules.append(p)
+        return sg
+
+
+class simconnection(object):
+
+    """
+    Base for the simulated connections.  host names the API family the same
+    way the real endpoints do, so rate limiting and statistics key the same.
+    """
+
+    endpoint = None
+
+    def __init__(self, sim, region):
+        self.sim = sim
+        self.region_name = region
+        self.aws_access_key_id = 'simulated'
+        if region:
+            self.host = '%s.%s.amazonaws.com' % (self.endpoint, region)
+        else:
+            self.host = '%s.amazonaws.com' % self.endpoint
+
+    def call(self):
+        return self.sim.call(self.region_name)
+
+    def now(self):
+        return self.sim.clock.time()
+
+
+class simautoscale(simconnection):
+
+    endpoint = 'autoscaling'
+
+    def get_all_groups(self, names=None, max_records=None, next_token=None):
+        with self.call() as r:
+            if names:
+                found = [n for n in r.grouporder if n in set(names)]
+            else:
+                found = r.grouporder
+            rs = page(found, next_token, max_records or 50)
+            now = self.now()
+            rs[:] = [self.sim.boto_group(r, r.groups[n], now) for n in rs]
+            return rs
+
+    def get_all_tags(self, filters=None, max_records=None, next_token=None):
+        with self.call() as r:
+            filters = filters or dict()
+
+            def matches(k, v):
+                want = filters.get(k)
+                if want is None:
+                    return True
+                if isinstance(want, list):
+                    return v in want
+                return v == want
+
+            tags = list()
+            for n in r.grouporder:
+                if not matches('auto-scaling-group', n):
+                    continue
+                for k, v in sorted(r.groups[n].tags.iteritems()):
+                    if matches('key', k) and matches('value', v):
+                        tags.append(Tag(key=k, value=v, resource_id=n))
+            return page(tags, next_token, max_records or 100)
+
+    def get_all_launch_configurations(self, names=None, max_records=None,
+                                      next_token=None):
+        with self.call() as r:
+            if names:
+                found = [n for n in r.configorder if n in set(names)]
+            else:
+                found = r.configorder
+            rs = page(found, next_token, max_records or 50)
+            rs[:] = [r.configs[n] for n in rs]
+            return rs
+
+    def get_all_activities(self, autoscale_group, activity_ids=None,
+                           max_records=None, next_token=None):
+        with self.call() as r:
+            name = getattr(autoscale_group, 'name', autoscale_group)
+            if name not in r.groups:
+                raise error(400, 'ValidationError', 'group not found')
+            return page(r.groups[name].activities, next_token,
+                        max_records or 100)
+
+    def terminate_instance(self, instance_id, decrement_capacity=True):
+        with self.call() as r:
+            inst = r.instances.get(instance_id)
+            if not inst or inst.terminating is not None:
+                raise error(400, 'ValidationError',
+                            'Instance Id not found - No managed instance '
+                            'found for instance ID %s' % instance_id)
+            g = r.groups[inst.group]
+            now = self.now()
+            if decrement_capacity:
+                if g.desired <= g.min_size:
+                    raise error(400, 'ValidationError',
+                                'Currently, desiredSize equals minSize')
+                g.desired -= 1
+            a = self.sim.terminate(r, g, inst, now)
+            self.sim.reconcile(r, g, now)
+            return a
+
+    def set_desired_capacity(self, group_name, desired_capacity,
+                             honor_cooldown=False):
+        with self.call() as r:
+            g = r.groups.get(group_name)
+            if not g:
+                raise error(400, 'ValidationError', 'group not found')
+            if desired_capacity < g.min_size or \
+                    desired_capacity > g.max_size:
+                raise error(400, 'ValidationError',
+                            'New SetDesiredCapacity value %d is outside '
+                            'the group bounds' % desired_capacity)
+            g.desired = desired_capacity
+            self.sim.reconcile(r, g, self.now())
+            return True
+
+
+class simec2(simconnection):
+
+    endpoint = 'ec2'
+
+    def get_all_reservations(self, instance_ids=None, filters=None,
+                             dry_run=False, max_results=None,
+                             next_token=None):
+        with self.call() as r:
+            if instance_ids:
+                for i in instance_ids:
+                    if i not in r.instances:
+                        raise error(400, 'InvalidInstanceID.NotFound',
+                                    'The instance ID %s does not exist' % i)
+                ids = instance_ids
+            else:
+                ids = sorted(r.instances)
+            rs = page(ids, next_token, max_results or 1000)
+            now = self.now()
+            reservations = list()
+            for iid in rs:
+                res = Reservation()
+                res.id = 'r-%s' % iid[2:]
+                res.owner_id = ACCOUNT_ID
+                res.instances = [self.sim.boto_instance(
+                    r, r.instances[iid], now)]
+                reservations.append(res)
+            rs[:] = reservations
+            return rs
+
+    def get_all_instance_status(self, instance_ids=None, max_results=None,
+                                next_token=None, filters=None,
+                                dry_run=False, include_all_instances=False):
+        with self.call() as r:
+            ids = instance_ids or sorted(r.instances)
+            rs = page([i for i in ids if i in r.instances], next_token,
+                      max_results or 1000)
+            now = self.now()
+            statuses = list()
+            for iid in rs:
+                inst = r.instances[iid]
+                code, name = self.sim.instance_state(r, inst, now)
+                s = InstanceStatus(id=iid, zone=inst.zone, state_code=code,
+                                   state_name=name)
+                ok = 'ok' if name == 'running' else 'initializing'
+                s.system_status = Status(ok, {'reachability': 'passed'})
+                s.instance_status = Status(ok, {'reachability': 'passed'})
+                s.events = None
+                statuses.append(s)
+            rs[:] = statuses
+            return rs
+
+    def get_all_images(self, image_ids=None, owners=None,
+                       executable_by=None, filters=None, dry_run=False):
+        with self.call() as r:
+            pattern = None
+            if isinstance(filters, dict):
+                pattern = filters.get('name')
+            images = ResultSet()
+            for ami, name, description in r.images:
+                if image_ids and ami not in image_ids:
+                    continue
+                if pattern and not fnmatch.fnmatch(name, pattern):
+                    continue
+                i = Image()
+                i.id = ami
+                i.name = name
+                i.description = description
+                images.append(i)
+            return images
+
+    def get_all_security_groups(self, groupnames=None, group_ids=None,
+                                filters=None, dry_run=False):
+        with self.call() as r:
+            if group_ids:
+                for sgid in group_ids:
+                    if sgid not in r.sgroups:
+                        raise error(400, 'InvalidGroup.NotFound',
+                                    'The security group %s does not exist'
+                                    % sgid)
+                ids = group_ids
+            else:
+                ids = sorted(r.sgroups)
+            name = (filters or dict()).get('group-name')
+            sgroups = ResultSet()
+            for sgid in ids:
+                if name and r.sgroups[sgid][0] != name:
+                    continue
+                if groupnames and r.sgroups[sgid][0] not in groupnames:
+                    continue
+                sgroups.append(self.sim.boto_sgroup(r, sgid))
+            return sgroups
+
+    def get_all_subnets(self, subnet_ids=None, filters=None, dry_run=False):
+        with self.call() as r:
+            subnets = ResultSet()
+            for sid in subnet_ids or sorted(r.subnets):
+                if sid not in r.subnets:
+                    raise error(400, 'InvalidSubnetID.NotFound',
+                                'The subnet ID %s does not exist' % sid)
+                s = Subnet()
+                s.id = sid
+                s.cidr_block, s.availability_zone = r.subnets[sid]
+                s.vpc_id = 'vpc-00000001'
+                subnets.append(s)
+            return subnets
+
+    def get_all_addresses(self, addresses=None, filters=None,
+                          allocation_ids=None, dry_run=False):
+        with self.call() as r:
+            found = ResultSet()
+            for ip in addresses or sorted(r.addresses):
+                if ip in r.addresses:
+                    found.append(r.addresses[ip])
+            return found
+
+    def associate_address(self, instance_id=None, public_ip=None,
+                          allocation_id=None, network_interface_id=None,
+                          private_ip_address=None,
+                          allow_reassociation=False, dry_run=False):
+        with self.call() as r:
+            for a in r.addresses.values():
+                if a.allocation_id == allocation_id:
+                    a.instance_id = instance_id
+                    a.network_interface_id = network_interface_id
+                    a.association_id = self.sim.newid('eipassoc')
+                    return True
+            raise error(400, 'InvalidAllocationID.NotFound',
+                        'allocation %s not found' % allocation_id)
+
+    def disassociate_address(self, public_ip=None, association_id=None,
+                             dry_run=False):
+        with self.call() as r:
+            for a in r.addresses.values():
+                if a.association_id == association_id:
+                    a.instance_id = None
+                    a.network_interface_id = None
+                    a.association_id = None
+            return True
+
+    def __eni_instance(self, r, network_interface_id):
+        iid = 'i-%s' % network_interface_id[4:]
+        if iid not in r.instances:
+            raise error(400, 'InvalidNetworkInterfaceID.NotFound',
+                        'interface %s not found' % network_interface_id)
+        return r.instances[iid]
+
+    def assign_private_ip_addresses(self, network_interface_id=None,
+                                    private_ip_addresses=None,
+                                    secondary_private_ip_address_count=None,
+                                    allow_reassignment=False, dry_run=False):
+        with self.call() as r:
+            inst = self.__eni_instance(r, network_interface_id)
+            for ip in private_ip_addresses or list():
+                for other in r.instances.values():
+                    if ip in other.secondary and not allow_reassignment:
+                        raise error(400, 'InvalidParameterValue',
+                                    'address %s in use' % ip)
+                inst.secondary.append(ip)
+            return True
+
+    def unassign_private_ip_addresses(self, network_interface_id=None,
+                                      private_ip_addresses=None,
+                                      dry_run=False):
+        with self.call() as r:
+            inst = self.__eni_instance(r, network_interface_id)
+            if not isinstance(private_ip_addresses, list):
+                private_ip_addresses = [private_ip_addresses]
+            for ip in private_ip_addresses:
+                if ip in inst.secondary:
+                    inst.secondary.remove(ip)
+            return True
+
+
+class simelb(simconnection):
+
+    endpoint = 'elasticloadbalancing'
+
+    def __balancer(self, r, name):
+        if name not in r.balancers:
+            raise error(400, 'LoadBalancerNotFound',
+                        'Cannot find Load Balancer %s' % name)
+        return r.balancers[name]
+
+    def get_all_load_balancers(self, load_balancer_names=None, marker=None):
+        with self.call() as r:
+            if load_balancer_names:
+                for n in load_balancer_names:
+                    self.__balancer(r, n)
+                names = load_balancer_names
+            else:
+                names = r.balancerorder
+            rs = page(names, marker, 400, attr='next_marker')
+            rs[:] = [self.sim.boto_balancer(r, r.balancers[n]) for n in rs]
+            return rs
+
+    def get_all_lb_attributes(self, load_balancer_name):
+        with self.call() as r:
+            b = self.__balancer(r, load_balancer_name)
+            attrs = LbAttributes()
+            attrs.cross_zone_load_balancing.enabled = b.crosszone
+            attrs.connecting_settings.idle_timeout = 60
+            attrs.connection_draining.enabled = b.draining > 0
+            attrs.connection_draining.timeout = b.draining or 300
+            attrs.access_log.enabled = False
+            return attrs
+
+    def describe_instance_health(self, load_balancer_name, instances=None):
+        with self.call() as r:
+            b = self.__balancer(r, load_balancer_name)
+            now = self.now()
+            ids = instances or sorted(b.members)
+            health = ResultSet()
+            for iid in ids:
+                state = None
+                if iid in b.members:
+                    state = self.sim.balancer_state(r, b, iid, now)
+                if state is None:
+                    if instances:
+                        raise error(400, 'InvalidInstance',
+                                    'Could not find EC2 instance %s' % iid)
+                    continue
+                health.append(BalancerState(
+                    load_balancer=b.name, instance_id=iid, state=state[0],
+                    reason_code=state[1], description=state[2]))
+            return health
+
+    def register_instances(self, load_balancer_name, instances):
+        with self.call() as r:
+            b = self.__balancer(r, load_balancer_name)
+            now = self.now()
+            for iid in instances:
+                if iid not in b.members or b.members[iid][1] is not None:
+                    b.members[iid] = [now, None]
+            return sorted(b.members)
+
+    def deregister_instances(self, load_balancer_name, instances):
+        with self.call() as r:
+            b = self.__balancer(r, load_balancer_name)
+            now = self.now()
+            for iid in instances:
+                if iid in b.members and b.members[iid][1] is None:
+                    b.members[iid][1] = now
+            return sorted(b.members)
+
+
+class simzone(object):
+
+    def __init__(self, conn, name, records):
+        self.route53connection = conn
+        self.name = name
+        self.records = records
+
+    def get_records(self):
+        with self.route53connection.call():
+            rs = ResultSet()
+            for name, rtype, value in self.records:
+                if rtype == 'CNAME':
+                    rs.append(Record(name='%s.' % name, type=rtype,
+                                     resource_records=['%s.' % value]))
+                else:
+                    rs.append(Record(name='%s.' % name, type=rtype,
+                                     alias_dns_name='%s.' % value))
+            return rs
+
+
+class simroute53(simconnection):
+
+    endpoint = 'route53'
+
+    def __init__(self, sim, region):
+        simconnection.__init__(self, sim, None)
+
+    def get_zone(self, name):
+        with self.call():
+            name = name.rstrip('.')
+            if name not in self.sim.zones:
+                return None
+            return simzone(self, name, self.sim.zones[name])
+
+
+class simsts(simconnection):
+
+    endpoint = 'sts'
+
+    def assume_role(self, role_arn, role_session_name, policy=None,
+                    duration_seconds=None, external_id=None,
+                    mfa_serial_number=None, mfa_token=None):
+        with self.call():
+            c = Credentials()
+            c.access_key = self.sim.newid('ASIA')
+            c.secret_key = 'simulated'
+            c.session_token = 'simulated'
+            return AssumedRole(credentials=c)
+
+
+class simiam(simconnection):
+
+    endpoint = 'iam'
+
+    def __init__(self, sim, region):
+        simconnection.__init__(self, sim, None)
+
+    def get_user(self, user_name=None):
+        with self.call():
+            return {'get_user_response': {'get_user_result': {'user': {
+                'arn': 'arn:aws:iam::%s:user/billow' % ACCOUNT_ID}}}}
+
+
+def install(sim):
+    """
+    Serve all backend connections from a simulator, timed by its clock
+    """
+    aws.set_provider(sim)
+    aws.set_clock(sim.clock)
+    return sim
+
+
+def uninstall():
+    aws.set_provider(None)
+    aws.set_clock(None)
@@ -0,0 +1,173 @@
+"""
+billow AWS API call statistics
+
+Every call made through aws.wrap is recorded here, per operation and region.
+"""
+import json
+import sys
+import threading
+
+# Latency histogram bucket upper bounds, in seconds
+buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Process-wide statistics, keyed by (region, operation)
+operations = dict()
+operations_lock = threading.Lock()
+
+
+class opstats(object):
+
+    """
+    Counters and latency histogram for one operation in one region
+    """
+
+    def __init__(self, operation, region):
+        self.operation = operation
+        self.region = region
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.pages = 0
+        self.coalesced = 0
+        self.cached = 0
+        self.waited = 0.0
+        self.latency = 0.0
+        self.latency_max = 0.0
+        self.histogram = [0] * (len(buckets) + 1)
+
+    def call(self, latency, page=False):
+        """
+        one request sent to AWS, successful or not
+        """
+        with self.lock:
+            self.calls += 1
+            self.latency += latency
+            self.latency_max = max(self.latency_max, latency)
+            for n, b in enumerate(buckets):
+                if latency <= b:
+                    self.histogram[n] += 1
+                    break
+            else:
+                self.histogram[-1] += 1
+            if page:
+                self.pages += 1
+
+    def error(self, throttled=False):
+        with self.lock:
+            self.errors += 1
+            if throttled:
+                self.throttles += 1
+
+    def retry(self, waited=0):
+        with self.lock:
+            self.retries += 1
+            self.waited += waited
+
+    def coalesce(self):
+        """
+        call answered by an identical call already in flight
+        """
+        with self.lock:
+            self.coalesced += 1
+
+    def hit(self):
+        """
+        call answered by the inventory cache
+        """
+        with self.lock:
+            self.cached += 1
+
+    def wait(self, waited):
+        """
+        time spent waiting on the rate limiter
+        """
+        with self.lock:
+            self.waited += waited
+
+    def as_dict(self):
+        with self.lock:
+            # [upper bound in seconds, count], last bucket unbounded
+            histogram = list()
+            for n, b in enumerate(buckets):
+                histogram.append([b, self.histogram[n]])
+            histogram.append(['inf', self.histogram[-1]])
+            mean = 0.0
+            if self.calls:
+                mean = self.latency / self.calls
+            return {
+                'operation': self.operation,
+                'region': self.region,
+                'calls': self.calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'throttles': self.throttles,
+                'pages': self.pages,
+                'coalesced': self.coalesced,
+                'cached': self.cached,
+                'waited': round(self.waited, 6),
+                'latency': {
+                    'total': round(self.latency, 6),
+                    'mean': round(mean, 6),
+                    'max': round(self.latency_max, 6),
+                    'histogram': histogram
+                }
+            }
+
+
+def get(operation, region):
+    key = (region, operation)
+    with operations_lock:
+        if key not in operations:
+            operations[key] = opstats(operation, region)
+        return operations[key]
+
+
+def snapshot():
+    """
+    list of per-operation statistics, ordered by region and operation
+    """
+    with operations_lock:
+        keys = sorted(operations.keys())
+        ops = [operations[k] for k in keys]
+    return [o.as_dict() for o in ops]
+
+
+def totals():
+    """
+    counters summed over all operations and regions
+    """
+    total = {
+        'calls': 0,
+        'errors': 0,
+        'retries': 0,
+        'throttles': 0,
+        'pages': 0,
+        'coalesced': 0,
+        'cached': 0,
+        'latency': 0.0
+    }
+    for o in snapshot():
+        for k in ['calls', 'errors', 'retries', 'throttles', 'pages',
+                  'coalesced', 'cached']:
+            total[k] += o[k]
+        total['latency'] += o['latency']['total']
+    total['latency'] = round(total['latency'], 6)
+    return total
+
+
+def reset():
+    with operations_lock:
+        operations.clear()
+
+
+def dump(fp=None):
+    if not fp:
+        fp = sys.stderr
+    json.dump({'totals': totals(), 'operations': snapshot()}, fp,
+              indent=4, separators=(',', ': '), sort_keys=True)
+    fp.write('\n')
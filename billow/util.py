@@ -25,12 +25,71 @@ def common_parser(description='untitled'):
         help='ec2 regions'
     )
 
+    parser.add_argument(
+        '--stats',
+        help='dump AWS API call statistics as JSON to stderr on exit',
+        action='store_true'
+    )
+
+    cassettegroup = parser.add_mutually_exclusive_group()
+    cassettegroup.add_argument(
+        '--record',
+        metavar='CASSETTE',
+        help='record all AWS calls to a cassette file'
+    )
+    cassettegroup.add_argument(
+        '--replay',
+        metavar='CASSETTE',
+        help='replay AWS calls from a cassette file instead of AWS'
+    )
+    parser.add_argument(
+        '--replay-latency',
+        help='replayed calls take as long as when recorded',
+        action='store_true'
+    )
+
+    cachegroup = parser.add_mutually_exclusive_group()
+    cachegroup.add_argument(
+        '--no-cache',
+        help='do not use the inventory cache',
+        action='store_true'
+    )
+    cachegroup.add_argument(
+        '--refresh',
+        help='ignore cached inventory, but store what is fetched',
+        action='store_true'
+    )
+
     return parser
 
-import boto.utils
+import atexit
+from . import cache
+from . import cassette
+from . import stats
+
+
+def common_args(args, refresh=False):
+    """
+    refresh=True never serves cached inventory, for commands that change AWS
+    state and must act on what is there now
+    """
 
+    # Statistics are dumped on exit, including sys.exit() from commands
+    if args.stats:
+        atexit.register(stats.dump)
 
-def common_args(args):
+    # Cassettes are closed on exit, flushing the recording
+    if args.record:
+        cassette.use(args.record, mode='record')
+        atexit.register(cassette.stop)
+    elif args.replay:
+        cassette.use(args.replay, mode='replay', latency=args.replay_latency)
+
+    # Inventory cache, shared with other billow processes.  Cassettes must
+    # see every call, so never cache while recording or replaying.
+    if not args.no_cache and not args.record and not args.replay:
+        cache.use(refresh=refresh or args.refresh)
+        atexit.register(cache.stop)
 
     # Region setting:
     # 1. Prefer command-line --region
@@ -38,6 +97,7 @@ def common_args(args):
     # 3. Default to us-east-1
     local_region = None
     if args.auto:
+        import boto.utils
         identity = boto.utils.get_instance_identity(timeout=1, num_retries=5)
         try:
             local_region = identity['document']['region']
@@ -75,6 +135,17 @@ def cli_signal_handler(signal, frame):
 def catch_sigint():
     signal.signal(signal.SIGINT, cli_signal_handler)
 
+import os
+
+
+def cache_dir(*parts):
+    """
+    $XDG_CACHE_HOME/billow, ~/.cache/billow by default, joined with parts
+    """
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'billow', *parts)
+
 import fnmatch
 import re
 
@@ -85,3 +156,51 @@ def regex_match(match, string, use_regex):
     elif fnmatch.fnmatch(string, match):
         return True
     return False
+
+import json
+
+
+def yaml_dump(output):
+    """
+    yaml is slow to import, only -y pays for it
+    """
+    import yaml
+    return yaml.safe_dump(output, encoding='utf-8', allow_unicode=True)
+
+
+def print_ndjson(record):
+    """
+    one JSON record per line, flushed so readers see it straight away
+    """
+    sys.stdout.write(json.dumps(record, separators=(',', ':')) + '\n')
+    sys.stdout.flush()
+
+
+def service_records(info):
+    """
+    billowService.info() as separate records: the service with its
+    balancers, then each group, then each instance of the group
+    """
+    groups = info['groups']
+    service = dict(info)
+    service['groups'] = [g['name'] for g in groups]
+    service['record'] = 'service'
+    yield service
+
+    for g in groups:
+        group = dict(g)
+        instances = group.pop('instances', list())
+        group['record'] = 'group'
+        group['region'] = info['region']
+        group['service'] = info['service']
+        group['environ'] = info['environ']
+        yield group
+
+        for i in instances:
+            instance = dict(i)
+            instance['record'] = 'instance'
+            instance['region'] = info['region']
+            instance['service'] = info['service']
+            instance['environ'] = info['environ']
+            instance['group'] = g['name']
+            yield instance
@@ -4,23 +4,35 @@ billow Virtual Private Cloud API
 import billow
 from billow import aws
 import boto
-import boto.vpc
 
 
 class vpc(object):
 
     def __init__(self, region):
         self.region = region
-        self.aws = aws.aws()
+        self.aws = aws.aws(region=self.region)
         self.vpc = None
 
+        # subnet id -> Subnet, subnets are long lived
+        self.subnets = dict()
+
     def __connect(self):
         if not self.vpc:
-            self.vpc = boto.vpc.connect_to_region(
-                self.region,
-                aws_access_key_id=self.aws.access_key(),
-                aws_secret_access_key=self.aws.secret_key()
-            )
+            self.vpc = self.aws.connect('ec2')
+
+    def list_subnets(self):
+        """
+        list all Subnets in a region, caching them for subnet_name
+        """
+        self.__connect()
+
+        snets = self.aws.wrap(
+            self.vpc.get_all_subnets
+        )
+        for s in snets:
+            self.subnets[s.id] = s
+
+        return list(snets)
 
     def get_subnet(self, subnets):
         """
@@ -41,7 +53,9 @@ class vpc(object):
         return snets
 
     def subnet_name(self, subnet):
-        subnets = self.get_subnet(subnet)
-        if subnets:
-            return subnets[0].cidr_block
+        if subnet not in self.subnets:
+            for s in self.get_subnet(subnet):
+                self.subnets[s.id] = s
+        if subnet in self.subnets:
+            return self.subnets[subnet].cidr_block
         return subnet
@@ -33,7 +33,8 @@ setup(
             "billow-rotate-instance = billow.cli:billow_rotate_instance",
             "billow-rotate-register = billow.cli:billow_rotate_register",
             "billow-rotate-status= billow.cli:billow_rotate_status",
-            "billow-rotate-terminate = billow.cli:billow_rotate_terminate"
+            "billow-rotate-terminate = billow.cli:billow_rotate_terminate",
+            "billowd = billow.daemon:main"
         ]
     }
 )
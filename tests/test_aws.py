@@ -0,0 +1,355 @@
+"""
+aws.wrap's rate limiting, retry budgets, circuit breakers and coalescing of
+identical calls, and lookups split into chunks, on the simulator, on
+virtual time.
+
+    python -m unittest discover tests
+"""
+import StringIO
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from billow import asg, aws, clock, sim, stats
+from boto.exception import BotoServerError
+
+REGION = 'us-east-1'
+
+
+class flaky(sim.simconnection):
+
+    """
+    ec2 connection answering ServiceUnavailable while down
+    """
+
+    endpoint = 'ec2'
+
+    def __init__(self, s):
+        sim.simconnection.__init__(self, s, REGION)
+        self.down = True
+        self.calls = 0
+
+    def get_all_things(self):
+        with self.call():
+            self.calls += 1
+            if self.down:
+                raise sim.error(503, 'ServiceUnavailable')
+            return list()
+
+
+class stalled(sim.simconnection):
+
+    """
+    ec2 connection whose calls wait until released with a result or error
+    """
+
+    endpoint = 'ec2'
+
+    def __init__(self, s):
+        sim.simconnection.__init__(self, s, REGION)
+        self.entered = threading.Event()
+        self.released = threading.Event()
+        self.result = None
+        self.error = None
+        self.calls = 0
+
+    def get_all_things(self):
+        with self.call():
+            self.calls += 1
+        self.entered.set()
+        self.released.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class interrupt(BaseException):
+    pass
+
+
+class awstest(unittest.TestCase):
+
+    """
+    a small simulated fleet, with rate limits restored afterwards
+    """
+
+    def setUp(self):
+        self.clock = clock.virtualclock()
+        self.sim = sim.simulator(clock=self.clock, seed=1)
+        self.sim.generate(regions=[REGION], services=1, groups=1,
+                          instances=2)
+        sim.install(self.sim)
+        self.rate_limits = dict(aws.rate_limits)
+        # retries are reported on stderr
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        aws.rate_limits.clear()
+        aws.rate_limits.update(self.rate_limits)
+        sim.uninstall()
+
+
+class limitertest(awstest):
+
+    def test_burst_then_rate(self):
+        l = aws.limiter(2, 4)
+        for n in range(4):
+            self.assertEqual(l.reserve(), 0)
+        self.assertAlmostEqual(l.reserve(), 0.5)
+        self.assertAlmostEqual(l.reserve(), 1.0)
+
+    def test_refill(self):
+        l = aws.limiter(2, 4)
+        for n in range(4):
+            l.reserve()
+        self.clock.sleep(1)
+        self.assertEqual(l.reserve(), 0)
+        self.assertEqual(l.reserve(), 0)
+        self.assertAlmostEqual(l.reserve(), 0.5)
+
+    def test_refill_stops_at_burst(self):
+        l = aws.limiter(2, 4)
+        l.reserve()
+        self.clock.sleep(3600)
+        for n in range(4):
+            self.assertEqual(l.reserve(), 0)
+        self.assertAlmostEqual(l.reserve(), 0.5)
+
+    def test_penalize(self):
+        l = aws.limiter(2, 4)
+        l.penalize()
+        self.assertAlmostEqual(l.reserve(), 0.5)
+
+    def test_shared_by_backends(self):
+        # two backends in one region draw on the same autoscaling bucket
+        aws.set_rate_limit('autoscaling', 1, 2)
+        backends = [asg.asg(REGION), asg.asg(REGION)]
+        start = self.clock.time()
+        for n in range(3):
+            for b in backends:
+                b.list_configs()
+        self.assertAlmostEqual(self.clock.time() - start, 4)
+
+
+class budgettest(awstest):
+
+    def calls(self, func):
+        """
+        simulated calls func made before giving up
+        """
+        before = self.sim.calls
+        self.assertRaises(BotoServerError, func)
+        return self.sim.calls - before
+
+    def test_exhaustion(self):
+        b = asg.asg(REGION)
+        self.sim.throttle = 1
+        # attempts are capped first, then the 10 retries held in reserve
+        self.assertEqual(self.calls(b.list_configs), 8)
+        self.assertEqual(self.calls(b.list_configs), 4)
+        self.assertEqual(self.calls(b.list_configs), 1)
+
+    def test_earned_by_success(self):
+        b = asg.asg(REGION)
+        self.sim.throttle = 1
+        self.calls(b.list_configs)
+        self.calls(b.list_configs)
+        self.sim.throttle = 0
+        for n in range(10):
+            b.list_configs()
+        self.sim.throttle = 1
+        self.assertEqual(self.calls(b.list_configs), 2)
+
+    def test_per_operation(self):
+        b = asg.asg(REGION)
+        self.sim.throttle = 1
+        self.calls(b.list_configs)
+        self.calls(b.list_configs)
+        self.assertEqual(self.calls(b.list_groups), 8)
+
+
+class breakertest(awstest):
+
+    def setUp(self):
+        awstest.setUp(self)
+        self.aws = aws.aws(region=REGION, retry=aws.retrypolicy(attempts=1))
+        self.conn = flaky(self.sim)
+        self.circuit = aws.get_breaker('simulated', REGION, 'ec2')
+
+    def call(self):
+        return self.aws.wrap(self.conn.get_all_things)
+
+    def open(self):
+        for n in range(self.circuit.threshold):
+            self.assertRaises(BotoServerError, self.call)
+
+    def test_opens(self):
+        self.open()
+        self.assertRaises(aws.CircuitOpenError, self.call)
+        self.assertEqual(self.conn.calls, self.circuit.threshold)
+
+    def test_probe_success_closes(self):
+        self.open()
+        self.clock.sleep(self.circuit.cooldown)
+        self.conn.down = False
+        self.assertEqual(self.call(), [])
+        self.assertEqual(self.call(), [])
+        self.assertEqual(self.circuit.remaining(), 0)
+
+    def test_probe_failure_reopens(self):
+        self.open()
+        self.clock.sleep(self.circuit.cooldown)
+        self.assertRaises(BotoServerError, self.call)
+        self.assertRaises(aws.CircuitOpenError, self.call)
+        self.assertEqual(self.conn.calls, self.circuit.threshold + 1)
+
+    def test_single_probe(self):
+        self.open()
+        self.clock.sleep(self.circuit.cooldown)
+        self.assertEqual(self.circuit.remaining(), 0)
+        # the probe has not answered yet, everyone else fails fast
+        self.assertTrue(self.circuit.remaining() > 0)
+        self.assertTrue(self.circuit.remaining() > 0)
+        self.circuit.success()
+        self.assertEqual(self.circuit.remaining(), 0)
+
+    def test_probe_released(self):
+        self.open()
+        self.clock.sleep(self.circuit.cooldown)
+        self.assertEqual(self.circuit.remaining(), 0)
+        self.circuit.release()
+        self.assertEqual(self.circuit.remaining(), 0)
+
+    def test_lost_probe(self):
+        self.open()
+        self.clock.sleep(self.circuit.cooldown)
+        self.assertEqual(self.circuit.remaining(), 0)
+        self.clock.sleep(self.circuit.cooldown)
+        self.assertEqual(self.circuit.remaining(), 0)
+
+
+class flighttest(awstest):
+
+    followers = 4
+
+    def setUp(self):
+        awstest.setUp(self)
+        stats.reset()
+        self.aws = aws.aws(region=REGION)
+        self.conn = stalled(self.sim)
+        self.outcomes = dict()
+
+    def call(self, n):
+        try:
+            self.outcomes[n] = self.aws.wrap(self.conn.get_all_things)
+        except BaseException as e:
+            self.outcomes[n] = e
+
+    def fly(self, result=None, error=None):
+        """
+        one leader and the followers that join it, once all are waiting
+        release the leader with result or error
+        """
+        threads = [threading.Thread(target=self.call, args=(0,))]
+        threads[0].start()
+        self.assertTrue(self.conn.entered.wait(5))
+        for n in range(1, self.followers + 1):
+            threads.append(threading.Thread(target=self.call, args=(n,)))
+            threads[-1].start()
+
+        opstats = stats.get('ec2.get_all_things', REGION)
+        deadline = time.time() + 5
+        while opstats.coalesced < self.followers and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(opstats.coalesced, self.followers)
+
+        self.conn.result = result
+        self.conn.error = error
+        self.conn.released.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(self.conn.calls, 1)
+        self.assertEqual(len(self.outcomes), self.followers + 1)
+        return self.outcomes.values()
+
+    def test_result_shared(self):
+        result = ['thing']
+        for o in self.fly(result=result):
+            self.assertTrue(o is result)
+
+    def test_error_shared(self):
+        error = sim.error(400, 'InvalidParameterValue')
+        for o in self.fly(error=error):
+            self.assertTrue(o is error)
+
+    def test_interrupt_shared(self):
+        # not an Exception, followers must not take it for a None result
+        error = interrupt()
+        for o in self.fly(error=error):
+            self.assertTrue(o is error)
+
+    def test_next_call_not_coalesced(self):
+        self.fly(result=['thing'])
+        self.conn.result = ['other']
+        self.assertEqual(self.aws.wrap(self.conn.get_all_things), ['other'])
+        self.assertEqual(self.conn.calls, 2)
+
+
+class chunktest(awstest):
+
+    def setUp(self):
+        awstest.setUp(self)
+        stats.reset()
+        self.aws = aws.aws(region=REGION)
+        self.asg = asg.asg(REGION)
+        region = self.sim.region(REGION)
+        self.ids = sorted(region.instances)
+
+    def test_chunks(self):
+        self.assertEqual(aws.chunks([], 3), [])
+        self.assertEqual(aws.chunks(range(3), 3), [[0, 1, 2]])
+        self.assertEqual(aws.chunks(range(4), 3), [[0, 1, 2], [3]])
+
+    def test_chunked_order(self):
+        seen = list()
+
+        def func(chunk):
+            seen.append(chunk)
+            return [i * 2 for i in chunk]
+        self.assertEqual(self.aws.chunked(func, range(7), 3),
+                         [0, 2, 4, 6, 8, 10, 12])
+        self.assertEqual(sorted(seen), [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_chunked_error(self):
+        def func(chunk):
+            if 3 in chunk:
+                raise sim.error(400, 'InvalidInstanceID.NotFound')
+            return chunk
+        self.assertRaises(BotoServerError, self.aws.chunked, func,
+                          range(7), 3)
+
+    def lookups(self, size):
+        """
+        get_all_reservations calls made to get every instance, size per call
+        """
+        before = stats.get('ec2.get_all_reservations', REGION).calls
+        self.asg.chunk_instances = size
+        found = self.asg.get_instance(self.ids)
+        self.assertEqual(sorted(i.id for i in found), self.ids)
+        return stats.get('ec2.get_all_reservations', REGION).calls - before
+
+    def test_exactly_one_chunk(self):
+        self.assertEqual(self.lookups(len(self.ids)), 1)
+
+    def test_one_over(self):
+        self.assertEqual(self.lookups(len(self.ids) - 1), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
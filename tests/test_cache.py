@@ -0,0 +1,118 @@
+"""
+The inventory cache on the simulator, on virtual time: responses expire
+with their operation's time to live, and only a private file of the
+current user's is used.
+
+    python -m unittest discover tests
+"""
+import StringIO
+import errno
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from billow import asg, cache, clock, sim
+
+REGION = 'us-east-1'
+
+
+class cachetest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.virtualclock()
+        self.sim = sim.simulator(clock=self.clock, seed=1)
+        self.sim.generate(regions=[REGION], services=1, groups=1,
+                          instances=2)
+        sim.install(self.sim)
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'billow', 'inventory.sqlite')
+        # refusals are reported on stderr
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        cache.stop()
+        sim.uninstall()
+        shutil.rmtree(self.tmp)
+
+    def calls(self, func):
+        before = self.sim.calls
+        func()
+        return self.sim.calls - before
+
+    def test_expiry(self):
+        c = cache.cache(self.path, clock=self.clock)
+        op = 'ec2.get_all_images'
+        c.put('a', REGION, op, (), {}, ['image'])
+        self.assertEqual(c.get('a', REGION, op, (), {}), (True, ['image']))
+        self.clock.sleep(cache.ttls[op])
+        self.assertEqual(c.get('a', REGION, op, (), {}), (True, ['image']))
+        self.clock.sleep(1)
+        self.assertEqual(c.get('a', REGION, op, (), {}), (False, None))
+
+    def test_uncached_operation(self):
+        c = cache.cache(self.path, clock=self.clock)
+        c.put('a', REGION, 'ec2.get_console_output', (), {}, 'output')
+        self.assertEqual(c.get('a', REGION, 'ec2.get_console_output', (),
+                               {}), (False, None))
+
+    def test_wrapped_calls(self):
+        cache.use(self.path, clock=self.clock)
+        b = asg.asg(REGION)
+        ttl = cache.ttls['autoscaling.get_all_launch_configurations']
+        self.assertEqual(self.calls(b.list_configs), 1)
+        self.assertEqual(self.calls(b.list_configs), 0)
+        self.clock.sleep(ttl + 1)
+        self.assertEqual(self.calls(b.list_configs), 1)
+
+    def test_refresh_stores(self):
+        cache.use(self.path, refresh=True, clock=self.clock)
+        b = asg.asg(REGION)
+        self.assertEqual(self.calls(b.list_configs), 1)
+        self.assertEqual(self.calls(b.list_configs), 1)
+        cache.use(self.path, clock=self.clock)
+        self.assertEqual(self.calls(b.list_configs), 0)
+
+    def test_mutation_invalidates(self):
+        cache.use(self.path, clock=self.clock)
+        b = asg.asg(REGION)
+        b.list_configs()
+        self.assertEqual(self.calls(b.list_configs), 0)
+        group = self.sim.region(REGION).grouporder[0]
+        b.aws.wrap(b.asg.set_desired_capacity, group, 2)
+        self.assertEqual(self.calls(b.list_configs), 1)
+
+    def test_created_private(self):
+        cache.cache(self.path, clock=self.clock)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0600)
+        self.assertEqual(
+            stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode), 0700)
+
+    def test_refuses_writable(self):
+        cache.cache(self.path, clock=self.clock).close()
+        os.chmod(self.path, 0666)
+        try:
+            cache.cache(self.path, clock=self.clock)
+        except OSError as e:
+            self.assertEqual(e.errno, errno.EPERM)
+        else:
+            self.fail('cache opened a file writable by other users')
+        self.assertTrue(cache.use(self.path, clock=self.clock) is None)
+
+    def test_refuses_symlink(self):
+        os.makedirs(os.path.dirname(self.path))
+        target = os.path.join(self.tmp, 'elsewhere')
+        open(target, 'w').close()
+        os.chmod(target, 0600)
+        os.symlink(target, self.path)
+        self.assertTrue(cache.use(self.path, clock=self.clock) is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
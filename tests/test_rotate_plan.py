@@ -0,0 +1,139 @@
+"""
+Batched rotation waves and parallel rotation slots planned on the
+simulator: no wave or slot takes more than its share of a zone, a balancer
+or a group's spare capacity, and every instance is planned exactly once.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from billow import clock, sim
+from billow.billowCloud import billowCloud
+from billow.billowRotate import billowRotate
+
+REGION = 'us-east-1'
+
+
+class plantest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.virtualclock()
+        self.sim = sim.simulator(clock=self.clock, seed=1)
+        self.sim.generate(regions=[REGION], services=1, groups=2,
+                          instances=8, zones=2)
+        sim.install(self.sim)
+        self.region = self.sim.region(REGION)
+        self.rotator = self.rotate()
+        self.groups = self.rotator.service.groups
+
+    def tearDown(self):
+        sim.uninstall()
+
+    def rotate(self):
+        svc = billowCloud(regions=[REGION]).get_service('svc0000')[0]
+        r = billowRotate(svc, clock=self.clock)
+        r.set_logger(lambda msg: None)
+        return r
+
+    def zone(self, instance_id):
+        return self.region.instances[instance_id].zone
+
+    def count(self, instance_ids, key):
+        counts = dict()
+        for i in instance_ids:
+            counts[key(i)] = counts.get(key(i), 0) + 1
+        return counts
+
+    def at_max_size(self):
+        for name in self.region.grouporder:
+            g = self.region.groups[name]
+            g.max_size = g.desired
+        self.rotator = self.rotate()
+        self.groups = self.rotator.service.groups
+
+    def planned(self, slots):
+        """
+        every instance of every slot, checking none is planned twice
+        """
+        instances = [i for slot in slots for (g, part) in slot for i in part]
+        self.assertEqual(len(instances), len(set(instances)))
+        return instances
+
+    def test_batch_count(self):
+        g = self.groups[0]
+        self.assertEqual(self.rotator.batch_count(g, batch_size=3), 3)
+        self.assertEqual(self.rotator.batch_count(g, batch_percent=25), 2)
+        self.assertEqual(self.rotator.batch_count(g, batch_percent=30), 3)
+        # never past max size
+        self.assertEqual(self.rotator.batch_count(g, batch_size=100),
+                         g.max_size - g.cur_size)
+        self.at_max_size()
+        self.assertEqual(
+            self.rotator.batch_count(self.groups[0], batch_size=3), 0)
+
+    def test_zone_limits(self):
+        g = self.groups[0]
+        self.assertEqual(self.count(g.instanceids, self.zone),
+                         {REGION + 'a': 4, REGION + 'b': 4})
+        self.assertEqual(self.rotator.zone_limits(g),
+                         {REGION + 'a': 2, REGION + 'b': 2})
+
+    def test_waves(self):
+        g = self.groups[0]
+        order = [i for i in self.rotator.order() if i in g.instanceids]
+        waves = self.rotator.waves(g, order, 3)
+        self.assertEqual(sorted(i for w in waves for i in w), sorted(order))
+        limits = self.rotator.zone_limits(g)
+        for w in waves:
+            self.assertTrue(0 < len(w) <= 3)
+            for zone, n in self.count(w, self.zone).iteritems():
+                self.assertTrue(n <= limits[zone])
+            # rotation order is kept within a wave
+            self.assertEqual(w, [i for i in order if i in w])
+
+    def test_slots_per_zone(self):
+        order = self.rotator.order()
+        for k in (1, 2, 3):
+            slots = self.rotator.plan(order, max_unavailable=k)
+            self.assertEqual(sorted(self.planned(slots)), sorted(order))
+            for slot in slots:
+                ids = [i for (g, part) in slot for i in part]
+                for n in self.count(ids, self.zone).values():
+                    self.assertTrue(n <= k)
+            # both zones are used in every full slot
+            self.assertEqual(len(self.count(
+                [i for (g, part) in slots[0] for i in part], self.zone)), 2)
+
+    def test_slots_per_balancer(self):
+        order = self.rotator.order()
+        slots = self.rotator.plan(order, max_unavailable=4,
+                                  balancer_unavailable=1)
+        self.assertEqual(sorted(self.planned(slots)), sorted(order))
+        for slot in slots:
+            self.assertEqual(sum(len(part) for (g, part) in slot), 1)
+
+    def test_slots_per_group(self):
+        order = self.rotator.order()
+        slots = self.rotator.plan(order, max_unavailable=4, batch_size=1)
+        self.assertEqual(sorted(self.planned(slots)), sorted(order))
+        for slot in slots:
+            self.assertEqual(len(slot), len(self.groups))
+            for (g, part) in slot:
+                self.assertEqual(len(part), 1)
+
+    def test_slots_at_max_size(self):
+        self.at_max_size()
+        order = self.rotator.order()
+        slots = self.rotator.plan(order, max_unavailable=4)
+        self.assertEqual(sorted(self.planned(slots)), sorted(order))
+        for slot in slots:
+            for (g, part) in slot:
+                self.assertEqual(len(part), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
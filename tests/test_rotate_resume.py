@@ -0,0 +1,146 @@
+"""
+Interrupt a rotation on the simulator after each journaled phase, or when
+the group refuses to grow, and check --resume finishes it: the secondary
+private IP ends up on exactly one live instance and every group is back to
+its original size.
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from billow import clock, sim
+from billow.billowCloud import billowCloud
+from billow.billowGroup import billowGroup
+from billow.billowRotate import billowRotate
+from billow.journal import journal
+
+REGION = 'us-east-1'
+ADDRESS = '10.9.9.9'
+
+
+class interrupted(Exception):
+    pass
+
+
+class interruptingjournal(journal):
+
+    """
+    journal that stops the rotation once phase is recorded
+    """
+
+    def __init__(self, path, clock, phase):
+        journal.__init__(self, path, clock=clock)
+        self.phase = phase
+
+    def record(self, phase, instance=None, **data):
+        journal.record(self, phase, instance, **data)
+        if phase == self.phase:
+            raise interrupted(phase)
+
+
+class resumetest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.virtualclock()
+        self.sim = sim.simulator(clock=self.clock, seed=1)
+        self.sim.generate(regions=[REGION], services=1, groups=2,
+                          instances=4)
+        sim.install(self.sim)
+        self.region = self.sim.region(REGION)
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'rotate.journal')
+
+        first = self.rotator().order()[0]
+        self.region.instances[first].secondary.append(ADDRESS)
+        self.sizes = dict((g, self.region.groups[g].desired)
+                          for g in self.region.grouporder)
+
+    def tearDown(self):
+        sim.uninstall()
+        shutil.rmtree(self.tmp)
+
+    def rotator(self, j=None):
+        svc = billowCloud(regions=[REGION]).get_service('svc0000')[0]
+        r = billowRotate(svc, clock=self.clock)
+        r.set_logger(lambda msg: None)
+        if j:
+            r.set_journal(j)
+        return r
+
+    def resume(self, **kw):
+        r = self.rotator(journal(self.path, clock=self.clock))
+        start = self.clock.time()
+        self.assertTrue(r.rotate(resume=True, **kw))
+        self.assertTrue(self.clock.time() - start < 6 * 3600)
+
+        live = [i for i in self.region.instances.values()
+                if i.terminating is None]
+        self.assertEqual(len([i for i in live if ADDRESS in i.secondary]), 1)
+        for g in self.region.grouporder:
+            group = self.region.groups[g]
+            self.assertEqual(group.desired, self.sizes[g])
+            self.assertEqual(len([i for i in group.instances
+                                  if self.region.instances[i].terminating
+                                  is None]), self.sizes[g])
+
+    def interrupt(self, phase, **kw):
+        r = self.rotator(interruptingjournal(self.path, self.clock, phase))
+        self.assertRaises(interrupted, r.rotate, **kw)
+        self.resume(**kw)
+
+    def test_phases(self):
+        for phase in ['notified', 'detached', 'launching', 'launched',
+                      'reattached', 'healthy', 'terminating']:
+            self.interrupt(phase)
+            self.tearDown()
+            self.setUp()
+
+    def test_phases_batched(self):
+        for phase in ['detached', 'launching', 'launched', 'healthy']:
+            self.interrupt(phase, batch_size=2)
+            self.tearDown()
+            self.setUp()
+
+    def test_unfinished_journal(self):
+        r = self.rotator(interruptingjournal(self.path, self.clock,
+                                             'detached'))
+        self.assertRaises(interrupted, r.rotate)
+        records = journal(self.path).records()
+        r = self.rotator(journal(self.path, clock=self.clock))
+        self.assertFalse(r.rotate())
+        self.assertEqual(journal(self.path).records(), records)
+        self.resume()
+
+    def test_resume_timeout(self):
+        r = self.rotator(interruptingjournal(self.path, self.clock,
+                                             'launching'))
+        self.assertRaises(interrupted, r.rotate, batch_size=2)
+        r = self.rotator(journal(self.path, clock=self.clock))
+        start = self.clock.time()
+        r.resume(timeout=100)
+        self.assertTrue(self.clock.time() - start <= 100)
+
+    def test_increment_fails(self):
+        increment = billowGroup.increment
+
+        def failing(group, count=1):
+            billowGroup.increment = increment
+            raise interrupted('increment')
+
+        billowGroup.increment = failing
+        try:
+            r = self.rotator(journal(self.path, clock=self.clock))
+            self.assertRaises(interrupted, r.rotate)
+        finally:
+            billowGroup.increment = increment
+        self.resume()
+
+
+if __name__ == '__main__':
+    unittest.main()